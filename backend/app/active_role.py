@@ -0,0 +1,114 @@
+"""The active job role, cached by each API process and dropped when any process changes the job roles"""
+
+import select
+import threading
+import time
+from collections import namedtuple
+import psycopg2
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.models import JobRole
+
+# Channel notified on commit of a change to the job roles, listened to by every API process.
+CHANNEL = "job_roles_changed"
+
+# Seconds between two checks of the listening connection, and before listening again after losing it.
+HEARTBEAT_SECONDS = 60
+RECONNECT_SECONDS = 5
+
+# The id and name of the role, enough for the endpoints and safe to share between requests.
+ActiveRole = namedtuple("ActiveRole", ["id", "name"])
+
+
+class ActiveRoleCache:
+    """The active role of this process, read once from the database and kept until a change is notified
+
+    The role is only cached while the process listens to the notifications, so that a lost connection never serves
+    a stale role: it is read again on every request until the process listens again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The cached role in a tuple, so that None can be cached as well.
+        self.cached = None
+        self.listening = False
+        self.generation = 0
+        self.listener = None
+
+    def get(self, db: Session):
+        cached = self.cached
+        if cached:
+            return cached[0]
+
+        with self.lock:
+            generation = self.generation
+
+        role = db.query(JobRole.id, JobRole.name).filter(JobRole.is_active == True).first()
+        role = ActiveRole(role.id, role.name) if role else None
+
+        # A change notified while reading makes the role read stale.
+        with self.lock:
+            if self.listening and generation == self.generation:
+                self.cached = (role,)
+        return role
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.cached = None
+
+    def start(self, engine):
+        """Listen to the changes of the job roles from a background thread, with its own connection"""
+        if self.listener:
+            return
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self.listener = threading.Thread(target=self._listen, args=(dsn,), name="active-role", daemon=True)
+        self.listener.start()
+
+    def _set_listening(self, listening):
+        with self.lock:
+            self.listening = listening
+        self.invalidate()
+
+    def _listen(self, dsn):
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = connection.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                # The changes made before listening are not notified.
+                self._set_listening(True)
+
+                while True:
+                    if select.select([connection], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                        cursor.execute("SELECT 1")
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        connection.notifies.clear()
+                        self.invalidate()
+
+            except Exception:
+                self._set_listening(False)
+                time.sleep(RECONNECT_SECONDS)
+
+            finally:
+                if connection:
+                    connection.close()
+
+
+active_role_cache = ActiveRoleCache()
+
+
+def resolve_active_role(db: Session = Depends(get_db)):
+    """FastAPI dependency giving the active role, None if there is none"""
+    return active_role_cache.get(db)
+
+
+def notify_job_roles_changed(db: Session):
+    """Notify every API process of a change to the job roles, sent on commit of the transaction of db"""
+    db.execute(text(f"NOTIFY {CHANNEL}"))
@@ -0,0 +1,105 @@
+"""CV text extraction and keyword index of the job roles"""
+
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from pypdf import PdfReader
+
+MAX_CV_CHARACTERS = 20000
+MAX_KEYWORDS = 40
+
+# The skills of the vocabulary rank above the other frequent words of the CV.
+SKILL_WEIGHT = 3
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "about", "across", "after", "all", "also", "an", "and", "any", "are", "as", "at", "be", "been", "being",
+    "both", "but", "by", "can", "do", "during", "each", "etc", "for", "from", "had", "has", "have", "he", "her",
+    "his", "i", "in", "into", "is", "it", "its", "me", "more", "most", "my", "new", "no", "not", "of", "on",
+    "one", "or", "other", "our", "out", "over", "per", "she", "so", "such", "than", "that", "the", "their",
+    "them", "then", "there", "these", "they", "this", "those", "through", "to", "up", "us", "using", "was",
+    "we", "were", "what", "when", "where", "which", "while", "who", "will", "with", "within", "you", "your",
+    # Words found in most CVs, saying nothing about the skills.
+    "company", "curriculum", "date", "email", "experience", "january", "february", "march", "april", "may",
+    "june", "july", "august", "september", "october", "november", "december", "linkedin", "phone", "present",
+    "responsible", "responsibilities", "role", "team", "teams", "vitae", "work", "worked", "working", "year", "years",
+    "ability", "address", "based", "education", "including", "skills", "strong", "summary", "well",
+}
+
+# Skills recognized in the CVs, in their lowercase form, the phrases being matched on whole words.
+SKILLS = {
+    # Languages and frameworks
+    "angular", "bash", "c#", "c++", "django", "fastapi", "flask", "go", "golang", "graphql", "java", "javascript",
+    "kotlin", "node.js", "php", "python", "react", "ruby", "rails", "rust", "scala", "spring", "sql", "swift",
+    "typescript", "vue",
+    # Data and infrastructure
+    "airflow", "ansible", "aws", "azure", "bigquery", "data engineering", "data science", "dbt", "docker",
+    "elasticsearch", "etl", "gcp", "git", "hadoop", "kafka", "kubernetes", "linux", "machine learning", "mongodb",
+    "mysql", "nlp", "pandas", "postgresql", "pytorch", "redis", "snowflake", "spark", "tableau", "tensorflow",
+    "terraform", "power bi", "deep learning", "computer vision",
+    # Product, design and delivery
+    "agile", "analytics", "b2b", "b2c", "discovery", "figma", "jira", "kanban", "okrs", "product management",
+    "project management", "roadmap", "saas", "scrum", "stakeholder management", "user research", "ux", "ui",
+    # Business
+    "accounting", "budgeting", "crm", "excel", "financial modeling", "marketing", "salesforce", "seo", "sales",
+}
+SKILL_PHRASES = [skill for skill in SKILLS if " " in skill]
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9+#.]*[a-z0-9+#]|[a-z]")
+
+
+def extract_cv_text(path: Path) -> str:
+    """Return the text of a PDF CV, whitespace normalized and truncated"""
+    reader = PdfReader(str(path))
+    text = " ".join(page.extract_text() or "" for page in reader.pages)
+    return " ".join(text.split())[:MAX_CV_CHARACTERS]
+
+
+def get_cv_keywords(text: str) -> dict:
+    """Return the skills and the most frequent meaningful words of the CV with their weight
+
+    The weight is the frequency of the word, multiplied by SKILL_WEIGHT for the skills of the vocabulary.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    keywords = Counter(word for word in words if len(word) > 1 and word not in STOPWORDS)
+
+    for word in keywords:
+        if word in SKILLS:
+            keywords[word] *= SKILL_WEIGHT
+
+    # The phrases are counted on the words of the CV joined by single spaces.
+    joined_words = f" {' '.join(words)} "
+    for phrase in SKILL_PHRASES:
+        count = joined_words.count(f" {phrase} ")
+        if count:
+            keywords[phrase] = count * SKILL_WEIGHT
+            # The words of the phrase are not counted again on their own.
+            keywords.subtract({word: count for word in phrase.split() if word in keywords})
+
+    # The unary plus drops the words left at zero.
+    return dict((+keywords).most_common(MAX_KEYWORDS))
+
+
+def index_job_role_cv(role, upload_dir: Path) -> bool:
+    """Extract the CV text and keywords of a job role, once per uploaded file
+
+    Returns True when the role was updated, the caller commits the change.
+    """
+    storage_name = role.cv_storage_name or role.cv_filename
+    if not storage_name or role.cv_indexed_name == storage_name:
+        return False
+
+    file_path = upload_dir / storage_name
+    if not file_path.exists():
+        return False
+
+    try:
+        text = extract_cv_text(file_path)
+    except Exception as e:
+        logger.warning("Could not extract the text of %s: %s", file_path, e)
+        return False
+
+    role.cv_keywords = get_cv_keywords(text)
+    role.cv_indexed_name = storage_name
+    return True
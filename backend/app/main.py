@@ -1,16 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Header, Query
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
 from pathlib import Path
 import uuid
 import shutil
-from app.database import engine, Base, get_db
+from app.database import engine, Base, get_db, SessionLocal
+from app.active_role import ActiveRole, active_role_cache, notify_job_roles_changed, resolve_active_role
 from app.models import JobRole, JobOpportunity, Watchlist, SearchSession
+from app.cv_index import index_job_role_cv
+from app.page_types import PAGE_TYPES
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from app.search_queue import RUNNING, enqueue_search
+from app.search_metrics import LIVE_SESSION_MINUTES, render_metrics
+from app.session_events import stream_session_events
 
 # Create tables
 Base.metadata.drop_all(bind=engine)
@@ -67,6 +75,10 @@ class JobOpportunityResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class JobOpportunityPage(BaseModel):
+    items: list[JobOpportunityResponse]
+    next_cursor: Optional[str] = None
+
 class WatchlistCreate(BaseModel):
     url: str
     job_role_id: int
@@ -83,6 +95,10 @@ class WatchlistResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class WatchlistPage(BaseModel):
+    items: list[WatchlistResponse]
+    next_cursor: Optional[str] = None
+
 class SearchSessionCreate(BaseModel):
     job_role_id: int
     start_datetime: datetime
@@ -97,10 +113,25 @@ class SearchSessionResponse(BaseModel):
     end_datetime: Optional[datetime] = None
     score_threshold: int
     log_file_path: Optional[str] = None
+    status: Optional[str] = None
+    urls_total: int = 0
+    urls_done: int = 0
+    urls_failed: int = 0
+    job_descriptions_checked: int = 0
+    opportunities_found: int = 0
+    metrics: Optional[dict] = None
 
     class Config:
         from_attributes = True
 
+class SearchSessionPage(BaseModel):
+    items: list[SearchSessionResponse]
+    next_cursor: Optional[str] = None
+
+class SearchSessionQueue(BaseModel):
+    job_role_id: Optional[int] = None
+    score_threshold: int = 80
+
 # Initialize sample data
 def init_sample_data(db: Session):
     """Initialize database with sample job roles if table is empty"""
@@ -152,18 +183,79 @@ def ensure_job_role_storage_column(db: Session):
     db.execute(text("ALTER TABLE job_roles ADD COLUMN IF NOT EXISTS cv_storage_name VARCHAR(255)"))
     db.commit()
 
+def ensure_job_role_cv_columns(db: Session):
+    db.execute(text("ALTER TABLE job_roles ADD COLUMN IF NOT EXISTS cv_keywords JSON"))
+    db.execute(text("ALTER TABLE job_roles ADD COLUMN IF NOT EXISTS cv_indexed_name VARCHAR(255)"))
+    db.commit()
+
+def index_job_role_cvs(db: Session):
+    """Index the CVs uploaded before the CV index existed"""
+    for role in db.query(JobRole).all():
+        index_job_role_cv(role, UPLOAD_DIR)
+    db.commit()
+
+def ensure_watchlist_fingerprint_columns(db: Session):
+    db.execute(text("ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+    db.execute(text("ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS job_fingerprints JSON"))
+    db.execute(text("ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS etag VARCHAR(255)"))
+    db.execute(text("ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS last_modified VARCHAR(255)"))
+    db.commit()
+
+def ensure_search_session_progress_columns(db: Session):
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS status VARCHAR(50)"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS urls_total INTEGER NOT NULL DEFAULT 0"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS urls_done INTEGER NOT NULL DEFAULT 0"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS urls_failed INTEGER NOT NULL DEFAULT 0"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS job_descriptions_checked INTEGER NOT NULL DEFAULT 0"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS opportunities_found INTEGER NOT NULL DEFAULT 0"))
+    db.commit()
+
+def ensure_search_session_metrics_column(db: Session):
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS metrics JSON"))
+    db.execute(text("ALTER TABLE search_sessions ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE"))
+    db.commit()
+
+def ensure_list_indexes(db: Session):
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_job_opportunities_role_created_at ON job_opportunities (job_role_id, created_at, url)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_job_opportunities_role_status_created_at ON job_opportunities (job_role_id, status, created_at, url)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_job_opportunities_role_score ON job_opportunities (job_role_id, score, url)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_watchlist_role_created_at ON watchlist (job_role_id, created_at, url)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_search_sessions_role_start_datetime ON search_sessions (job_role_id, start_datetime, id)"))
+    db.commit()
+
+def ensure_single_active_job_role(db: Session):
+    # Keeps the first of the roles left active before the index existed.
+    db.execute(text("UPDATE job_roles SET is_active = false WHERE is_active AND id <> (SELECT min(id) FROM job_roles WHERE is_active)"))
+    db.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_job_roles_single_active ON job_roles (is_active) WHERE is_active"))
+    db.commit()
+
 # Initialize on startup
 @app.on_event("startup")
 def startup_event():
     db = next(get_db())
     ensure_job_role_storage_column(db)
+    ensure_job_role_cv_columns(db)
+    ensure_watchlist_fingerprint_columns(db)
+    ensure_search_session_progress_columns(db)
+    ensure_search_session_metrics_column(db)
+    ensure_list_indexes(db)
+    ensure_single_active_job_role(db)
     init_sample_data(db)
+    index_job_role_cvs(db)
     db.close()
+    active_role_cache.start(engine)
 
 @app.get("/")
 def read_root():
     return {"message": "My Next Job API is running!"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(db: Session = Depends(get_db)):
+    """Metrics of the search sessions in the Prometheus text format"""
+    sessions = db.query(SearchSession.id, SearchSession.log_file_path, SearchSession.status, SearchSession.heartbeat_at, SearchSession.metrics).all()
+    live_after = datetime.now(timezone.utc) - timedelta(minutes=LIVE_SESSION_MINUTES)
+    return PlainTextResponse(render_metrics(sessions, RUNNING, live_after), media_type="text/plain; version=0.0.4")
+
 # Job Role endpoints
 @app.get("/job-roles", response_model=list[JobRoleResponse])
 def get_job_roles(db: Session = Depends(get_db)):
@@ -206,6 +298,7 @@ def create_job_role(
         cv_storage_name=unique_name,
         is_active=False,
     )
+    index_job_role_cv(db_role, UPLOAD_DIR)
     db.add(db_role)
     db.commit()
     db.refresh(db_role)
@@ -239,13 +332,17 @@ def get_job_role(role_id: int, db: Session = Depends(get_db)):
 @app.put("/job-roles/{role_id}", response_model=JobRoleResponse)
 def update_job_role(role_id: int, role_update: JobRoleUpdate, db: Session = Depends(get_db)):
     """Update a job role"""
+    # Activating a role locks all of them, so that concurrent activations run one after the other.
+    if role_update.is_active is True:
+        db.query(JobRole).with_for_update().all()
     role = db.query(JobRole).filter(JobRole.id == role_id).first()
     if not role:
         raise HTTPException(status_code=404, detail="Job role not found")
     
     # If setting is_active to True, deactivate all others
     if role_update.is_active is True:
-        db.query(JobRole).update({JobRole.is_active: False})
+        db.query(JobRole).filter(JobRole.id != role_id).update({JobRole.is_active: False})
+        db.flush()
     
     if role_update.name is not None:
         role.name = role_update.name
@@ -254,7 +351,14 @@ def update_job_role(role_id: int, role_update: JobRoleUpdate, db: Session = Depe
     if role_update.is_active is not None:
         role.is_active = role_update.is_active
     
-    db.commit()
+    notify_job_roles_changed(db)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A role activated by another request since the lock, e.g. one created active.
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Another job role was activated at the same time, retry")
+    active_role_cache.invalidate()
     db.refresh(role)
     return role
 
@@ -265,19 +369,52 @@ def delete_job_role(role_id: int, db: Session = Depends(get_db)):
     if not role:
         raise HTTPException(status_code=404, detail="Job role not found")
     db.delete(role)
+    notify_job_roles_changed(db)
     db.commit()
+    active_role_cache.invalidate()
     return {"message": "Job role deleted successfully"}
 
 # Job Opportunity endpoints
 @app.get("/opportunities", response_model=list[JobOpportunityResponse])
-def get_opportunities(db: Session = Depends(get_db)):
+def get_opportunities(db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Get all opportunities for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         return []
     opportunities = db.query(JobOpportunity).filter(JobOpportunity.job_role_id == active_role.id).all()
     return opportunities
 
+@app.get("/opportunities/page", response_model=JobOpportunityPage)
+def get_opportunities_page(
+    status: Optional[str] = None,
+    min_score: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    sort: Literal["created_at", "score"] = "created_at",
+    order: Literal["asc", "desc"] = "desc",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    active_role: Optional[ActiveRole] = Depends(resolve_active_role),
+):
+    """Get a page of the opportunities for the active job role, filtered and sorted by the database"""
+    if not active_role:
+        return {"items": [], "next_cursor": None}
+
+    query = db.query(JobOpportunity).filter(JobOpportunity.job_role_id == active_role.id)
+    if status is not None:
+        query = query.filter(JobOpportunity.status == status)
+    if min_score is not None:
+        query = query.filter(JobOpportunity.score >= min_score)
+    if created_from is not None:
+        query = query.filter(JobOpportunity.created_at >= created_from)
+    if created_to is not None:
+        query = query.filter(JobOpportunity.created_at < created_to)
+
+    sort_column = JobOpportunity.score if sort == "score" else JobOpportunity.created_at
+    filters = {"job_role_id": active_role.id, "status": status, "min_score": min_score, "created_from": created_from, "created_to": created_to}
+    items, next_cursor = paginate(query, [sort_column, JobOpportunity.url], order == "desc", cursor, limit, filters)
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.post("/opportunities", response_model=JobOpportunityResponse)
 def create_opportunity(opp: JobOpportunityCreate, db: Session = Depends(get_db)):
     """Create a new job opportunity"""
@@ -296,9 +433,8 @@ def create_opportunity(opp: JobOpportunityCreate, db: Session = Depends(get_db))
     return db_opp
 
 @app.delete("/opportunities")
-def delete_all_opportunities(db: Session = Depends(get_db)):
+def delete_all_opportunities(db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Delete all opportunities for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=400, detail="No active job role found")
     
@@ -307,12 +443,11 @@ def delete_all_opportunities(db: Session = Depends(get_db)):
     return {"message": "All opportunities deleted successfully"}
 
 @app.put("/opportunities")
-def update_opportunity_status(url: str, status: str, db: Session = Depends(get_db)):
+def update_opportunity_status(url: str, status: str, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Update the status of a job opportunity"""
     if status not in ["New", "Ignore"]:
         raise HTTPException(status_code=400, detail="Status must be either 'New' or 'Ignore'")
     
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=400, detail="No active job role found")
     
@@ -331,9 +466,8 @@ def update_opportunity_status(url: str, status: str, db: Session = Depends(get_d
     return opportunity
 
 @app.delete("/opportunities/item")
-def delete_opportunity(url: str, db: Session = Depends(get_db)):
+def delete_opportunity(url: str, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Delete a single opportunity for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=400, detail="No active job role found")
 
@@ -350,28 +484,47 @@ def delete_opportunity(url: str, db: Session = Depends(get_db)):
     return {"message": "Opportunity deleted successfully"}
 
 @app.get("/opportunities/active-role")
-def get_active_role(db: Session = Depends(get_db)):
+def get_active_role(active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Get the currently active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         return {"active_role": None}
     return {"active_role": active_role.name, "id": active_role.id}
 
 # Watchlist endpoints
 @app.get("/watchlist", response_model=list[WatchlistResponse])
-def get_watchlist(db: Session = Depends(get_db)):
+def get_watchlist(db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Get all watchlist entries for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         return []
     watchlist = db.query(Watchlist).filter(Watchlist.job_role_id == active_role.id).all()
     return watchlist
 
+@app.get("/watchlist/page", response_model=WatchlistPage)
+def get_watchlist_page(
+    page_type: Optional[str] = None,
+    order: Literal["asc", "desc"] = "desc",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    active_role: Optional[ActiveRole] = Depends(resolve_active_role),
+):
+    """Get a page of the watchlist entries for the active job role, by creation date"""
+    if not active_role:
+        return {"items": [], "next_cursor": None}
+
+    query = db.query(Watchlist).filter(Watchlist.job_role_id == active_role.id)
+    if page_type is not None:
+        query = query.filter(Watchlist.page_type == page_type)
+
+    filters = {"job_role_id": active_role.id, "page_type": page_type}
+    items, next_cursor = paginate(query, [Watchlist.created_at, Watchlist.url], order == "desc", cursor, limit, filters)
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.post("/watchlist", response_model=WatchlistResponse)
 def create_watchlist_entry(watch: WatchlistCreate, db: Session = Depends(get_db)):
     """Create a new watchlist entry"""
-    if watch.page_type not in [None, "ashbyhq"]:
-        raise HTTPException(status_code=400, detail="page_type must be null or 'ashbyhq'")
+    if watch.page_type is not None and watch.page_type not in PAGE_TYPES:
+        raise HTTPException(status_code=400, detail=f"page_type must be null or one of: {', '.join(PAGE_TYPES)}")
 
     # Check if entry already exists
     existing = db.query(Watchlist).filter(
@@ -393,9 +546,8 @@ def create_watchlist_entry(watch: WatchlistCreate, db: Session = Depends(get_db)
     return db_watch
 
 @app.delete("/watchlist")
-def delete_watchlist_entry(url: str, db: Session = Depends(get_db)):
+def delete_watchlist_entry(url: str, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Delete a watchlist entry for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=404, detail="No active job role found")
     
@@ -412,14 +564,40 @@ def delete_watchlist_entry(url: str, db: Session = Depends(get_db)):
 
 # Search Session endpoints
 @app.get("/search-sessions", response_model=list[SearchSessionResponse])
-def get_search_sessions(db: Session = Depends(get_db)):
+def get_search_sessions(db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Get all search sessions for the active job role"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         return []
     sessions = db.query(SearchSession).filter(SearchSession.job_role_id == active_role.id).all()
     return sessions
 
+@app.get("/search-sessions/page", response_model=SearchSessionPage)
+def get_search_sessions_page(
+    status: Optional[str] = None,
+    started_from: Optional[datetime] = None,
+    started_to: Optional[datetime] = None,
+    order: Literal["asc", "desc"] = "desc",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    active_role: Optional[ActiveRole] = Depends(resolve_active_role),
+):
+    """Get a page of the search sessions for the active job role, by start date"""
+    if not active_role:
+        return {"items": [], "next_cursor": None}
+
+    query = db.query(SearchSession).filter(SearchSession.job_role_id == active_role.id)
+    if status is not None:
+        query = query.filter(SearchSession.status == status)
+    if started_from is not None:
+        query = query.filter(SearchSession.start_datetime >= started_from)
+    if started_to is not None:
+        query = query.filter(SearchSession.start_datetime < started_to)
+
+    filters = {"job_role_id": active_role.id, "status": status, "started_from": started_from, "started_to": started_to}
+    items, next_cursor = paginate(query, [SearchSession.start_datetime, SearchSession.id], order == "desc", cursor, limit, filters)
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.post("/search-sessions", response_model=SearchSessionResponse)
 def create_search_session(session: SearchSessionCreate, db: Session = Depends(get_db)):
     """Create a new search session"""
@@ -435,10 +613,26 @@ def create_search_session(session: SearchSessionCreate, db: Session = Depends(ge
     db.refresh(db_session)
     return db_session
 
+@app.post("/search-sessions/queue", response_model=SearchSessionResponse)
+def queue_search_session(queue: SearchSessionQueue, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
+    """Queue a search session for the search workers, for the active job role unless another one is given"""
+    if queue.job_role_id is not None:
+        role = db.query(JobRole).filter(JobRole.id == queue.job_role_id).first()
+        if not role:
+            raise HTTPException(status_code=404, detail="Job role not found")
+    else:
+        role = active_role
+        if not role:
+            raise HTTPException(status_code=400, detail="No active job role found")
+
+    if not db.query(Watchlist).filter(Watchlist.job_role_id == role.id).count():
+        raise HTTPException(status_code=400, detail="Watchlist empty for this job role")
+
+    return enqueue_search(db, role, queue.score_threshold)
+
 @app.delete("/search-sessions/{session_id}")
-def delete_search_session(session_id: int, db: Session = Depends(get_db)):
+def delete_search_session(session_id: int, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Delete a search session"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=400, detail="No active job role found")
     
@@ -455,9 +649,8 @@ def delete_search_session(session_id: int, db: Session = Depends(get_db)):
     return {"message": "Search session deleted successfully"}
 
 @app.get("/search-sessions/{session_id}/log")
-def get_search_session_log(session_id: int, db: Session = Depends(get_db)):
+def get_search_session_log(session_id: int, db: Session = Depends(get_db), active_role: Optional[ActiveRole] = Depends(resolve_active_role)):
     """Get the log file content for a search session"""
-    active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
     if not active_role:
         raise HTTPException(status_code=400, detail="No active job role found")
     
@@ -471,7 +664,16 @@ def get_search_session_log(session_id: int, db: Session = Depends(get_db)):
     
     log_file_path = Path(session.log_file_path)
     if not log_file_path.exists():
-        raise HTTPException(status_code=404, detail="Log file does not exist")
+        # Old session logs are compressed, the browser decompresses them.
+        compressed_log_file_path = Path(f"{log_file_path}.gz")
+        if not compressed_log_file_path.exists():
+            raise HTTPException(status_code=404, detail="Log file does not exist")
+        return FileResponse(
+            path=compressed_log_file_path,
+            media_type="text/plain",
+            filename=log_file_path.name,
+            headers={"Content-Encoding": "gzip"}
+        )
     
     return FileResponse(
         path=log_file_path,
@@ -479,6 +681,36 @@ def get_search_session_log(session_id: int, db: Session = Depends(get_db)):
         filename=log_file_path.name
     )
 
+@app.get("/search-sessions/{session_id}/events")
+def get_search_session_events(session_id: int, offset: int = 0, log: bool = True, last_event_id: Optional[str] = Header(None)):
+    """Stream the log lines and the progress of a search session as server-sent events, from a byte offset of its log file"""
+    # The database session is closed before streaming, the events open their own for each poll.
+    db = SessionLocal()
+    try:
+        active_role = active_role_cache.get(db)
+        if not active_role:
+            raise HTTPException(status_code=400, detail="No active job role found")
+
+        session = db.query(SearchSession).filter(
+            SearchSession.id == session_id,
+            SearchSession.job_role_id == active_role.id
+        ).first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Search session not found")
+        log_file_path = session.log_file_path
+    finally:
+        db.close()
+
+    # A reconnecting EventSource resumes after the last event it received.
+    if last_event_id and last_event_id.isdigit():
+        offset = int(last_event_id)
+
+    return StreamingResponse(
+        stream_session_events(session_id, log_file_path, offset=max(offset, 0), include_log=log),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, JSON, Text, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.database import Base
 
 class JobRole(Base):
     __tablename__ = "job_roles"
+    __table_args__ = (
+        # A single active role, the index also serving the lookup of the active role.
+        Index("ix_job_roles_single_active", "is_active", unique=True, postgresql_where=text("is_active")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, unique=True)
@@ -13,12 +17,22 @@ class JobRole(Base):
     is_active = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # CV keywords, extracted once per uploaded file (cv_indexed_name is the file they come from).
+    cv_keywords = Column(JSON, nullable=True)
+    cv_indexed_name = Column(String(255), nullable=True)
+
     opportunities = relationship("JobOpportunity", back_populates="job_role", cascade="all, delete-orphan")
     watchlist = relationship("Watchlist", back_populates="job_role", cascade="all, delete-orphan")
     search_sessions = relationship("SearchSession", back_populates="job_role", cascade="all, delete-orphan")
 
 class JobOpportunity(Base):
     __tablename__ = "job_opportunities"
+    __table_args__ = (
+        # Keyset pagination of the opportunities of a role, by creation date (optionally for a status) or by score.
+        Index("ix_job_opportunities_role_created_at", "job_role_id", "created_at", "url"),
+        Index("ix_job_opportunities_role_status_created_at", "job_role_id", "status", "created_at", "url"),
+        Index("ix_job_opportunities_role_score", "job_role_id", "score", "url"),
+    )
 
     url = Column(String(2048), primary_key=True)
     job_role_id = Column(Integer, ForeignKey("job_roles.id", ondelete="CASCADE"), primary_key=True, nullable=False)
@@ -31,6 +45,9 @@ class JobOpportunity(Base):
 
 class Watchlist(Base):
     __tablename__ = "watchlist"
+    __table_args__ = (
+        Index("ix_watchlist_role_created_at", "job_role_id", "created_at", "url"),
+    )
 
     url = Column(String(2048), primary_key=True)
     job_role_id = Column(Integer, ForeignKey("job_roles.id", ondelete="CASCADE"), primary_key=True, nullable=False)
@@ -38,10 +55,19 @@ class Watchlist(Base):
     page_type = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Fingerprint of the last complete visit, used by the incremental search.
+    content_hash = Column(String(64), nullable=True)
+    job_fingerprints = Column(JSON, nullable=True)
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(255), nullable=True)
+
     job_role = relationship("JobRole", back_populates="watchlist")
 
 class SearchSession(Base):
     __tablename__ = "search_sessions"
+    __table_args__ = (
+        Index("ix_search_sessions_role_start_datetime", "job_role_id", "start_datetime", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     job_role_id = Column(Integer, ForeignKey("job_roles.id", ondelete="CASCADE"), nullable=False)
@@ -50,5 +76,45 @@ class SearchSession(Base):
     score_threshold = Column(Integer, nullable=False)
     log_file_path = Column(String(1024), nullable=True)
 
+    # Progress of the sessions queued from the API, updated by the search workers as their tasks finish.
+    status = Column(String(50), nullable=True)
+    urls_total = Column(Integer, nullable=False, default=0)
+    urls_done = Column(Integer, nullable=False, default=0)
+    urls_failed = Column(Integer, nullable=False, default=0)
+    job_descriptions_checked = Column(Integer, nullable=False, default=0)
+    opportunities_found = Column(Integer, nullable=False, default=0)
+
+    # Summary of the stage durations, counters and in-flight gauges of the crawl, see app.search_metrics.
+    metrics = Column(JSON, nullable=True)
+    # Refreshed while the crawl runs, a running session without a recent heartbeat was left by a crashed search.
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
     job_role = relationship("JobRole", back_populates="search_sessions")
+    tasks = relationship("SearchTask", back_populates="search_session", cascade="all, delete-orphan")
+
+class SearchTask(Base):
+    __tablename__ = "search_tasks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("search_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    url = Column(String(2048), nullable=False)
+    status = Column(String(50), nullable=False, default="queued", index=True)
+    worker = Column(String(255), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    job_descriptions = Column(Integer, nullable=False, default=0)
+    opportunities = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    search_session = relationship("SearchSession", back_populates="tasks")
+
+
+class ScoreCacheEntry(Base):
+    __tablename__ = "score_cache"
 
+    key = Column(String(64), primary_key=True)
+    score = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    last_hit = Column(DateTime(timezone=True), server_default=func.now(), index=True)
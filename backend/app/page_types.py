@@ -0,0 +1,8 @@
+"""Page types of the watchlist entries, the career pages whose jobs are listed through the API of their ATS"""
+
+# Label of each page type, by name. The searcher has a page adapter per name, the API only validates the names.
+PAGE_TYPES = {
+    "ashbyhq": "Ashby",
+    "greenhouse": "Greenhouse",
+    "lever": "Lever",
+}
@@ -0,0 +1,76 @@
+"""Keyset pagination of the list endpoints, with opaque cursors"""
+
+import base64
+import hashlib
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def get_query_key(columns, descending, filters) -> str:
+    """A hash of the sort and the filters of a query, stored in its cursors so that they are not used with another one"""
+    data = json.dumps([[str(column) for column in columns], descending, sorted((name, _to_json(value)) for name, value in (filters or {}).items())])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(values, query_key) -> str:
+    """The sort key of the last item of a page and the key of its query, as a url-safe token"""
+    data = json.dumps({"query": query_key, "values": [_to_json(value) for value in values]})
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, columns, query_key) -> list:
+    """The sort key stored in a cursor, checked against the query and the types of the sort columns"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(data, dict):
+            raise ValueError("unknown format")
+        if data.get("query") != query_key:
+            raise ValueError("it was returned for another sort or other filters")
+        values = data.get("values")
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("wrong number of values")
+
+        decoded_values = []
+        for value, column in zip(values, columns):
+            python_type = column.expression.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            if not isinstance(value, python_type):
+                raise ValueError(f"{column.key} must be a {python_type.__name__}")
+            decoded_values.append(value)
+        return decoded_values
+
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+
+def paginate(query, columns, descending, cursor, limit, filters=None) -> tuple[list, str]:
+    """One page of the query ordered by columns, the last ones making the order unique, with the cursor of the next page
+
+    The page starts right after the cursor with a row comparison, so it costs the same at any depth when an index
+    matches the filters and the columns. filters are the parameters the query is filtered by, a cursor of the same
+    columns, order and filters only being accepted.
+    """
+
+    query_key = get_query_key(columns, descending, filters)
+    if cursor:
+        key, cursor_key = tuple_(*columns), tuple_(*decode_cursor(cursor, columns, query_key))
+        query = query.filter(key < cursor_key if descending else key > cursor_key)
+
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    rows = query.limit(limit + 1).all()
+
+    # The extra row only tells whether there is a next page.
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([getattr(rows[limit - 1], column.key) for column in columns], query_key)
+    return rows[:limit], next_cursor
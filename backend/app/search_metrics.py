@@ -0,0 +1,131 @@
+"""Metrics of the search sessions, persisted as a summary on their rows and exposed in the Prometheus text format
+
+A summary is {"histograms": {stage: {"buckets": [...], "sum", "count", "p50", "p99"}}, "counters": {series: value},
+"gauges": {name: {"value", "max"}}}. The buckets count the durations up to each of HISTOGRAM_BUCKETS seconds, the
+last one counting the longer ones, and a series is a name with its labels, as in 'inference_requests{type="job_name"}'.
+
+The metrics exposed are sums over the sessions kept in the database, which go down when sessions are deleted, so they
+are all gauges: a Prometheus counter must never decrease.
+"""
+
+from bisect import bisect_left
+
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+METRIC_PREFIX = "job_search"
+
+# A running session without a heartbeat for this long is considered dead, its in-flight gauges are not reported.
+LIVE_SESSION_MINUTES = 30
+
+
+def get_series(name, labels=None) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in sorted(labels.items())) + "}"
+
+
+def get_bucket_index(seconds) -> int:
+    # The buckets include their upper bound, as the Prometheus "le" label.
+    return bisect_left(HISTOGRAM_BUCKETS, seconds)
+
+
+def get_histogram_percentile(histogram, percentile) -> float:
+    # Upper bound of the bucket holding the nearest rank, the last bound for the durations above it.
+    rank = max(1, round(percentile / 100 * histogram["count"]))
+    seen = 0
+    for index, count in enumerate(histogram["buckets"]):
+        seen += count
+        if seen >= rank:
+            return HISTOGRAM_BUCKETS[min(index, len(HISTOGRAM_BUCKETS) - 1)]
+    return 0.0
+
+
+def merge_metrics(total, metrics) -> dict:
+    """Add a summary to another one (None for an empty one), as for the tasks of a session run by several workers"""
+
+    merged = {
+        "histograms": {stage: dict(histogram) for stage, histogram in ((total or {}).get("histograms") or {}).items()},
+        "counters": dict((total or {}).get("counters") or {}),
+        "gauges": {name: dict(gauge) for name, gauge in ((total or {}).get("gauges") or {}).items()},
+    }
+
+    for stage, histogram in (metrics.get("histograms") or {}).items():
+        current = merged["histograms"].get(stage)
+        if current:
+            current["buckets"] = [count + other for count, other in zip(current["buckets"], histogram["buckets"])]
+            current["sum"] += histogram["sum"]
+            current["count"] += histogram["count"]
+            # The exact percentiles of the parts are lost, they are estimated from the buckets.
+            current["p50"] = get_histogram_percentile(current, 50)
+            current["p99"] = get_histogram_percentile(current, 99)
+        else:
+            merged["histograms"][stage] = dict(histogram)
+
+    for series, value in (metrics.get("counters") or {}).items():
+        merged["counters"][series] = merged["counters"].get(series, 0) + value
+
+    for name, gauge in (metrics.get("gauges") or {}).items():
+        current = merged["gauges"].setdefault(name, {"value": 0, "max": 0})
+        current["value"] += gauge["value"]
+        current["max"] = max(current["max"], gauge["max"])
+
+    return merged
+
+
+def render_metrics(sessions, running_status, live_after) -> str:
+    """The metrics of all the search sessions in the Prometheus text format
+
+    sessions are rows with the id, log_file_path, status, heartbeat_at and metrics of the sessions. The roles searched
+    in a single crawl share its log file and its summary, which is counted once. The in-flight gauges are those of the
+    running sessions with a heartbeat after live_after, a crashed search leaving its session running.
+    """
+
+    total = None
+    running = None
+    statuses = {}
+    crawls = set()
+    for session in sessions:
+        statuses[session.status] = statuses.get(session.status, 0) + 1
+        crawl = session.log_file_path or session.id
+        if not session.metrics or crawl in crawls:
+            continue
+        crawls.add(crawl)
+        total = merge_metrics(total, session.metrics)
+        if session.status == running_status and session.heartbeat_at and session.heartbeat_at >= live_after:
+            running = merge_metrics(running, session.metrics)
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_sessions Search sessions by status.",
+        f"# TYPE {METRIC_PREFIX}_sessions gauge",
+    ]
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        lines.append(f'{METRIC_PREFIX}_sessions{{status="{status or "unknown"}"}} {count}')
+
+    total = total or merge_metrics(None, {})
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_seconds Duration of the stages of the searches of the sessions kept, in buckets.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds gauge",
+    ]
+    for stage, histogram in sorted(total["histograms"].items()):
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS + ["+Inf"], histogram["buckets"]):
+            cumulative += count
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+    counters = {}
+    for series, value in total["counters"].items():
+        name, _, labels = series.partition("{")
+        counters.setdefault(name, []).append((f"{{{labels}" if labels else "", value))
+    for name, values in sorted(counters.items()):
+        lines += [f"# TYPE {METRIC_PREFIX}_{name} gauge"]
+        lines += [f"{METRIC_PREFIX}_{name}{labels} {value}" for labels, value in sorted(values)]
+
+    gauges = (running or {}).get("gauges") or {}
+    for name in sorted(total["gauges"]):
+        lines += [
+            f"# TYPE {METRIC_PREFIX}_{name}_in_flight gauge",
+            f"{METRIC_PREFIX}_{name}_in_flight {gauges.get(name, {}).get('value', 0)}",
+        ]
+
+    return "\n".join(lines) + "\n"
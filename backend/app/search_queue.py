@@ -0,0 +1,188 @@
+"""Postgres work queue of the search sessions started from the API, one task per watchlist URL"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.models import JobRole, SearchSession, SearchTask, Watchlist
+from app.search_metrics import merge_metrics
+
+LOG_DIR = Path(__file__).resolve().parent.parent / "logs"
+
+# Task status: queued, then running, then done or failed. A failed attempt is queued again until max_attempts, as is
+# a running task whose worker stopped renewing its lease.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Session status: queued, running once a worker claims its first task, completed once all its tasks are done or failed.
+# A search run by search_jobs.py is running then completed, or failed when the script stops on an error.
+COMPLETED = "completed"
+
+
+def enqueue_search(db: Session, role: JobRole, score_threshold: int) -> SearchSession:
+    """Create a queued search session for the role, with a task per URL of its watchlist"""
+
+    start_time = datetime.now()
+    urls = [url for url, in db.query(Watchlist.url).filter(Watchlist.job_role_id == role.id).all()]
+
+    search_session = SearchSession(
+        job_role_id=role.id,
+        start_datetime=start_time,
+        score_threshold=score_threshold,
+        status=QUEUED,
+        urls_total=len(urls),
+    )
+    db.add(search_session)
+    db.flush()
+
+    # The workers append to the log file of the session.
+    LOG_DIR.mkdir(exist_ok=True)
+    log_path = LOG_DIR / f"search_session_{start_time.strftime('%Y%m%d_%H%M%S')}_{search_session.id}.log"
+    log_path.touch()
+    search_session.log_file_path = str(log_path)
+
+    for url in urls:
+        db.add(SearchTask(session_id=search_session.id, url=url, status=QUEUED))
+    db.commit()
+    db.refresh(search_session)
+    return search_session
+
+
+def _close_session_if_done(db: Session, session_id: int):
+    # The worker finishing the last task closes the session.
+    remaining = db.query(SearchTask).filter(
+        SearchTask.session_id == session_id,
+        SearchTask.status.in_([QUEUED, RUNNING])
+    ).count()
+    if not remaining:
+        db.query(SearchSession).filter(
+            SearchSession.id == session_id,
+            SearchSession.end_datetime.is_(None)
+        ).update({SearchSession.status: COMPLETED, SearchSession.end_datetime: datetime.now()}, synchronize_session=False)
+        db.commit()
+
+
+def _fail_exhausted_tasks(db: Session, expired: datetime, max_attempts: int):
+    # A running task whose lease expired on its last attempt most likely kills its worker (out of memory, browser
+    # crash), so it is failed instead of being claimed again.
+
+    tasks = db.query(SearchTask).filter(
+        SearchTask.status == RUNNING,
+        SearchTask.started_at < expired,
+        SearchTask.attempts >= max_attempts
+    ).with_for_update(skip_locked=True).all()
+
+    for task in tasks:
+        task.status = FAILED
+        task.error = f"Worker {task.worker} lost the task on attempt {task.attempts}"
+        task.finished_at = datetime.now()
+        db.query(SearchSession).filter(SearchSession.id == task.session_id).update({
+            SearchSession.urls_done: SearchSession.urls_done + 1,
+            SearchSession.urls_failed: SearchSession.urls_failed + 1,
+        }, synchronize_session=False)
+    db.commit()
+
+    for session_id in {task.session_id for task in tasks}:
+        _close_session_if_done(db, session_id)
+
+
+def get_open_log_paths(db: Session) -> list[str]:
+    """The log files of the sessions not ended yet, queued or still written to by their searches"""
+    return [log_path for (log_path,) in db.query(SearchSession.log_file_path).filter(
+        SearchSession.end_datetime.is_(None),
+        SearchSession.log_file_path.isnot(None)
+    ).all()]
+
+
+def claim_task(db: Session, worker: str, lease_minutes: int = 30, max_attempts: int = 3):
+    """Lock the oldest queued task for this worker, or a running one whose worker stopped renewing its lease
+
+    SKIP LOCKED lets any number of workers poll the queue at the same time without waiting on each other.
+    The running tasks renew their lease with heartbeat_task, an expired lease meaning that the worker died.
+    """
+
+    expired = datetime.now() - timedelta(minutes=lease_minutes)
+    _fail_exhausted_tasks(db, expired, max_attempts)
+
+    task = db.query(SearchTask).filter(
+        or_(
+            SearchTask.status == QUEUED,
+            and_(SearchTask.status == RUNNING, SearchTask.started_at < expired, SearchTask.attempts < max_attempts)
+        )
+    ).order_by(SearchTask.id).with_for_update(skip_locked=True).first()
+
+    if not task:
+        db.commit()
+        return None
+
+    task.status = RUNNING
+    task.worker = worker
+    task.attempts += 1
+    task.started_at = datetime.now()
+    db.query(SearchSession).filter(
+        SearchSession.id == task.session_id,
+        SearchSession.status == QUEUED
+    ).update({SearchSession.status: RUNNING}, synchronize_session=False)
+    db.query(SearchSession).filter(SearchSession.id == task.session_id).update({SearchSession.heartbeat_at: task.started_at}, synchronize_session=False)
+    db.commit()
+    return task
+
+
+def heartbeat_task(db: Session, task_id: int, session_id: int, worker: str) -> bool:
+    """Renew the lease of a running task and the heartbeat of its session, returns False when it was lost to another worker"""
+
+    now = datetime.now()
+    updated = db.query(SearchTask).filter(
+        SearchTask.id == task_id,
+        SearchTask.worker == worker,
+        SearchTask.status == RUNNING
+    ).update({SearchTask.started_at: now}, synchronize_session=False)
+    if updated:
+        db.query(SearchSession).filter(SearchSession.id == session_id).update({SearchSession.heartbeat_at: now}, synchronize_session=False)
+    db.commit()
+    return bool(updated)
+
+
+def finish_task(db: Session, task: SearchTask, worker: str, job_descriptions: int, opportunities: int, error: str = None, max_attempts: int = 3, metrics: dict = None) -> bool:
+    """Record the result of a task and the progress of its session, returns False when the lease of the worker was lost"""
+
+    retry = error is not None and task.attempts < max_attempts
+    values = {
+        SearchTask.status: QUEUED if retry else FAILED if error else DONE,
+        SearchTask.error: error,
+        SearchTask.finished_at: None if retry else datetime.now(),
+        SearchTask.job_descriptions: job_descriptions,
+        SearchTask.opportunities: opportunities,
+    }
+
+    # The task may have been claimed again by another worker once its lease expired.
+    updated = db.query(SearchTask).filter(
+        SearchTask.id == task.id,
+        SearchTask.worker == worker,
+        SearchTask.status == RUNNING
+    ).update(values, synchronize_session=False)
+    if not updated:
+        db.commit()
+        return False
+
+    # The metrics of every attempt are added to the summary of the session, its row locked against the other workers.
+    if metrics:
+        search_session = db.query(SearchSession).filter(SearchSession.id == task.session_id).with_for_update().populate_existing().first()
+        if search_session:
+            search_session.metrics = merge_metrics(search_session.metrics, metrics)
+            db.flush()
+
+    db.query(SearchSession).filter(SearchSession.id == task.session_id).update({SearchSession.heartbeat_at: datetime.now()}, synchronize_session=False)
+    if not retry:
+        db.query(SearchSession).filter(SearchSession.id == task.session_id).update({
+            SearchSession.urls_done: SearchSession.urls_done + 1,
+            SearchSession.urls_failed: SearchSession.urls_failed + (1 if error else 0),
+            SearchSession.job_descriptions_checked: SearchSession.job_descriptions_checked + job_descriptions,
+            SearchSession.opportunities_found: SearchSession.opportunities_found + opportunities,
+        }, synchronize_session=False)
+    db.commit()
+
+    _close_session_if_done(db, task.session_id)
+    return True
@@ -0,0 +1,128 @@
+"""Server-sent events of a search session: the new lines of its log file and its progress counters"""
+
+import asyncio
+import gzip
+import json
+import time
+from pathlib import Path
+from app.database import SessionLocal
+from app.models import SearchSession
+from app.search_queue import QUEUED, RUNNING
+
+# The log file is read by chunks, so a client catching up on a large log never holds more than a chunk in memory.
+CHUNK_SIZE = 64 * 1024
+MAX_LINE_BYTES = 16 * 1024
+
+POLL_SECONDS = 1.0
+RETRY_MILLISECONDS = 3000
+
+# A session that ended, or whose status is known and neither queued nor running, is closed once its last lines are
+# sent. The sessions without a status (created before the status column or by POST /search-sessions) end with their
+# end_datetime only. A session whose log stays still is left to the client retry.
+END_GRACE_SECONDS = 2.0
+MAX_IDLE_SECONDS = 600.0
+
+PROGRESS_FIELDS = ["status", "urls_total", "urls_done", "urls_failed", "job_descriptions_checked", "opportunities_found"]
+
+
+def format_event(event: str, data: str, id=None) -> str:
+    """One server-sent event, its id being the byte offset of the log file to resume from"""
+    lines = [f"id: {id}"] if id is not None else []
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def _get_progress(session_id: int):
+    # A short-lived database session per poll, a stream can stay open for hours.
+    db = SessionLocal()
+    try:
+        session = db.query(SearchSession).filter(SearchSession.id == session_id).first()
+        if not session:
+            return None
+        progress = {field: getattr(session, field) for field in PROGRESS_FIELDS}
+        progress["end_datetime"] = session.end_datetime.isoformat() if session.end_datetime else None
+        return progress
+    finally:
+        db.close()
+
+
+def _open_log(log_path: Path):
+    # Old session logs are compressed, the file is kept open so that reading it by chunks doesn't decompress it again.
+    if log_path.exists():
+        return log_path.open("rb")
+    compressed_log_path = Path(f"{log_path}.gz")
+    if compressed_log_path.exists():
+        return gzip.open(compressed_log_path, "rb")
+    return None
+
+
+def _read_lines(log_file, offset: int) -> list[tuple[int, str]]:
+    # The complete lines found in the next chunk, with the offset following each of them.
+
+    log_file.seek(offset)
+    chunk = log_file.read(CHUNK_SIZE)
+
+    lines = []
+    start = 0
+    while (end := chunk.find(b"\n", start)) >= 0:
+        lines.append((offset + end + 1, chunk[start:end][:MAX_LINE_BYTES].decode("utf-8", errors="replace")))
+        start = end + 1
+
+    # A line longer than a chunk is cut, so that the stream keeps moving forward.
+    if not lines and len(chunk) == CHUNK_SIZE:
+        lines.append((offset + len(chunk), chunk[:MAX_LINE_BYTES].decode("utf-8", errors="replace")))
+
+    return lines
+
+
+async def stream_session_events(session_id: int, log_file_path, offset: int = 0, include_log: bool = True):
+    """Yield a 'log' event per new line of the session log from offset, a 'progress' event when the counters change
+    and an 'end' event once the session ended and its log was sent"""
+
+    log_path = Path(log_file_path) if log_file_path else None
+    log_file = None
+    progress = None
+    last_poll = float("-inf")
+    last_line = time.monotonic()
+
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+
+    try:
+        while True:
+
+            lines = []
+            if include_log and log_path and not log_file:
+                log_file = await asyncio.to_thread(_open_log, log_path)
+            if log_file:
+                lines = await asyncio.to_thread(_read_lines, log_file, offset)
+            for offset, line in lines:
+                yield format_event("log", line, id=offset)
+
+            now = time.monotonic()
+            if now - last_poll >= POLL_SECONDS:
+                last_poll = now
+                new_progress = await asyncio.to_thread(_get_progress, session_id)
+                if new_progress is None:
+                    yield format_event("end", json.dumps({"status": "deleted"}), id=offset)
+                    return
+                if new_progress != progress:
+                    progress = new_progress
+                    yield format_event("progress", json.dumps(progress), id=offset)
+
+            if lines:
+                last_line = now
+                continue
+
+            ended = progress["end_datetime"] or progress["status"] not in (None, QUEUED, RUNNING)
+            if ended and now - last_line >= END_GRACE_SECONDS:
+                yield format_event("end", json.dumps(progress), id=offset)
+                return
+            if now - last_line >= MAX_IDLE_SECONDS:
+                return
+
+            await asyncio.sleep(POLL_SECONDS)
+
+    finally:
+        if log_file:
+            log_file.close()
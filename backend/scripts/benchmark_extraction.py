@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Extraction Benchmark Script - Compares the parse time and the useful text kept by the text extractors on saved pages.
+
+Usage:
+    python scripts/benchmark_extraction.py
+    python scripts/benchmark_extraction.py --fixtures path/to/pages --max-characters 2000
+"""
+
+import os
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+import click
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from searcher import Logger
+from searcher.text_extractor import LxmlTextExtractor, SoupTextExtractor
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "extraction"
+
+WORD_PATTERN = re.compile(r"\w+")
+
+EXTRACTORS = [
+    ("html.parser, whole page", SoupTextExtractor()),
+    ("lxml, whole page", LxmlTextExtractor(main_content=False)),
+    ("lxml, main content", LxmlTextExtractor()),
+]
+
+
+def get_words(text) -> Counter:
+    return Counter(word.lower() for word in WORD_PATTERN.findall(text))
+
+
+def get_fixtures(fixtures_dir):
+    # Each saved page <name>.html comes with the text of its job description in <name>.txt.
+    fixtures = []
+    for html_path in sorted(Path(fixtures_dir).glob("*.html")):
+        reference_path = html_path.with_suffix(".txt")
+        if reference_path.exists():
+            fixtures.append((html_path.stem, html_path.read_text(encoding="utf-8"), get_words(reference_path.read_text(encoding="utf-8"))))
+    return fixtures
+
+
+def run(extractor, html_content, max_characters, repeat):
+    # Best time of the runs, the text being the same for each of them.
+    best_seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text_content = extractor.get_text(html_content, max_characters)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return best_seconds, text_content
+
+
+@click.command()
+@click.option('--fixtures', '-f', 'fixtures_dir', default=str(FIXTURES_DIR), type=click.Path(exists=True, file_okay=False),
+              help='Directory of saved pages, <name>.html with the text of its job description in <name>.txt (default: scripts/fixtures/extraction)')
+@click.option('--max-characters', '-m', default=int(os.environ.get("MAX_CHARACTERS_FOR_CAREER_PAGE_ANALYSIS", 6000)), type=int,
+              help='Characters of text given to the model, as in search_jobs.py (default: MAX_CHARACTERS_FOR_CAREER_PAGE_ANALYSIS or 6000)')
+@click.option('--repeat', '-r', default=20, type=int,
+              help='Runs of each extractor on each page, the best time is kept (default: 20)')
+def benchmark_extraction(fixtures_dir, max_characters, repeat):
+
+    logger = Logger()
+    fixtures = get_fixtures(fixtures_dir)
+    if not fixtures:
+        logger.write(f"No saved page with its reference text found in {fixtures_dir}")
+        return
+
+    logger.write("=" * 80)
+    logger.write(f"EXTRACTION BENCHMARK ({len(fixtures)} pages, {max_characters} characters)")
+    logger.write("=" * 80)
+
+    for name, extractor in EXTRACTORS:
+
+        total_seconds = 0.0
+        useful_words = 0
+        extracted_words = 0
+        reference_words = 0
+        for fixture_name, html_content, reference in fixtures:
+            seconds, text_content = run(extractor, html_content, max_characters, repeat)
+            words = get_words(text_content)
+            useful = sum((words & reference).values())
+            total_seconds += seconds
+            useful_words += useful
+            extracted_words += sum(words.values())
+            reference_words += sum(reference.values())
+            logger.write(f"  {name} - {fixture_name}: {seconds * 1000:.2f} ms, {useful}/{sum(reference.values())} words of the job description, {sum(words.values())} words extracted")
+
+        # Yield is the share of the job description kept, precision the share of the text given to the model that is useful.
+        logger.write(f"{name}: {total_seconds * 1000:.2f} ms, yield {useful_words / reference_words:.0%}, precision {useful_words / extracted_words if extracted_words else 0.0:.0%}")
+
+
+if __name__ == '__main__':
+    benchmark_extraction()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Inference Benchmark Script - Compares the prompt cache reuse of the inference servers with and without prefix grouping.
+
+The strategies run in a random order, the slots of the llama.cpp servers being erased before each run so that a run
+does not start with the prompt cache warmed by the previous one.
+
+Usage:
+    python scripts/benchmark_inference.py
+    python scripts/benchmark_inference.py --requests 40 --inference-endpoints endpoints.json --seed 7
+"""
+
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+import click
+import requests
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from searcher import ContentAnalyser, InferenceRouter, JobDescription, Logger
+
+ROLES = [
+    SimpleNamespace(id=1, name="Senior Product Manager", cv_keywords={"product": 9, "roadmap": 5, "discovery": 4, "saas": 3, "b2b": 3}),
+    SimpleNamespace(id=2, name="Backend Engineer - Python & PostgreSQL", cv_keywords={"python": 9, "postgresql": 6, "fastapi": 4, "docker": 3, "aws": 3}),
+]
+
+JOB_NAMES = [
+    "Product Manager, Growth", "Senior Software Engineer, Platform", "Group Product Manager", "Staff Backend Engineer",
+    "Data Engineer", "Technical Program Manager", "Engineering Manager, Payments", "Product Designer",
+    "Site Reliability Engineer", "Head of Product", "Solutions Architect", "Backend Engineer, Python",
+]
+
+JOB_TEXT = (
+    "We are looking for someone to join our team and own a critical part of our platform. "
+    "You will work with engineering, design and go-to-market teams, define the roadmap, write clear specs, "
+    "ship iteratively and measure the impact. Requirements: 5+ years of relevant experience, strong written "
+    "communication, experience with B2B SaaS, data driven decision making, Python and SQL are a plus. "
+)
+
+
+def get_workload(requests_per_role):
+    # One job name and one full job description request per job, for each role.
+    jobs = [
+        JobDescription(description=JOB_NAMES[index % len(JOB_NAMES)], url=f"https://example.com/jobs/{index}", text_content=f"{JOB_NAMES[index % len(JOB_NAMES)]}. {JOB_TEXT * 4}")
+        for index in range(requests_per_role)
+    ]
+    return [(role, type, job) for job in jobs for role in ROLES for type in ["job_name", "full_job_description"]]
+
+
+def erase_slots(logger, router) -> bool:
+    # Erases the prompt cache of every slot of the llama.cpp servers, returns False when a server does not allow it.
+    erased = True
+    for endpoint in router.endpoints:
+        url_parts = urlsplit(endpoint.client.inference_url)
+        slots_url = f"{url_parts.scheme}://{url_parts.netloc}/slots"
+        try:
+            response = requests.get(slots_url, timeout=10)
+            response.raise_for_status()
+            for slot in response.json():
+                requests.post(f"{slots_url}/{slot['id']}", params={"action": "erase"}, timeout=10).raise_for_status()
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.write(f"WARNING: Could not erase the slots of {endpoint.client.inference_url} ({str(e)}), the run may reuse the prompt cache of the previous one.")
+            erased = False
+    return erased
+
+
+def run(content_analyser, workload):
+    start = time.perf_counter()
+    for role, type, job_description in workload:
+        if type == "job_name":
+            content_analyser.get_score_for_job_name(job_description, role)
+        else:
+            content_analyser.get_score_for_full_job_description(job_description, role)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option('--requests', '-r', default=20, type=int,
+              help='Jobs scored per role, each with a job name and a full job description request (default: 20)')
+@click.option('--inference-endpoints', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='JSON file listing the inference servers, as in search_jobs.py (default: INFERENCE_URL only)')
+@click.option('--seed', default=None, type=int,
+              help='Seed of the random order of the strategies (default: random)')
+def benchmark_inference(requests, inference_endpoints, seed):
+
+    logger = Logger()
+    workload = get_workload(requests)
+
+    # Page order interleaves the roles and the scoring types, grouped order sends the requests of a prefix together.
+    strategies = [
+        ("page order, no affinity", workload, False),
+        ("grouped by prefix, pinned", sorted(workload, key=lambda item: (item[0].id, item[1])), True),
+    ]
+    # A fixed order would always give the second strategy the server state left by the first one.
+    random.Random(seed).shuffle(strategies)
+
+    results = []
+    for name, ordered_workload, prefix_affinity in strategies:
+
+        router = InferenceRouter.from_config(logger, inference_endpoints, default_url=os.environ.get("INFERENCE_URL"), default_model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"),
+                                             timeout=int(os.environ.get("INFERENCE_TIMEOUT", 120)), prefix_affinity=prefix_affinity)
+        cold = erase_slots(logger, router)
+        content_analyser = ContentAnalyser(logger, router, model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"), max_characters_for_career_page_analysis=int(os.environ.get("MAX_CHARACTERS_FOR_CAREER_PAGE_ANALYSIS", 6000)))
+
+        try:
+            duration = run(content_analyser, ordered_workload)
+        finally:
+            router.close()
+
+        clients = [endpoint.client for endpoint in router.endpoints]
+        prompt_tokens = sum(client.prompt_tokens for client in clients)
+        cached_prompt_tokens = sum(client.cached_prompt_tokens for client in clients)
+        first_token_calls = sum(client.first_token_calls for client in clients)
+        first_token_seconds = sum(client.first_token_seconds for client in clients)
+        results.append((name, len(ordered_workload), duration, cached_prompt_tokens / prompt_tokens if prompt_tokens else 0.0, first_token_seconds / first_token_calls if first_token_calls else 0.0, cold))
+
+    logger.write("=" * 80)
+    logger.write("INFERENCE BENCHMARK")
+    logger.write("=" * 80)
+    for name, calls, duration, hit_rate, first_token_seconds, cold in results:
+        logger.write(f"{name}: {calls} calls in {duration:.2f} seconds, prompt cache hit rate {hit_rate:.0%}, {first_token_seconds:.3f} seconds to first token{'' if cold else ' (prompt cache not erased before the run)'}")
+    logger.write("Prompt cache hits and time to first token come from the llama.cpp 'timings' of each answer.")
+
+
+if __name__ == '__main__':
+    benchmark_inference()
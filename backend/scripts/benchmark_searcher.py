@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Searcher Benchmark Script - Replays a recorded crawl against the stub inference server and reports the searcher throughput.
+
+Record a crawl once with search_jobs.py --crawl-archive, then compare changes of the searcher on the same pages,
+without the network or a model. The benchmark runs in a throwaway schema of the database, dropped at the end:
+
+Usage:
+    python scripts/benchmark_searcher.py --archive archives/crawl
+    python scripts/benchmark_searcher.py --archive archives/crawl --concurrency 8 --latency-ms 200 --token-ms 20
+"""
+
+import asyncio
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+import click
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import DATABASE_URL, Base
+from app.models import JobRole, Watchlist
+from searcher import JobSearcher, BrowserPool, AsyncBrowserPool, CrawlArchive, InferenceRouter, Logger, ScoreCache
+from searcher.search_metrics import STAGES
+from stub_inference_server import StubInferenceServer
+
+
+def create_benchmark_engine(schema):
+    # The tables of the application in their own schema, so that the roles, opportunities and scores of the benchmark
+    # never mix with the real ones.
+    engine = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={schema}"})
+    with engine.begin() as connection:
+        connection.execute(text(f'CREATE SCHEMA "{schema}"'))
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def drop_benchmark_engine(engine, schema):
+    engine.dispose()
+    with create_engine(DATABASE_URL).begin() as connection:
+        connection.execute(text(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE'))
+
+
+def get_fetched_pages(metrics) -> int:
+    # The pages fetched over HTTP, in the browser or from the archive, not the jobs listed with their content.
+    return sum(value for series, value in metrics.counters.items() if series.partition("{")[0] == "pages_fetched")
+
+
+def run(searcher, role_id, concurrency, per_host_concurrency):
+    start = time.perf_counter()
+    if concurrency > 1:
+        asyncio.run(searcher.check_watchlist_async([role_id], concurrency, per_host_concurrency))
+    else:
+        searcher.check_watchlist([role_id])
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option('--archive', required=True, type=click.Path(exists=True, file_okay=False),
+              help='Crawl archive recorded with search_jobs.py --crawl-archive')
+@click.option('--latency-ms', default=0, type=int,
+              help='Delay of the stub inference server before each answer, in milliseconds (default: 0)')
+@click.option('--token-ms', default=0, type=int,
+              help='Delay of the stub inference server per generated token, in milliseconds (default: 0)')
+@click.option('--concurrency', '-c', default=1, type=int,
+              help='Career pages and job descriptions crawled concurrently, 1 runs sequentially (default: 1)')
+@click.option('--per-host-concurrency', default=2, type=int,
+              help='Concurrent fetches against the same host in concurrent mode (default: 2)')
+@click.option('--runs', default=2, type=int,
+              help='Replays of the crawl, the later ones with a warm score cache (default: 2)')
+@click.option('--score-threshold', '-s', default=80, type=int,
+              help='Minimum score threshold for opportunities (default: 80)')
+@click.option('--score-cache/--no-score-cache', default=True,
+              help='Reuse the scores across the runs (default: score-cache)')
+def benchmark_searcher(archive, latency_ms, token_ms, concurrency, per_host_concurrency, runs, score_threshold, score_cache):
+
+    logger = Logger()
+    crawl_archive = CrawlArchive(logger, archive)
+    recorded_watchlist = crawl_archive.get_watchlist()
+    if not recorded_watchlist:
+        logger.write(f"ERROR: No watchlist recorded in {archive}")
+        return
+
+    stub = StubInferenceServer(logger, crawl_archive, latency_ms=latency_ms, token_ms=token_ms).start()
+    schema = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+    engine = None
+    db = None
+    cache = None
+
+    results = []
+    try:
+        engine = create_benchmark_engine(schema)
+        BenchmarkSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = BenchmarkSession()
+
+        # A role watching the recorded career pages.
+        role = JobRole(name="Benchmark", cv_filename="benchmark.pdf", cv_keywords={}, is_active=False)
+        db.add(role)
+        db.commit()
+        db.refresh(role)
+
+        for entry in recorded_watchlist:
+            db.add(Watchlist(url=entry["url"], job_role_id=role.id, page_type=entry["page_type"]))
+        db.commit()
+
+        cache = ScoreCache(BenchmarkSession(), logger) if score_cache else None
+        for run_number in range(1, runs + 1):
+
+            # The browser pools are lazy, a replayed crawl never launches a browser.
+            browser_pool = AsyncBrowserPool(logger) if concurrency > 1 else BrowserPool(logger)
+            inference_client = InferenceRouter.from_config(logger, None, default_url=stub.url, default_model_name="stub", timeout=120)
+            searcher = JobSearcher(db, logger, browser_pool, inference_client, score_threshold, None, None, score_cache=cache, archive=crawl_archive)
+            calls, hits, cache_hits = stub.calls, sum(crawl_archive.hits.values()), cache.hits if cache else 0
+
+            try:
+                duration = run(searcher, role.id, concurrency, per_host_concurrency)
+            finally:
+                if concurrency == 1:
+                    browser_pool.close()
+                inference_client.close()
+
+            results.append((run_number, duration, get_fetched_pages(searcher.metrics), stub.calls - calls,
+                            (cache.hits if cache else 0) - cache_hits, sum(crawl_archive.hits.values()) - hits, searcher.metrics))
+
+    finally:
+        if cache:
+            cache.close()
+        if db:
+            db.close()
+        if engine:
+            drop_benchmark_engine(engine, schema)
+        stub.close()
+
+    logger.write("=" * 80)
+    logger.write("SEARCHER BENCHMARK")
+    logger.write("=" * 80)
+    logger.write(f"Crawl archive: {archive}, {len(recorded_watchlist)} career pages, concurrency {concurrency} (per host: {per_host_concurrency}), schema {schema} (dropped)")
+    logger.write(f"Stub inference: {latency_ms} ms per answer, {token_ms} ms per token")
+    for run_number, duration, pages, calls, cache_hits, archive_hits, metrics in results:
+        logger.write(f"Run {run_number}: {pages} pages fetched in {duration:.2f} seconds ({pages / duration if duration else 0.0:.1f} pages/second), {calls} LLM calls, {cache_hits} score cache hits, {archive_hits} archive hits")
+        for stage in STAGES:
+            if metrics.get_count(stage):
+                logger.write(f"  {stage}: p50 {metrics.get_percentile(stage, 50) * 1000:.1f} ms, p99 {metrics.get_percentile(stage, 99) * 1000:.1f} ms ({metrics.get_count(stage)} runs)")
+    # ru_maxrss is in kilobytes on Linux.
+    logger.write(f"Peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    stub.write_summary()
+
+
+if __name__ == '__main__':
+    benchmark_searcher()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 """
-Job Search Script - Searches for job opportunities matching the active role.
+Job Search Script - Searches for job opportunities matching the active role, or several roles in a single crawl.
 
 Usage:
     python scripts/search_jobs.py --score-threshold 85
     python scripts/search_jobs.py --score-threshold 90 --max-results 100
+    python scripts/search_jobs.py --role 1 --role 3
 """
 
+import asyncio
+import os
 import sys
 from pathlib import Path
 from datetime import datetime
@@ -17,7 +20,8 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from app.database import SessionLocal
 from app.models import JobRole, SearchSession
-from searcher import JobSearcher, Logger
+from app.search_queue import RUNNING, COMPLETED, FAILED, get_open_log_paths
+from searcher import JobSearcher, BrowserPool, AsyncBrowserPool, HttpFetcher, InferenceRouter, Logger, PreFilter, ScoreCache, HtmlStore, CrawlArchive, HostScheduler, TEXT_EXTRACTORS, DEFAULT_TEXT_EXTRACTOR, compress_old_logs
 
 
 @click.command()
@@ -31,7 +35,61 @@ from searcher import JobSearcher, Logger
               help='Directory to store log files (default: logs)')
 @click.option('--verbose', '-v', default='false', type=bool,
               help='Enable verbose logging (default: false)')
-def search_jobs(score_threshold, max_opportunities, max_job_descriptions, log_dir, verbose):
+@click.option('--browsers', '-b', default=1, type=int,
+              help='Number of warm Chromium instances kept for the session (default: 1)')
+@click.option('--max-navigations', '-n', default=50, type=int,
+              help='Navigations per browser context before it is recycled (default: 50)')
+@click.option('--concurrency', '-c', default=1, type=int,
+              help='Career pages and job descriptions crawled concurrently, 1 runs sequentially (default: 1)')
+@click.option('--per-host-concurrency', default=2, type=int,
+              help='Concurrent fetches against the same host in concurrent mode (default: 2)')
+@click.option('--title-batch-size', default=20, type=int,
+              help='Job names scored in a single inference request (default: 20)')
+@click.option('--title-batch-mode', default='prompt', type=click.Choice(['prompt', 'concurrent']),
+              help='Score job names with one prompt per batch or with concurrent requests (default: prompt)')
+@click.option('--score-cache-ttl', default=30, type=int,
+              help='Days a cached score is reused across sessions, 0 disables the score cache (default: 30)')
+@click.option('--score-cache-max-entries', default=100000, type=int,
+              help='Maximum number of cached scores kept in the database (default: 100000)')
+@click.option('--incremental/--full', default=False,
+              help='Only check job descriptions new or changed since the last visit (default: full)')
+@click.option('--http-fetch/--browser-only', default=True,
+              help='Fetch pages over plain HTTP first and render them in the browser only when needed (default: http-fetch)')
+@click.option('--host-rate', default=1.0, type=float,
+              help='Requests per second to a same host to start from, adapted to its answers, 0 disables the per-host scheduling (default: 1.0)')
+@click.option('--host-burst', default=3, type=int,
+              help='Requests sent to a same host without waiting, after a quiet period (default: 3)')
+@click.option('--http-min-characters', default=500, type=int,
+              help='Minimum text characters of a job description served over HTTP, shorter ones are rendered in the browser (default: 500)')
+@click.option('--pre-filter-cutoff', default=0.0, type=float,
+              help='Minimum local similarity between a job name and the role to be scored by inference, the dropped job names are logged, 0 disables the pre-filter (default: 0)')
+@click.option('--pre-filter-top-k', default=None, type=int,
+              help='Maximum number of job names per career page scored by inference (default: unlimited)')
+@click.option('--stream-inference/--no-stream-inference', default=True,
+              help='Stream the inference answers and stop reading as soon as the score is parsed (default: stream-inference)')
+@click.option('--capture-analysis', is_flag=True, default=False,
+              help='Let the model generate its full analysis after the score, logged in verbose mode (default: false)')
+@click.option('--text-extractor', default=DEFAULT_TEXT_EXTRACTOR, type=click.Choice(list(TEXT_EXTRACTORS)),
+              help=f'Extraction of the job description text given to the model, lxml keeps the main content only (default: {DEFAULT_TEXT_EXTRACTOR})')
+@click.option('--html-store', default=None, type=click.Path(file_okay=False),
+              help='Directory where the raw HTML of the fetched pages is kept gzipped, for debugging (default: not kept)')
+@click.option('--crawl-archive', default=None, type=click.Path(file_okay=False),
+              help='Directory of a crawl archive recording the pages and inference answers of the search, or replaying them offline (default: none)')
+@click.option('--crawl-archive-mode', default='record', type=click.Choice(['record', 'replay']),
+              help='Record the search into the crawl archive, or replay its pages without going to the network (default: record)')
+@click.option('--inference-max-in-flight', default=4, type=int,
+              help='Maximum number of inference requests sent at the same time (default: 4)')
+@click.option('--inference-retries', default=3, type=int,
+              help='Retries of an inference request answered with 429 or 5xx, with jittered backoff (default: 3)')
+@click.option('--inference-endpoints', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='JSON file listing the inference servers to balance the requests across (default: INFERENCE_URL only)')
+@click.option('--log-compress-days', default=1, type=int,
+              help='Compress the session logs not written to for this many days, 0 keeps them uncompressed (default: 1)')
+@click.option('--role', '-r', 'role_ids', multiple=True, type=int,
+              help='Id of a job role to search for, repeat it to search several roles in a single crawl (default: the active role)')
+@click.option('--all-roles', is_flag=True, default=False,
+              help='Search for all the job roles in a single crawl (default: false)')
+def search_jobs(score_threshold, max_opportunities, max_job_descriptions, log_dir, verbose, browsers, max_navigations, concurrency, per_host_concurrency, title_batch_size, title_batch_mode, score_cache_ttl, score_cache_max_entries, incremental, http_fetch, host_rate, host_burst, http_min_characters, pre_filter_cutoff, pre_filter_top_k, stream_inference, capture_analysis, text_extractor, html_store, crawl_archive, crawl_archive_mode, inference_max_in_flight, inference_retries, inference_endpoints, log_compress_days, role_ids, all_roles):
 
     start_time = datetime.now()
     
@@ -48,12 +106,30 @@ def search_jobs(score_threshold, max_opportunities, max_job_descriptions, log_di
     except Exception as e:
         print(f"ERROR: {str(e)}")
         return
-    
+
     db = SessionLocal()
-    session_id = None
+
+    # The logs of the previous sessions are compressed once they ended and are no longer written to.
+    compressed_logs = compress_old_logs(log_dir_path, older_than_days=log_compress_days, open_log_paths=get_open_log_paths(db)) if log_compress_days > 0 else 0
+
+    if concurrency > 1:
+        browser_pool = AsyncBrowserPool(logger, size=browsers, max_navigations=max_navigations)
+    else:
+        browser_pool = BrowserPool(logger, size=browsers, max_navigations=max_navigations)
+    inference_client = InferenceRouter.from_config(logger, inference_endpoints, default_url=os.environ.get("INFERENCE_URL"), default_model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"),
+                                                   timeout=int(os.environ.get("INFERENCE_TIMEOUT", 120)), max_in_flight=inference_max_in_flight, max_retries=inference_retries)
+    scheduler = HostScheduler(logger, rate=host_rate, burst=host_burst) if host_rate > 0 else None
+    http_fetcher = HttpFetcher(logger, min_text_characters=http_min_characters, max_connections=max(concurrency, 1) * 2, scheduler=scheduler) if http_fetch else None
+    pre_filter = PreFilter(logger, cutoff=pre_filter_cutoff, top_k=pre_filter_top_k) if pre_filter_cutoff > 0 or pre_filter_top_k else None
+    score_cache = ScoreCache(SessionLocal(), logger, ttl_days=score_cache_ttl, max_entries=score_cache_max_entries) if score_cache_ttl > 0 else None
+    html_store = HtmlStore(logger, html_store) if html_store else None
+    archive = CrawlArchive(logger, crawl_archive, mode=crawl_archive_mode) if crawl_archive else None
+    session_ids = []
     
     try:
-        searcher = JobSearcher(db, logger, score_threshold, max_opportunities, max_job_descriptions)
+        searcher = JobSearcher(db, logger, browser_pool, inference_client, score_threshold, max_opportunities, max_job_descriptions,
+                               title_batch_size=title_batch_size, title_batch_mode=title_batch_mode, score_cache=score_cache, incremental=incremental, http_fetcher=http_fetcher, pre_filter=pre_filter,
+                               stream_inference=stream_inference, capture_analysis=capture_analysis, text_extractor=TEXT_EXTRACTORS[text_extractor], html_store=html_store, archive=archive, scheduler=scheduler)
             
         searcher.logger.write("=" * 80)
         searcher.logger.write("JOB SEARCH SESSION STARTED")
@@ -61,38 +137,84 @@ def search_jobs(score_threshold, max_opportunities, max_job_descriptions, log_di
         searcher.logger.write(f"Score threshold: {score_threshold}")
         searcher.logger.write(f"Max opportunities: {max_opportunities if max_opportunities else 'unlimited'}")
         searcher.logger.write(f"Max job descriptions: {max_job_descriptions if max_job_descriptions else 'unlimited'}")
-        searcher.logger.write(f"Log file: {log_path}")
+        searcher.logger.write(f"Browsers: {browsers} (recycled every {max_navigations} navigations)")
+        searcher.logger.write(f"Concurrency: {concurrency} (per host: {per_host_concurrency})")
+        searcher.logger.write(f"Job name scoring: {title_batch_mode} mode, batches of {title_batch_size}")
+        searcher.logger.write(f"Score cache: {f'{score_cache_ttl} days, {score_cache_max_entries} entries' if score_cache else 'disabled'}")
+        searcher.logger.write(f"Mode: {'incremental' if incremental else 'full'}")
+        searcher.logger.write(f"HTTP fetch: {f'enabled, job descriptions of at least {http_min_characters} characters' if http_fetcher else 'disabled, browser only'}")
+        searcher.logger.write(f"Pre-filter: {f'cutoff {pre_filter_cutoff}, top {pre_filter_top_k} per career page' if pre_filter_top_k else f'cutoff {pre_filter_cutoff}' if pre_filter else 'disabled'}")
+        searcher.logger.write(f"Inference: {'streamed, stopped once the score is parsed' if stream_inference and not capture_analysis else 'full analysis generated'}")
+        searcher.logger.write(f"Text extractor: {text_extractor}, raw HTML {f'kept in {html_store.directory}' if html_store else 'released once extracted'}")
+        searcher.logger.write(f"Per-host scheduling: {f'{host_rate} requests per second to start from, bursts of {host_burst}' if scheduler else 'disabled'}")
+        searcher.logger.write(f"Crawl archive: {f'{crawl_archive_mode} {archive.directory}' if archive else 'disabled'}")
+        searcher.logger.write(f"Inference requests: {len(inference_client.endpoints)} endpoints, {inference_max_in_flight} in flight per endpoint unless configured, {inference_retries} retries")
+        searcher.logger.write(f"Log file: {log_path} (and {log_path.with_suffix('.jsonl').name}), {compressed_logs} old session logs compressed")
             
-        # Get active role
-        active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
-        if not active_role:
-            searcher.logger.write("ERROR: No active job role found!")
+        # Get the roles to search for, the active role unless some are selected.
+        if all_roles:
+            search_roles = db.query(JobRole).order_by(JobRole.id).all()
+        elif role_ids:
+            search_roles = db.query(JobRole).filter(JobRole.id.in_(role_ids)).order_by(JobRole.id).all()
+        else:
+            active_role = db.query(JobRole).filter(JobRole.is_active == True).first()
+            search_roles = [active_role] if active_role else []
+        if not search_roles:
+            searcher.logger.write("ERROR: No active job role found!" if not all_roles and not role_ids else "ERROR: No job role found!")
             return
-                    
-        searcher.logger.write(f"Active Role: {active_role.name}")
-            
-        # Create search session record
-        search_session = SearchSession(
-            job_role_id=active_role.id,
-            start_datetime=start_time,
-            score_threshold=score_threshold,
-            log_file_path=str(log_path)
-        )
-        db.add(search_session)
+
+        searcher.logger.write(f"{'Active Role' if len(search_roles) == 1 else 'Roles'}: {', '.join(role.name for role in search_roles)}")
+
+        # Create a search session record per role, sharing the log file.
+        search_sessions = []
+        for role in search_roles:
+            search_session = SearchSession(
+                job_role_id=role.id,
+                start_datetime=start_time,
+                score_threshold=score_threshold,
+                log_file_path=str(log_path),
+                status=RUNNING,
+                heartbeat_at=start_time
+            )
+            db.add(search_session)
+            search_sessions.append(search_session)
         db.commit()
-        db.refresh(search_session)
-        session_id = search_session.id
-        
-        searcher.logger.write(f"Search Session ID: {session_id}")
+        for search_session in search_sessions:
+            db.refresh(search_session)
+            session_ids.append(search_session.id)
+
+        searcher.logger.write(f"Search Session ID: {', '.join(str(session_id) for session_id in session_ids)}")
 
         searcher.opportunities_found = 0
         searcher.opportunities_saved = 0
 
-        searcher.check_watchlist(active_role.id)
-        
-        # Update search session with end time
+        # The progress of the crawl is stored on the sessions after each career page, for the session events of the API.
+        def update_progress(searcher):
+            # Each session gets the progress of its role, the crawl being shared by all the roles.
+            for search_session in search_sessions:
+                role_progress = searcher.role_progress[search_session.job_role_id]
+                search_session.urls_total = role_progress["urls_total"]
+                search_session.urls_done = role_progress["urls_done"]
+                search_session.job_descriptions_checked = role_progress["job_descriptions"]
+                search_session.opportunities_found = role_progress["opportunities"]
+                search_session.metrics = searcher.metrics.to_summary()
+                search_session.heartbeat_at = datetime.now()
+            db.commit()
+
+        searcher.on_progress = update_progress
+
+        search_role_ids = [role.id for role in search_roles]
+        if concurrency > 1:
+            asyncio.run(searcher.check_watchlist_async(search_role_ids, concurrency, per_host_concurrency))
+        else:
+            searcher.check_watchlist(search_role_ids)
+
+        # Update the search sessions with end time
         end_time = datetime.now()
-        search_session.end_datetime = end_time
+        for search_session in search_sessions:
+            search_session.end_datetime = end_time
+            search_session.status = COMPLETED
+            search_session.metrics = searcher.metrics.to_summary()
         db.commit()
 
         duration = (end_time - start_time).total_seconds()
@@ -101,26 +223,53 @@ def search_jobs(score_threshold, max_opportunities, max_job_descriptions, log_di
         searcher.logger.write("SEARCH SESSION COMPLETED")
         searcher.logger.write(f"Duration: {duration:.2f} seconds")
         searcher.logger.write(f"New opportunities found: {searcher.opportunities_found}")
-        searcher.logger.write(f"Session ID: {session_id}")
+        browser_pool.write_summary()
+        inference_client.write_summary()
+        if http_fetcher:
+            http_fetcher.write_summary()
+        if pre_filter:
+            pre_filter.write_summary()
+        if score_cache:
+            score_cache.prune()
+            score_cache.write_summary()
+        if scheduler:
+            scheduler.write_summary()
+        if html_store:
+            html_store.write_summary()
+        if archive:
+            archive.write_summary()
+        searcher.metrics.write_summary(searcher.logger)
+        searcher.logger.write(f"Session ID: {', '.join(str(session_id) for session_id in session_ids)}")
         searcher.logger.write("=" * 80)
             
-    except Exception as e:
-        print(f"ERROR: {str(e)}")
+    except (Exception, KeyboardInterrupt) as e:
+        print(f"ERROR: {str(e) or type(e).__name__}")
         import traceback
         traceback.print_exc()
-        
-        # Mark session as failed (no end time)
-        if session_id:
+
+        # Mark the sessions as failed, with their end time, so that the API and its event streams see them ended.
+        if session_ids:
             try:
-                session = db.query(SearchSession).filter(SearchSession.id == session_id).first()
-                if session:
-                    # Keep end_datetime as None to indicate error
-                    db.commit()
-            except:
-                pass
-    
+                db.rollback()
+                db.query(SearchSession).filter(
+                    SearchSession.id.in_(session_ids),
+                    SearchSession.end_datetime.is_(None)
+                ).update({SearchSession.status: FAILED, SearchSession.end_datetime: datetime.now()}, synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+
     finally:
+        # The async pool is closed inside its event loop by check_watchlist_async.
+        if isinstance(browser_pool, BrowserPool):
+            browser_pool.close()
+        if http_fetcher:
+            http_fetcher.close()
+        inference_client.close()
+        if score_cache:
+            score_cache.close()
         db.close()
+        logger.close()
 
 
 if __name__ == '__main__':
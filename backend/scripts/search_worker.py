@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Search Worker Script - Drains the search sessions queued from the API, one watchlist URL at a time.
+
+Usage:
+    python scripts/search_worker.py
+    python scripts/search_worker.py --processes 4 --browsers 1
+"""
+
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+import click
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import SessionLocal, engine
+from app.models import SearchSession
+from app.search_queue import LOG_DIR, claim_task, finish_task, get_open_log_paths, heartbeat_task
+from searcher import JobSearcher, BrowserPool, HttpFetcher, InferenceRouter, Logger, PreFilter, ScoreCache, HtmlStore, HostScheduler, TEXT_EXTRACTORS, DEFAULT_TEXT_EXTRACTOR, compress_old_logs
+
+# Seconds between two prunes of the score cache by a worker.
+SCORE_CACHE_PRUNE_SECONDS = 3600
+
+
+def run_task(db, logger, searcher_factory, task, worker):
+    # Check the URL of the task for the role of its session, logging to the session log file.
+    # Returns the job descriptions checked, the opportunities found, the error, if any, and the metrics summary.
+
+    search_session = db.query(SearchSession).filter(SearchSession.id == task.session_id).first()
+    if not search_session:
+        return 0, 0, "Search session deleted", None
+
+    logger.close()
+    logger.log_path = search_session.log_file_path
+    logger.create_file('a')
+    logger.write(f"Worker {worker}: checking {task.url} (attempt {task.attempts}).")
+
+    searcher = searcher_factory(search_session.score_threshold)
+    try:
+        searcher.check_watchlist([search_session.job_role_id], urls=[task.url])
+        error = f"{searcher.errors} errors, see the session log" if searcher.errors else None
+    except Exception as e:
+        db.rollback()
+        error = str(e)
+        logger.write(f"  Error processing {task.url}: {error}")
+
+    return searcher.job_descriptions, searcher.opportunities, error, searcher.metrics.to_summary()
+
+
+def renew_lease(logger, task_id, session_id, worker, interval_seconds, stopped):
+    # Refresh the lease of the running task from its own connection, the searcher using the worker one.
+    db = SessionLocal()
+    try:
+        while not stopped.wait(interval_seconds):
+            try:
+                if not heartbeat_task(db, task_id, session_id, worker):
+                    logger.write(f"Worker {worker}: the lease of task {task_id} was lost.")
+                    return
+            except Exception as e:
+                db.rollback()
+                logger.write(f"Worker {worker}: lease renewal of task {task_id} failed: {e}")
+    finally:
+        db.close()
+
+
+def run_worker(options):
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    logger = Logger(verbose=options["verbose"])
+    db = SessionLocal()
+    browser_pool = BrowserPool(logger, size=options["browsers"], max_navigations=options["max_navigations"])
+    inference_client = InferenceRouter.from_config(logger, options["inference_endpoints"], default_url=os.environ.get("INFERENCE_URL"), default_model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"),
+                                                   timeout=int(os.environ.get("INFERENCE_TIMEOUT", 120)), max_in_flight=options["inference_max_in_flight"])
+    scheduler = HostScheduler(logger, rate=options["host_rate"], burst=options["host_burst"]) if options["host_rate"] > 0 else None
+    http_fetcher = HttpFetcher(logger, scheduler=scheduler) if options["http_fetch"] else None
+    pre_filter = PreFilter(logger, cutoff=options["pre_filter_cutoff"]) if options["pre_filter_cutoff"] > 0 else None
+    score_cache = ScoreCache(SessionLocal(), logger, ttl_days=options["score_cache_ttl"]) if options["score_cache_ttl"] > 0 else None
+    html_store = HtmlStore(logger, options["html_store"]) if options["html_store"] else None
+
+    # The browsers, connections and caches are kept for all the tasks of the worker, the searcher is per task.
+    def searcher_factory(score_threshold):
+        return JobSearcher(db, logger, browser_pool, inference_client, score_threshold, None, None,
+                           score_cache=score_cache, incremental=options["incremental"], http_fetcher=http_fetcher, pre_filter=pre_filter,
+                           stream_inference=options["stream_inference"], text_extractor=TEXT_EXTRACTORS[options["text_extractor"]], html_store=html_store, scheduler=scheduler)
+
+    logger.write(f"Search worker {worker} started.")
+    tasks = 0
+    pruned_at = time.monotonic()
+
+    try:
+        while True:
+
+            task = claim_task(db, worker, lease_minutes=options["lease_minutes"], max_attempts=options["max_attempts"])
+            if not task:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_seconds"])
+                continue
+
+            # The lease is renewed three times per period, so that a slow renewal does not let it expire.
+            stopped = threading.Event()
+            heartbeat = threading.Thread(target=renew_lease, args=(logger, task.id, task.session_id, worker, options["lease_minutes"] * 20, stopped), daemon=True)
+            heartbeat.start()
+            try:
+                job_descriptions, opportunities, error, metrics = run_task(db, logger, searcher_factory, task, worker)
+            finally:
+                stopped.set()
+                heartbeat.join()
+            if not finish_task(db, task, worker, job_descriptions, opportunities, error=error, max_attempts=options["max_attempts"], metrics=metrics):
+                logger.write(f"Worker {worker}: lease lost on {task.url}, the result is dropped.")
+            tasks += 1
+
+            # The expired and least used scores are evicted from time to time, the worker never ending.
+            if score_cache and time.monotonic() - pruned_at >= SCORE_CACHE_PRUNE_SECONDS:
+                score_cache.prune()
+                pruned_at = time.monotonic()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        logger.close()
+        logger.write(f"Search worker {worker} stopped after {tasks} tasks.")
+        browser_pool.write_summary()
+        inference_client.write_summary()
+        if scheduler:
+            scheduler.write_summary()
+        if html_store:
+            html_store.write_summary()
+        if score_cache:
+            score_cache.prune()
+            score_cache.write_summary()
+            score_cache.close()
+        browser_pool.close()
+        if http_fetcher:
+            http_fetcher.close()
+        inference_client.close()
+        db.close()
+        # The worker processes exit without running the atexit handlers.
+        logger.close()
+
+
+@click.command()
+@click.option('--processes', '-p', default=1, type=int,
+              help='Worker processes started on this host, each with its own browsers (default: 1)')
+@click.option('--poll-seconds', default=5, type=int,
+              help='Seconds to wait before polling the queue again when it is empty (default: 5)')
+@click.option('--lease-minutes', default=30, type=int,
+              help='Minutes after which a task still running is handed to another worker (default: 30)')
+@click.option('--max-attempts', default=3, type=int,
+              help='Attempts of a failing task before it is marked as failed (default: 3)')
+@click.option('--once', is_flag=True, default=False,
+              help='Stop once the queue is empty instead of waiting for new sessions (default: false)')
+@click.option('--verbose', '-v', default='false', type=bool,
+              help='Enable verbose logging (default: false)')
+@click.option('--browsers', '-b', default=1, type=int,
+              help='Number of warm Chromium instances kept by each worker process (default: 1)')
+@click.option('--max-navigations', '-n', default=50, type=int,
+              help='Navigations per browser context before it is recycled (default: 50)')
+@click.option('--incremental/--full', default=False,
+              help='Only check job descriptions new or changed since the last visit (default: full)')
+@click.option('--http-fetch/--browser-only', default=True,
+              help='Fetch pages over plain HTTP first and render them in the browser only when needed (default: http-fetch)')
+@click.option('--host-rate', default=1.0, type=float,
+              help='Requests per second to a same host to start from, adapted to its answers, 0 disables the per-host scheduling (default: 1.0)')
+@click.option('--host-burst', default=3, type=int,
+              help='Requests sent to a same host without waiting, after a quiet period (default: 3)')
+@click.option('--pre-filter-cutoff', default=0.0, type=float,
+              help='Minimum local similarity between a job name and the role to be scored by inference, the dropped job names are logged, 0 disables the pre-filter (default: 0)')
+@click.option('--stream-inference/--no-stream-inference', default=True,
+              help='Stream the inference answers and stop reading as soon as the score is parsed (default: stream-inference)')
+@click.option('--text-extractor', default=DEFAULT_TEXT_EXTRACTOR, type=click.Choice(list(TEXT_EXTRACTORS)),
+              help=f'Extraction of the job description text given to the model, lxml keeps the main content only (default: {DEFAULT_TEXT_EXTRACTOR})')
+@click.option('--html-store', default=None, type=click.Path(file_okay=False),
+              help='Directory where the raw HTML of the fetched pages is kept gzipped, for debugging (default: not kept)')
+@click.option('--score-cache-ttl', default=30, type=int,
+              help='Days a cached score is reused across sessions, 0 disables the score cache (default: 30)')
+@click.option('--inference-max-in-flight', default=4, type=int,
+              help='Maximum number of inference requests sent at the same time by each worker process (default: 4)')
+@click.option('--inference-endpoints', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='JSON file listing the inference servers to balance the requests across (default: INFERENCE_URL only)')
+def search_worker(processes, **options):
+
+    LOG_DIR.mkdir(exist_ok=True)
+    db = SessionLocal()
+    try:
+        compress_old_logs(LOG_DIR, open_log_paths=get_open_log_paths(db))
+    finally:
+        db.close()
+
+    if processes <= 1:
+        run_worker(options)
+        return
+
+    # The forked workers would otherwise share the pooled connection of the parent.
+    engine.dispose()
+    workers = [multiprocessing.Process(target=run_worker, args=(options,)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.join()
+
+
+if __name__ == '__main__':
+    search_worker()
@@ -1,9 +1,21 @@
 """Job searcher module"""
 
 from .job_searcher import JobSearcher
+from .browser_pool import BrowserPool, AsyncBrowserPool
 from .career_page import CareerPage
+from .http_fetcher import HttpFetcher, HostThrottledError
 from .content_analyser import ContentAnalyser
 from .job_description import JobDescription
-from .logger import Logger
+from .inference_client import InferenceClient, InferenceError, InferenceUnavailableError
+from .inference_router import InferenceRouter
+from .logger import Logger, compress_old_logs
+from .pre_filter import PreFilter
+from .page_adapters import PageAdapter, PAGE_ADAPTERS
+from .score_cache import ScoreCache
+from .html_store import HtmlStore
+from .crawl_archive import CrawlArchive
+from .host_scheduler import HostScheduler
+from .search_metrics import SearchMetrics
+from .text_extractor import TextExtractor, TEXT_EXTRACTORS, DEFAULT_TEXT_EXTRACTOR
 
-__all__ = ['JobSearcher', 'CareerPage', 'ContentAnalyser', 'JobDescription', 'Logger']
+__all__ = ['JobSearcher', 'BrowserPool', 'AsyncBrowserPool', 'CareerPage', 'HttpFetcher', 'HostThrottledError', 'ContentAnalyser', 'JobDescription', 'InferenceClient', 'InferenceError', 'InferenceUnavailableError', 'InferenceRouter', 'Logger', 'compress_old_logs', 'PageAdapter', 'PAGE_ADAPTERS', 'PreFilter', 'ScoreCache', 'HtmlStore', 'CrawlArchive', 'HostScheduler', 'SearchMetrics', 'TextExtractor', 'TEXT_EXTRACTORS', 'DEFAULT_TEXT_EXTRACTOR']
@@ -0,0 +1,233 @@
+"""BrowserPool class for sharing warm Chromium instances across fetches"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from playwright.async_api import async_playwright
+from playwright.sync_api import sync_playwright
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+class _PooledBrowser:
+    """One Chromium instance with its current context and page"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.context = None
+        self.page = None
+        self.navigations = 0
+
+
+class BrowserPool:
+    """Keeps a number of Chromium instances and contexts alive for a whole search session"""
+
+    def __init__(self, logger, size=1, max_navigations=50, headless=True):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if max_navigations < 1:
+            raise ValueError("max_navigations must be at least 1")
+
+        self.logger = logger
+        self.size = size
+        self.max_navigations = max_navigations
+        self.headless = headless
+        self.playwright = None
+        self.browsers = []
+        self.next_browser = 0
+
+        # Timing counters, reported at the end of the session.
+        self.fetches = 0
+        self.launch_seconds = 0.0
+        self.navigation_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start(self):
+        # Playwright and the browsers are started lazily, on the first page request.
+        self.playwright = sync_playwright().start()
+        for _ in range(self.size):
+            self.browsers.append(_PooledBrowser(self.playwright.chromium.launch(headless=self.headless)))
+
+    def _recycle(self, pooled):
+        # Drop the current context (cookies, cache, memory) and open a fresh one on the same browser.
+        if pooled.context:
+            try:
+                pooled.context.close()
+            except Exception:
+                pass
+        if not pooled.browser.is_connected():
+            pooled.browser = self.playwright.chromium.launch(headless=self.headless)
+        pooled.context = pooled.browser.new_context(user_agent=USER_AGENT)
+        pooled.page = pooled.context.new_page()
+        pooled.navigations = 0
+
+    @contextmanager
+    def page(self):
+        """Hand out a warm page, yielding it with the seconds spent launching for this request"""
+
+        launch_start = time.perf_counter()
+
+        if not self.playwright:
+            self._start()
+
+        # Round robin across the browsers.
+        pooled = self.browsers[self.next_browser]
+        self.next_browser = (self.next_browser + 1) % len(self.browsers)
+
+        if not pooled.page or pooled.navigations >= self.max_navigations or not pooled.browser.is_connected():
+            self._recycle(pooled)
+
+        launch_seconds = time.perf_counter() - launch_start
+        self.launch_seconds += launch_seconds
+
+        try:
+            yield pooled.page, launch_seconds
+        except Exception:
+            # The page may be left in an unknown state, so it is recycled on next use.
+            pooled.navigations = self.max_navigations
+            raise
+        finally:
+            pooled.navigations += 1
+            self.fetches += 1
+
+    def record_navigation(self, seconds):
+        self.navigation_seconds += seconds
+
+    def close(self):
+        for pooled in self.browsers:
+            try:
+                pooled.browser.close()
+            except Exception:
+                pass
+        self.browsers = []
+        if self.playwright:
+            self.playwright.stop()
+            self.playwright = None
+
+    def write_summary(self):
+        self.logger.write(f"Browser fetches: {self.fetches} (launch: {self.launch_seconds:.2f} seconds, navigation: {self.navigation_seconds:.2f} seconds)")
+
+
+class _AsyncPooledBrowser:
+    """One Chromium instance shared by concurrent pages of the same context"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.context = None
+        self.navigations = 0
+        self.open_pages = {}
+        self.lock = asyncio.Lock()
+
+
+class AsyncBrowserPool:
+    """Async counterpart of BrowserPool, handing out one page per concurrent fetch"""
+
+    def __init__(self, logger, size=1, max_navigations=50, headless=True):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if max_navigations < 1:
+            raise ValueError("max_navigations must be at least 1")
+
+        self.logger = logger
+        self.size = size
+        self.max_navigations = max_navigations
+        self.headless = headless
+        self.playwright = None
+        self.browsers = []
+        self.next_browser = 0
+        self.start_lock = asyncio.Lock()
+
+        # Timing counters, reported at the end of the session.
+        self.fetches = 0
+        self.launch_seconds = 0.0
+        self.navigation_seconds = 0.0
+
+    async def _start(self):
+        async with self.start_lock:
+            if self.playwright:
+                return
+            playwright = await async_playwright().start()
+            for _ in range(self.size):
+                self.browsers.append(_AsyncPooledBrowser(await playwright.chromium.launch(headless=self.headless)))
+            self.playwright = playwright
+
+    async def _close_context(self, pooled, context):
+        # Retired contexts are closed once the last page using them is done.
+        if context is not pooled.context and not pooled.open_pages.get(context):
+            pooled.open_pages.pop(context, None)
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    async def _recycle(self, pooled):
+        retired = pooled.context
+        if not pooled.browser.is_connected():
+            pooled.browser = await self.playwright.chromium.launch(headless=self.headless)
+        pooled.context = await pooled.browser.new_context(user_agent=USER_AGENT)
+        pooled.open_pages[pooled.context] = 0
+        pooled.navigations = 0
+        if retired:
+            await self._close_context(pooled, retired)
+
+    @asynccontextmanager
+    async def page(self):
+        """Hand out a new page on a warm context, yielding it with the seconds spent launching for this request"""
+
+        launch_start = time.perf_counter()
+
+        if not self.playwright:
+            await self._start()
+
+        # Round robin across the browsers.
+        pooled = self.browsers[self.next_browser]
+        self.next_browser = (self.next_browser + 1) % len(self.browsers)
+
+        async with pooled.lock:
+            if not pooled.context or pooled.navigations >= self.max_navigations or not pooled.browser.is_connected():
+                await self._recycle(pooled)
+            context = pooled.context
+            pooled.navigations += 1
+            pooled.open_pages[context] += 1
+
+        try:
+            page = await context.new_page()
+        except Exception:
+            pooled.open_pages[context] -= 1
+            raise
+
+        launch_seconds = time.perf_counter() - launch_start
+        self.launch_seconds += launch_seconds
+
+        try:
+            yield page, launch_seconds
+        finally:
+            self.fetches += 1
+            pooled.open_pages[context] -= 1
+            try:
+                await page.close()
+            except Exception:
+                pass
+            await self._close_context(pooled, context)
+
+    def record_navigation(self, seconds):
+        self.navigation_seconds += seconds
+
+    async def close(self):
+        for pooled in self.browsers:
+            try:
+                await pooled.browser.close()
+            except Exception:
+                pass
+        self.browsers = []
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+    def write_summary(self):
+        self.logger.write(f"Browser fetches: {self.fetches} (launch: {self.launch_seconds:.2f} seconds, navigation: {self.navigation_seconds:.2f} seconds)")
@@ -1,82 +1,374 @@
 """CareerPage class for fetching and parsing job listings from URLs"""
 
+import asyncio
+import hashlib
+import json
 import os
+import time
+import requests
 from urllib.parse import urlsplit
-from playwright.sync_api import sync_playwright
 from .content_analyser import ContentAnalyser
-from .job_description import JobDescription
-from bs4 import BeautifulSoup
+from .browser_pool import USER_AGENT
+from .job_description import JobDescription, hash_content
+from .page_adapters import PAGE_ADAPTERS
+from .text_extractor import TEXT_EXTRACTORS, DEFAULT_TEXT_EXTRACTOR
+from .crawl_archive import PAGE, API
+from .search_metrics import SearchMetrics
 
 class CareerPage:
     
-    def __init__(self, url, page_type, logger, timeout=60000):
+    def __init__(self, url, page_type, logger, browser_pool, timeout=60000, http_fetcher=None, text_extractor=None, max_characters=None, html_store=None, archive=None, metrics=None, scheduler=None):
         self.url = url
         self.page_type = page_type
         self.logger = logger
+        self.browser_pool = browser_pool
+        self.http_fetcher = http_fetcher
+        self.text_extractor = text_extractor or TEXT_EXTRACTORS[DEFAULT_TEXT_EXTRACTOR]
+        self.max_characters = max_characters
+        self.html_store = html_store
+        self.archive = archive
+        self.metrics = metrics or SearchMetrics()
+        self.scheduler = scheduler
         self.timeout = timeout
         self.html_content = None
+        self.etag = None
+        self.last_modified = None
+
+        # Hash of the text of the board once fetched, and the urls whose fetch failed, left out of the fingerprints.
+        self.board_hash = None
+        self.failed_urls = set()
     
+    def is_unchanged(self, etag, last_modified) -> bool:
+        # Plain HTTP probe with the validators of the last visit, True when the server says the page did not change.
+        # The validators returned by the server are kept to be stored with this visit.
+
+        # A replayed crawl never goes to the network, its pages are always checked.
+        if self.archive and self.archive.replaying:
+            return False
+
+        # The HTML of a board rendered by JavaScript is a shell whose validators do not change with its jobs.
+        adapter = PAGE_ADAPTERS.get(self.page_type)
+        if adapter and adapter.rendered_fallback:
+            return False
+
+        headers = {"User-Agent": USER_AGENT}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        self._acquire(self.url)
+        start = time.perf_counter()
+        try:
+            response = requests.head(self.url, headers=headers, timeout=self.timeout / 1000, allow_redirects=True)
+        except requests.RequestException as e:
+            self._record(self.url, None, start)
+            self.logger.write(f"  HTTP probe failed for {self.url}: {str(e)}")
+            return False
+        self._record(self.url, response.status_code, start, response.headers.get("Retry-After"))
+
+        self.etag = response.headers.get("ETag", etag if response.status_code == 304 else None)
+        self.last_modified = response.headers.get("Last-Modified", last_modified if response.status_code == 304 else None)
+
+        if response.status_code == 304:
+            return True
+
+        # Some servers ignore conditional HEAD requests, so the validators are compared as well.
+        if response.status_code == 200:
+            if etag:
+                return self.etag == etag
+            if last_modified:
+                return self.last_modified == last_modified
+
+        return False
+
+    def get_fingerprints(self, job_descriptions) -> tuple[str, dict]:
+        # Content hash of the board and a hash per job posting, keyed by url.
+
+        # The hash of the fetched content is the fingerprint of a job when the page type lists it with the jobs,
+        # only its title being known otherwise until its page is fetched.
+        job_fingerprints = {
+            job_description.url: job_description.content_hash or hash_content(job_description.description)
+            for job_description in job_descriptions
+        }
+        # The text of a fetched board changes with more than its links, e.g. the locations of the jobs.
+        content_hash = hashlib.sha256(json.dumps([self.board_hash, sorted(job_fingerprints.items())]).encode("utf-8")).hexdigest()
+        return content_hash, job_fingerprints
+
+    def create_job_description(self, description, url, html_content=None) -> JobDescription:
+        # The full content listed with the job is extracted right away, like a fetched page.
+        job_description = JobDescription(description=description, url=url)
+        if html_content:
+            self._set_html_content(job_description, html_content)
+        return job_description
+
+    def _set_html_content(self, job_description, html_content):
+        # Only the text of a job description is kept, the board HTML is kept until its links are collected.
+        if self.html_store:
+            self.html_store.put(job_description.url if job_description else self.url, html_content)
+        if job_description:
+            with self.metrics.time("extraction"):
+                job_description.set_content(html_content, self.text_extractor, self.max_characters)
+        else:
+            self.html_content = html_content
+
+    def _set_fetched_content(self, job_description, url, html_content):
+        if self.archive and self.archive.recording:
+            self.archive.put(PAGE, url, html_content)
+        self._set_html_content(job_description, html_content)
+
+    def _replay(self, job_description, url) -> str:
+        html_content = self.archive.get(PAGE, url)
+        if html_content is None:
+            raise Exception(f"Error fetching {url}: not in the crawl archive")
+        self._set_html_content(job_description, html_content)
+        return "replay"
+
+    def _replay_json(self, url):
+        data = self.archive.get(API, url)
+        if data is None:
+            raise Exception(f"{url} not in the crawl archive")
+        return data
+
+    def _acquire(self, url):
+        # Waits for the turn of the request in the host scheduler, when there is one.
+        if self.scheduler:
+            self.scheduler.acquire(url)
+
+    async def _acquire_async(self, url):
+        if self.scheduler:
+            await self.scheduler.acquire_async(url)
+
+    def _record(self, url, status_code, start=None, retry_after=None):
+        # The latency of the browser navigations, rendering included, is not the one of the host.
+        if self.scheduler:
+            self.scheduler.record(url, status_code, time.perf_counter() - start if start else None, retry_after)
+
+    def get_json(self, url):
+
+        if self.archive and self.archive.replaying:
+            return self._replay_json(url)
+
+        if self.http_fetcher:
+            data = self.http_fetcher.get_json(url)
+        else:
+            self._acquire(url)
+            start = time.perf_counter()
+            try:
+                response = requests.get(url, headers={"User-Agent": USER_AGENT, "Accept": "application/json"}, timeout=self.timeout / 1000)
+            except requests.RequestException:
+                self._record(url, None, start)
+                raise
+            self._record(url, response.status_code, start, response.headers.get("Retry-After"))
+            response.raise_for_status()
+            data = response.json()
+
+        if self.archive and self.archive.recording:
+            self.archive.put(API, url, data)
+        return data
+
+    async def get_json_async(self, url):
+
+        if self.archive and self.archive.replaying:
+            return await asyncio.to_thread(self._replay_json, url)
+
+        if not self.http_fetcher:
+            return await asyncio.to_thread(self.get_json, url)
+
+        data = await self.http_fetcher.get_json_async(url)
+        if self.archive and self.archive.recording:
+            await asyncio.to_thread(self.archive.put, API, url, data)
+        return data
+
     def fetch(self, job_description=None) -> bool:
 
+        # The full content may already come with the job listing.
+        if job_description and job_description.fetched:
+            return True
+
         if job_description:
             url = job_description.url
         else:
             url = self.url
+
+        with self.metrics.time("fetch"), self.metrics.in_flight("fetches"):
+            try:
+                method = self._fetch(job_description, url)
+            except Exception:
+                self.failed_urls.add(url)
+                self.metrics.increment("fetch_errors")
+                raise
+        self.metrics.increment("pages_fetched", method=method)
+        return True
+
+    def _fetch(self, job_description, url) -> str:
+        # Returns how the page was fetched.
+
+        if self.archive and self.archive.replaying:
+            return self._replay(job_description, url)
+
+        # Plain HTTP first, the browser only renders the pages that need it. A throttled answer raises, the page is skipped.
+        if self.http_fetcher:
+            html_content = self.http_fetcher.fetch(url, self.page_type, kind="job_description" if job_description else "career_page")
+            if html_content is not None:
+                self._set_fetched_content(job_description, url, html_content)
+                if self.logger.verbose:
+                    self.logger.write(f"  Fetched {url} over HTTP")
+                return "http"
  
         try:
+
+            # The turn of the request is awaited before taking a page of the pool.
+            self._acquire(url)
  
-            with sync_playwright() as p:
- 
-                browser = p.chromium.launch(headless=True)
-                context = browser.new_context(
-                    user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                )
-                page = context.new_page()
-                page.goto(url, wait_until="networkidle")
+            with self.browser_pool.page() as (page, launch_seconds):
 
-                if job_description:
-                    job_description.html_content = page.content()
-                else:
-                    self.html_content = page.content()
+                navigation_start = time.perf_counter()
+                try:
+                    response = page.goto(url, wait_until="networkidle", timeout=self.timeout)
+                except Exception:
+                    self._record(url, None)
+                    raise
+                self._record(url, response.status if response else None, retry_after=response.headers.get("retry-after") if response else None)
+                html_content = page.content()
+                navigation_seconds = time.perf_counter() - navigation_start
+                self.browser_pool.record_navigation(navigation_seconds)
 
-                browser.close()
+            self._set_fetched_content(job_description, url, html_content)
+
+            if self.logger.verbose:
+                self.logger.write(f"  Fetched {url} in the browser (launch: {launch_seconds:.2f} seconds, navigation: {navigation_seconds:.2f} seconds)")
             
         except Exception as e:
             raise Exception(f"Error fetching {url}: {str(e)}")
 
+        return "browser"
+
+    async def fetch_async(self, job_description=None) -> bool:
+
+        # The full content may already come with the job listing.
+        if job_description and job_description.fetched:
+            return True
+
+        if job_description:
+            url = job_description.url
+        else:
+            url = self.url
+
+        with self.metrics.time("fetch"), self.metrics.in_flight("fetches"):
+            try:
+                method = await self._fetch_async(job_description, url)
+            except Exception:
+                self.failed_urls.add(url)
+                self.metrics.increment("fetch_errors")
+                raise
+        self.metrics.increment("pages_fetched", method=method)
         return True
 
-    def get_job_descriptions(self) -> list[JobDescription]:
+    async def _fetch_async(self, job_description, url) -> str:
+        # Returns how the page was fetched.
+
+        if self.archive and self.archive.replaying:
+            return await asyncio.to_thread(self._replay, job_description, url)
+
+        # Plain HTTP first, the browser only renders the pages that need it. A throttled answer raises, the page is skipped.
+        if self.http_fetcher:
+            html_content = await self.http_fetcher.fetch_async(url, self.page_type, kind="job_description" if job_description else "career_page")
+            if html_content is not None:
+                await asyncio.to_thread(self._set_fetched_content, job_description, url, html_content)
+                if self.logger.verbose:
+                    self.logger.write(f"  Fetched {url} over HTTP")
+                return "http"
+
+        try:
+
+            # The turn of the request is awaited before taking a page of the pool.
+            await self._acquire_async(url)
+
+            async with self.browser_pool.page() as (page, launch_seconds):
+
+                navigation_start = time.perf_counter()
+                try:
+                    response = await page.goto(url, wait_until="networkidle", timeout=self.timeout)
+                except Exception:
+                    self._record(url, None)
+                    raise
+                self._record(url, response.status if response else None, retry_after=response.headers.get("retry-after") if response else None)
+                html_content = await page.content()
+                navigation_seconds = time.perf_counter() - navigation_start
+                self.browser_pool.record_navigation(navigation_seconds)
+
+            # The text is extracted off the event loop, the HTML is released once extracted.
+            await asyncio.to_thread(self._set_fetched_content, job_description, url, html_content)
+
+            if self.logger.verbose:
+                self.logger.write(f"  Fetched {url} in the browser (launch: {launch_seconds:.2f} seconds, navigation: {navigation_seconds:.2f} seconds)")
+
+        except Exception as e:
+            raise Exception(f"Error fetching {url}: {str(e)}")
+
+        return "browser"
+
+    def _parse_job_descriptions(self) -> list[JobDescription]:
 
         job_descriptions = []
 
-        match self.page_type:
+        if self.logger.verbose:
+            self.logger.write(f"  Fetched HTML content of length {len(self.html_content)} characters")
 
-            case "ashbyhq":
+        # Preparing the base url.
+        url_parts = urlsplit(self.url)
+        base_url = f"{url_parts.scheme}://{url_parts.netloc}"
 
-                # Fetch the career page content.
-                self.fetch()
+        # Extract job descriptions from the career page content, the page being parsed once.
+        with self.metrics.time("parse"):
+            links = self.text_extractor.get_links(self.html_content)
+        for href, text in links:
+            if href.startswith("/"):
+                job_description = JobDescription(
+                    description=text,
+                    url=base_url + href
+                )
+                job_descriptions.append(job_description)
+        
+        self.logger.write(f"  Extracted {len(job_descriptions)} job descriptions from the page containing {len(links)} links")
 
-                if self.logger.verbose:
-                    self.logger.write(f"  Fetched HTML content of length {len(self.html_content)} characters")
-
-                # Preparing the base url.
-                url_parts = urlsplit(self.url)
-                base_url = f"{url_parts.scheme}://{url_parts.netloc}"
-
-                # Extract job descriptions from the career page content.
-                soup = BeautifulSoup(self.html_content, 'html.parser')
-                for anchor in soup.find_all('a', href=True):
-                    if anchor['href'].startswith("/"):
-                        job_description = JobDescription(
-                            description=anchor.get_text(strip=True),
-                            url=base_url + anchor['href']
-                        )
-                        job_descriptions.append(job_description)
-                
-                self.logger.write(f"  Extracted {len(job_descriptions)} job descriptions from the page containing {len(soup.find_all('a', href=True))} links")
-
-            case _:
-                self.logger.write(f"  No specific parsing logic for page type '{self.page_type}', skipping the career page analysis")
+        # The board HTML is not needed any more, only the hash of its text is kept for the fingerprints.
+        self.board_hash = hash_content(self.text_extractor.get_text(self.html_content))
+        self.html_content = None
 
         return job_descriptions
+
+    def get_job_descriptions(self) -> list[JobDescription]:
+
+        adapter = PAGE_ADAPTERS.get(self.page_type)
+        if not adapter:
+            self.logger.write(f"  No specific parsing logic for page type '{self.page_type}', skipping the career page analysis")
+            return []
+
+        job_descriptions = adapter.get_job_descriptions(self)
+
+        if job_descriptions is None and adapter.rendered_fallback:
+
+            # Fetch the career page content.
+            self.fetch()
+            job_descriptions = self._parse_job_descriptions()
+
+        return job_descriptions or []
+
+    async def get_job_descriptions_async(self) -> list[JobDescription]:
+
+        adapter = PAGE_ADAPTERS.get(self.page_type)
+        if not adapter:
+            self.logger.write(f"  No specific parsing logic for page type '{self.page_type}', skipping the career page analysis")
+            return []
+
+        job_descriptions = await adapter.get_job_descriptions_async(self)
+
+        if job_descriptions is None and adapter.rendered_fallback:
+
+            # Fetch the career page content.
+            await self.fetch_async()
+            job_descriptions = self._parse_job_descriptions()
+
+        return job_descriptions or []
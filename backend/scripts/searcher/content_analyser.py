@@ -1,18 +1,35 @@
+import asyncio
+import hashlib
+import json
 import re
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from .score_cache import ScoreCache
+from .crawl_archive import CrawlArchive, INFERENCE
+from .search_metrics import SearchMetrics
+
+# Keywords of the CV given to the model with the full job descriptions.
+MAX_SKILLS_IN_PROMPT = 15
+
+# Scoring types answered with a single leading score, whose stream can be closed once the score is complete.
+STREAMED_TYPES = ["job_name", "full_job_description"]
+
+# A leading score is complete once followed by something else than a digit.
+COMPLETE_SCORE_PATTERN = re.compile(r"^\s*(?:SCORE:\s*)?\d+\D")
 
 class ContentAnalyser:
     
-    def __init__(self, logger, inference_url, timeout, model_name, max_characters_for_career_page_analysis):
+    def __init__(self, logger, inference_client, model_name, max_characters_for_career_page_analysis, score_cache=None, stream=False, capture_analysis=False, archive=None, metrics=None):
         self.logger = logger
-        self.headers = {"Content-Type": "application/json"}
-        self.inference_url = inference_url
+        self.inference_client = inference_client
+        self.score_cache = score_cache
+        self.stream = stream
+        self.capture_analysis = capture_analysis
+        self.archive = archive
+        self.metrics = metrics or SearchMetrics()
         self.model_name = model_name
-        self.timeout = timeout
         self.max_characters_for_career_page_analysis = max_characters_for_career_page_analysis
     
-    def _get_inference_json(self,type=None,chat_request="Hi") -> dict:
+    def _get_inference_json(self,type=None,chat_request="Hi",max_tokens=None) -> dict:
 
         inference_json = {
             "model": self.model_name,
@@ -41,6 +58,24 @@ class ContentAnalyser:
                 inference_json["cache_prompt"] = True # Cache the prompt to improve performance for similar requests in the future.
                 inference_json["stop"] = ["[/INST]", "Job Description:", "Target Job Role:"] # Stop tokens to prevent the model from generating unwanted text after the score. 
    
+            case "job_name_batch":
+
+                # Same task as "job_name", scoring a numbered list of job names in one answer.
+
+                inference_json["messages"].insert(0, {
+                    "role": "system",
+                    "content": (
+                        "You are a professional Technical Recruiter."
+                        "Your task is to compare a numbered list of Job Descriptions with a Target Job Role."
+                        "You must ALWAYS answer with one line per Job Description, formatted as '<number>. SCORE: <0-100>', and nothing else."
+                )})
+
+                inference_json["temperature"] = 0.2 # Same moderate temperature used for the single job name scoring.
+                inference_json["top_p"] = 0.95 # Use nucleus sampling to allow for more diverse responses while still focusing on the most relevant ones.
+                inference_json["max_tokens"] = 300 # Overridden by the caller with a budget proportional to the batch size.
+                inference_json["cache_prompt"] = True # Cache the prompt to improve performance for similar requests in the future.
+                inference_json["stop"] = ["[/INST]", "Target Job Role:"] # "Job Description:" is not a stop token here, since the answer lists many of them.
+
             case "full_job_description":
 
                 # Tuned for Mistral 7B-Q4 model.
@@ -61,31 +96,114 @@ class ContentAnalyser:
                 inference_json["cache_prompt"] = True # Cache the prompt to improve performance for similar requests in the future.
                 inference_json["stop"] = ["[/INST]", "Job Description:", "Target Job Role:"] # Stop tokens to prevent the model from generating unwanted text after the score. 
 
+        if max_tokens:
+            inference_json["max_tokens"] = max_tokens
+
         return inference_json
 
-    def _call_inference(self,type=None, chat_request="Hi") -> dict:
+    def _is_streamed(self, type) -> bool:
+        # The full analysis is only generated when it is captured.
+        return self.stream and not self.capture_analysis and type in STREAMED_TYPES
 
-        response = requests.post(
-            self.inference_url,
-            headers=self.headers,
-            json=self._get_inference_json(type=type, chat_request=chat_request),
-            timeout=self.timeout
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"API returned status code {response.status_code}: {response.text}")
+    def _get_streamed_content(self, line, content) -> tuple[str, bool]:
+        # Adds the token of a server-sent event line to the content, telling when the stream can be closed.
 
-        return response.json()
+        if not line or not line.startswith("data:"):
+            return content, False
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return content, True
 
-    def get_score_for_job_name(self, job_description, active_job_role) -> int:
-        # Calculate the score based on the job descriptions only.
+        choice = json.loads(data).get("choices", [{}])[0]
+        content += choice.get("delta", {}).get("content") or ""
+        return content, bool(COMPLETE_SCORE_PATTERN.match(content.upper())) or choice.get("finish_reason") is not None
 
-        chat_request = (
-            f"[INST] Target Job Role: {active_job_role.name}\n"
-            "\n"
-            f"Job Description: {job_description.description}\n"
-            "\n"
-            "EVALUATION STEPS:\n"
+    def _get_streamed_response(self, content, chunks) -> dict:
+        # Same shape as a non streamed answer, for the score extraction. The stream is closed before the server sends
+        # its usage, so the answer counts the chunks of content received, a chunk holding one token or more.
+        return {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": {"completion_chunks": chunks}}
+
+    def _read_stream(self, lines) -> dict:
+        # Reads the answer chunk by chunk, the stream is closed as soon as the score is complete.
+
+        content, chunks = "", 0
+        for line in lines:
+            new_content, done = self._get_streamed_content(line, content)
+            chunks += new_content != content
+            content = new_content
+            if done:
+                break
+        return self._get_streamed_response(content, chunks)
+
+    async def _read_stream_async(self, lines) -> dict:
+
+        content, chunks = "", 0
+        async for line in lines:
+            new_content, done = self._get_streamed_content(line, content)
+            chunks += new_content != content
+            content = new_content
+            if done:
+                break
+        return self._get_streamed_response(content, chunks)
+
+    def _get_prefix_key(self, inference_json, prefix) -> str:
+        # Requests sharing the system prompt and the prefix of the user prompt are sent to the same server slot.
+        if not prefix:
+            return None
+        system_prompt = inference_json["messages"][0]["content"] if len(inference_json["messages"]) > 1 else ""
+        return hashlib.sha256(f"{system_prompt}\x1f{prefix}".encode("utf-8")).hexdigest()[:16]
+
+    def _record_answer(self, type, inference_json, answer) -> dict:
+        # The answers are counted with their tokens, and recorded for the stub inference server to replay them.
+        usage = answer.get("usage") or {}
+        self.metrics.increment("inference_requests", type=type)
+        self.metrics.increment("prompt_tokens", usage.get("prompt_tokens") or 0, type=type)
+        self.metrics.increment("completion_tokens", usage.get("completion_tokens") or 0, type=type)
+        if "completion_chunks" in usage:
+            self.metrics.increment("completion_chunks", usage["completion_chunks"], type=type)
+        if self.archive and self.archive.recording:
+            self.archive.put(INFERENCE, CrawlArchive.make_inference_key(inference_json), answer)
+        return answer
+
+    def _call_inference(self,type=None, chat_request="Hi", max_tokens=None, prefix=None) -> dict:
+
+        inference_json = self._get_inference_json(type=type, chat_request=chat_request, max_tokens=max_tokens)
+        prefix_key = self._get_prefix_key(inference_json, prefix)
+        with self.metrics.time("inference"), self.metrics.in_flight("inference_requests"):
+            try:
+                if self._is_streamed(type):
+                    inference_json["stream"] = True
+                    answer = self.inference_client.post(inference_json, read_stream=self._read_stream, type=type, prefix_key=prefix_key)
+                else:
+                    answer = self.inference_client.post(inference_json, type=type, prefix_key=prefix_key)
+            except Exception:
+                self.metrics.increment("inference_errors", type=type)
+                raise
+        return self._record_answer(type, inference_json, answer)
+
+    async def _call_inference_async(self, type=None, chat_request="Hi", max_tokens=None, prefix=None) -> dict:
+
+        inference_json = self._get_inference_json(type=type, chat_request=chat_request, max_tokens=max_tokens)
+        prefix_key = self._get_prefix_key(inference_json, prefix)
+        with self.metrics.time("inference"), self.metrics.in_flight("inference_requests"):
+            try:
+                if self._is_streamed(type):
+                    inference_json["stream"] = True
+                    answer = await self.inference_client.post_async(inference_json, read_stream=self._read_stream_async, type=type, prefix_key=prefix_key)
+                else:
+                    answer = await self.inference_client.post_async(inference_json, type=type, prefix_key=prefix_key)
+            except Exception:
+                self.metrics.increment("inference_errors", type=type)
+                raise
+        return self._record_answer(type, inference_json, answer)
+
+    # The prompts start with their invariant part (instructions, then the role) and end with the job, so the
+    # inference server reuses the cached prompt of the previous request up to the job.
+
+    def _get_job_name_prefix(self, active_job_role) -> str:
+
+        return (
+            "[INST] EVALUATION STEPS:\n"
             "1. Extract core requirements.\n"
             "2. Compare with Target Role.\n"
             "3. List 2-3 brief bullet points of gaps.\n"
@@ -93,38 +211,64 @@ class ContentAnalyser:
             "FORMAT:\n"
             "SCORE: <0-100>\n"
             "Analysis: <brief_explanation>\n"
+            "\n"
+            f"Target Job Role: {active_job_role.name}\n"
+            "\n"
+        )
+
+    def _get_job_name_request(self, job_description, active_job_role) -> str:
+
+        return (
+            self._get_job_name_prefix(active_job_role) +
+            f"Job Description: {job_description.description}\n"
             "[/INST] SCORE: " # The space after SCORE: is intentional to help the model understand that the score should come immediately after it without any other text in between.
         )
 
-        response = self._call_inference(type="job_name", chat_request=chat_request)
+    def _get_job_name_batch_prefix(self, active_job_role) -> str:
 
-        # Cleaning the response to extract only the score.
-        response_content = response.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-        score_str = response_content.upper().strip()
-        score_str = re.search(r"(?:SCORE:\s*)?(\d+)", score_str)
-        try:
-            score = int(score_str.group(1))
-        except (ValueError, AttributeError):
-            self.logger.write(f"WARNING: Inference's answer did not contain a valid score. Skipping the job opportunity.")
-            score = 0
+        return (
+            "[INST] Score how well each Job Description matches the Target Job Role.\n"
+            "\n"
+            "FORMAT (one line per Job Description, same numbering):\n"
+            "1. SCORE: <0-100>\n"
+            "2. SCORE: <0-100>\n"
+            "\n"
+            f"Target Job Role: {active_job_role.name}\n"
+            "\n"
+        )
 
-        if self.logger.verbose:
-            self.logger.write(f"Inference API response: {response}")
-            self.logger.write(f"Extracted score: {score}")
+    def _get_job_name_batch_request(self, job_descriptions, active_job_role) -> str:
 
-        return score
+        numbered_job_descriptions = "\n".join(
+            f"{number}. {job_description.description}"
+            for number, job_description in enumerate(job_descriptions, start=1)
+        )
 
-    def get_score_for_full_job_description(self, job_description, active_job_role) -> int:
-        # Calculate the score based on the full job description.
+        return (
+            self._get_job_name_batch_prefix(active_job_role) +
+            f"Job Descriptions:\n{numbered_job_descriptions}\n"
+            "[/INST] 1. SCORE: " # Same trick used for the single job name, the first score should come right after it.
+        )
+
+    def _get_text_content(self, job_description) -> str:
+
+        if job_description.text_content is None:
+            raise ValueError("text_content for job_description is required for calculating score based on full job description")
 
-        if not job_description.html_content:
-            raise ValueError("html_content for job_description is required for calculating score based on full job description")
+        # Extracted when the page was fetched, truncated to avoid exceeding the 4kb of context.
+        return job_description.text_content[:self.max_characters_for_career_page_analysis]
 
-        # Cleaning the HTML content to extract only the text for better scoring.
-        text_content = BeautifulSoup(job_description.html_content, "html.parser").get_text(separator=" ", strip=True)
-        text_content = text_content[:self.max_characters_for_career_page_analysis] # Truncate the text content to avoid exeeding the 4kb of context.
+    def _get_skills(self, active_job_role) -> str:
+        # The most frequent keywords of the CV, indexed once when the CV was uploaded.
+        cv_keywords = sorted((active_job_role.cv_keywords or {}).items(), key=lambda item: -item[1])[:MAX_SKILLS_IN_PROMPT]
+        return ", ".join(keyword for keyword, _ in cv_keywords)
 
-        chat_request = (
+    def _get_full_job_description_prefix(self, active_job_role) -> str:
+
+        skills = self._get_skills(active_job_role)
+        skills_line = f"Candidate Skills: {skills}\n" if skills else ""
+
+        return (
             f"[INST] You are a professional Technical Recruiter."
             "Analyze the match between the provided Job Description and the Target Job Role."
             "Start your response with the score."
@@ -135,13 +279,21 @@ class ContentAnalyser:
             "Analysis: <gaps>\n"
             "\n"
             f"Target Job Role: {active_job_role.name}\n"
+            f"{skills_line}"
             "\n"
+        )
+
+    def _get_full_job_description_request(self, text_content, active_job_role) -> str:
+
+        return (
+            self._get_full_job_description_prefix(active_job_role) +
             f"Job Description: {text_content}\n"
             "\n"
             "[/INST] SCORE: " # The space after SCORE: is intentional to help the model understand that the score should come immediately after it without any other text in between.
         )
 
-        response = self._call_inference(type="full_job_description", chat_request=chat_request)
+    def _extract_score(self, response):
+        # Returns None when the answer has no parsable score.
 
         # Cleaning the response to extract only the score.
         response_content = response.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
@@ -151,10 +303,211 @@ class ContentAnalyser:
             score = int(score_str.group(1))
         except (ValueError, AttributeError):
             self.logger.write(f"WARNING: Inference's answer did not contain a valid score. Skipping the job opportunity.")
-            score = 0;
+            score = None
 
         if self.logger.verbose:
             self.logger.write(f"Inference API response: {response}")
             self.logger.write(f"Extracted score: {score}")
 
         return score
+
+    def _extract_batch_scores(self, response, size) -> list:
+        # Returns one score per numbered line, None where the answer has no parsable score.
+
+        response_content = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+        # The prompt ends with "1. SCORE: ", so the answer starts with the first score only.
+        response_content = "1. SCORE: " + response_content.upper()
+
+        scores = [None] * size
+        for match in re.finditer(r"^\s*(\d+)\s*[.):-]\s*(?:SCORE:\s*)?(\d+)", response_content, re.MULTILINE):
+            number, score = int(match.group(1)), int(match.group(2))
+            if 1 <= number <= size and scores[number - 1] is None and 0 <= score <= 100:
+                scores[number - 1] = score
+
+        if self.logger.verbose:
+            self.logger.write(f"Inference API response: {response}")
+            self.logger.write(f"Extracted scores: {scores}")
+
+        return scores
+
+    def _get_cache_key(self, type, active_job_role, text):
+        if not self.score_cache:
+            return None
+        # The skills of the CV are part of the full job description prompt, so they are part of its key too.
+        role = active_job_role.name
+        if type == "full_job_description":
+            role = f"{role}\x1f{self._get_skills(active_job_role)}"
+        # The model is the one the router sends this scoring type to.
+        return ScoreCache.make_key(type, role, text, self.inference_client.get_model_name(type) or self.model_name)
+
+    def _get_cached_score(self, cache_key):
+        if not cache_key:
+            return None
+        return self.score_cache.get(cache_key)
+
+    def _cache_score(self, cache_key, score) -> int:
+        # Unparsable answers score 0 and are not cached, so they are retried next time.
+        if score is None:
+            return 0
+        if cache_key:
+            self.score_cache.put(cache_key, score)
+        return score
+
+    async def _get_cached_score_async(self, cache_key):
+        # The score cache may query the database, it runs in a thread so that it does not block the crawl.
+        if not cache_key:
+            return None
+        return await asyncio.to_thread(self.score_cache.get, cache_key)
+
+    async def _cache_score_async(self, cache_key, score) -> int:
+        # Same as _cache_score, the flushes of the score cache committing to the database.
+        if score is None or not cache_key:
+            return self._cache_score(cache_key, score)
+        return await asyncio.to_thread(self._cache_score, cache_key, score)
+
+    def get_score_for_job_name(self, job_description, active_job_role) -> int:
+        # Calculate the score based on the job descriptions only.
+
+        cache_key = self._get_cache_key("job_name", active_job_role, job_description.description)
+        score = self._get_cached_score(cache_key)
+        if score is not None:
+            return score
+
+        chat_request = self._get_job_name_request(job_description, active_job_role)
+        response = self._call_inference(type="job_name", chat_request=chat_request, prefix=self._get_job_name_prefix(active_job_role))
+        return self._cache_score(cache_key, self._extract_score(response))
+
+    def get_score_for_full_job_description(self, job_description, active_job_role) -> int:
+        # Calculate the score based on the full job description.
+
+        text_content = self._get_text_content(job_description)
+        cache_key = self._get_cache_key("full_job_description", active_job_role, text_content)
+        score = self._get_cached_score(cache_key)
+        if score is not None:
+            return score
+
+        chat_request = self._get_full_job_description_request(text_content, active_job_role)
+        response = self._call_inference(type="full_job_description", chat_request=chat_request, prefix=self._get_full_job_description_prefix(active_job_role))
+        return self._cache_score(cache_key, self._extract_score(response))
+
+    async def get_score_for_job_name_async(self, job_description, active_job_role) -> int:
+        # Same as get_score_for_job_name, without blocking the event loop.
+
+        cache_key = self._get_cache_key("job_name", active_job_role, job_description.description)
+        score = await self._get_cached_score_async(cache_key)
+        if score is not None:
+            return score
+
+        chat_request = self._get_job_name_request(job_description, active_job_role)
+        response = await self._call_inference_async(type="job_name", chat_request=chat_request, prefix=self._get_job_name_prefix(active_job_role))
+        return await self._cache_score_async(cache_key, self._extract_score(response))
+
+    async def get_score_for_full_job_description_async(self, job_description, active_job_role) -> int:
+        # Same as get_score_for_full_job_description, without blocking the event loop.
+
+        text_content = self._get_text_content(job_description)
+        cache_key = self._get_cache_key("full_job_description", active_job_role, text_content)
+        score = await self._get_cached_score_async(cache_key)
+        if score is not None:
+            return score
+
+        chat_request = self._get_full_job_description_request(text_content, active_job_role)
+        response = await self._call_inference_async(type="full_job_description", chat_request=chat_request, prefix=self._get_full_job_description_prefix(active_job_role))
+        return await self._cache_score_async(cache_key, self._extract_score(response))
+
+    def _get_cached_job_name_scores(self, job_descriptions, active_job_role, mode):
+        # Returns the cache keys, the scores found in the cache (None when missing) and the indexes still to score.
+        # The batch prompt does not score like the single one, so its scores are cached under their own type.
+        type = "job_name_batch" if mode == "prompt" else "job_name"
+        cache_keys = [self._get_cache_key(type, active_job_role, job_description.description) for job_description in job_descriptions]
+        scores = [self._get_cached_score(cache_key) for cache_key in cache_keys]
+        missing = [index for index, score in enumerate(scores) if score is None]
+        return cache_keys, scores, missing
+
+    def get_scores_for_job_names(self, job_descriptions, active_job_role, batch_size=20, mode="prompt", max_workers=4) -> list[int]:
+        # Score many job names at once, returning a score per job description in the same order.
+        # "prompt" mode packs batch_size job names in each request, "concurrent" mode sends one request per job name in parallel.
+
+        cache_keys, scores, missing = self._get_cached_job_name_scores(job_descriptions, active_job_role, mode)
+
+        if mode == "concurrent":
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                missing_scores = executor.map(lambda index: self._get_score_for_job_name_or_zero(job_descriptions[index], active_job_role), missing)
+                for index, score in zip(missing, missing_scores):
+                    scores[index] = score
+            return scores
+
+        for start in range(0, len(missing), batch_size):
+            batch_indexes = missing[start:start + batch_size]
+            batch = [job_descriptions[index] for index in batch_indexes]
+            try:
+                response = self._call_inference(type="job_name_batch", chat_request=self._get_job_name_batch_request(batch, active_job_role), max_tokens=self._get_batch_max_tokens(batch), prefix=self._get_job_name_batch_prefix(active_job_role))
+                batch_scores = self._extract_batch_scores(response, len(batch))
+            except Exception as e:
+                self.logger.write(f"WARNING: Batch scoring failed ({str(e)}). Scoring the job names one by one.")
+                batch_scores = [None] * len(batch)
+
+            # Items the model did not score are scored individually.
+            for index, score in zip(batch_indexes, batch_scores):
+                if score is None:
+                    scores[index] = self._get_score_for_job_name_or_zero(job_descriptions[index], active_job_role)
+                else:
+                    scores[index] = self._cache_score(cache_keys[index], score)
+
+        return scores
+
+    async def get_scores_for_job_names_async(self, job_descriptions, active_job_role, batch_size=20, mode="prompt") -> list[int]:
+        # Same as get_scores_for_job_names, with the batches (or the single requests) sent concurrently.
+
+        cache_keys, scores, missing = await asyncio.to_thread(self._get_cached_job_name_scores, job_descriptions, active_job_role, mode)
+
+        if mode == "concurrent":
+            missing_scores = await asyncio.gather(*[
+                self._get_score_for_job_name_or_zero_async(job_descriptions[index], active_job_role)
+                for index in missing
+            ])
+        else:
+            batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+            batch_scores = await asyncio.gather(*[
+                self._get_batch_scores_async([job_descriptions[index] for index in batch_indexes], [cache_keys[index] for index in batch_indexes], active_job_role)
+                for batch_indexes in batches
+            ])
+            missing_scores = [score for batch in batch_scores for score in batch]
+
+        for index, score in zip(missing, missing_scores):
+            scores[index] = score
+        return scores
+
+    async def _get_batch_scores_async(self, batch, cache_keys, active_job_role) -> list[int]:
+
+        try:
+            response = await self._call_inference_async(type="job_name_batch", chat_request=self._get_job_name_batch_request(batch, active_job_role), max_tokens=self._get_batch_max_tokens(batch), prefix=self._get_job_name_batch_prefix(active_job_role))
+            scores = self._extract_batch_scores(response, len(batch))
+        except Exception as e:
+            self.logger.write(f"WARNING: Batch scoring failed ({str(e)}). Scoring the job names one by one.")
+            scores = [None] * len(batch)
+
+        # Items the model did not score are scored individually.
+        return list(await asyncio.gather(*[
+            self._cache_score_async(cache_key, score) if score is not None else self._get_score_for_job_name_or_zero_async(job_description, active_job_role)
+            for job_description, cache_key, score in zip(batch, cache_keys, scores)
+        ]))
+
+    def _get_batch_max_tokens(self, batch) -> int:
+        # Around 8 tokens per "<n>. SCORE: <score>" line, plus some slack.
+        return 8 * len(batch) + 16
+
+    def _get_score_for_job_name_or_zero(self, job_description, active_job_role) -> int:
+        try:
+            return self.get_score_for_job_name(job_description, active_job_role)
+        except Exception as e:
+            self.logger.write(f"WARNING: Scoring failed for '{job_description.description}' ({str(e)}). Skipping the job opportunity.")
+            return 0
+
+    async def _get_score_for_job_name_or_zero_async(self, job_description, active_job_role) -> int:
+        try:
+            return await self.get_score_for_job_name_async(job_description, active_job_role)
+        except Exception as e:
+            self.logger.write(f"WARNING: Scoring failed for '{job_description.description}' ({str(e)}). Skipping the job opportunity.")
+            return 0
@@ -0,0 +1,118 @@
+"""CrawlArchive class recording the pages and the inference answers of a search, to replay it offline"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Kinds of recorded responses: the HTML of a page, the JSON answer of a job board API and an inference answer.
+PAGE = "page"
+API = "api"
+INFERENCE = "inference"
+
+# Inference request fields left out of the key, so that a recorded answer replays whatever the model, the streaming
+# or the server slot the router pinned the request to.
+INFERENCE_KEY_EXCLUDED_FIELDS = ["model", "stream", "id_slot"]
+
+
+class CrawlArchive:
+    """Local archive of the responses of a search, one gzipped JSON file per response
+
+    Recording stores every page, API answer and inference answer as it comes, with the watchlist it came from.
+    Replaying serves the pages and the API answers from the archive and never goes to the network, a response
+    missing from the archive failing like an unreachable page. The inference answers are replayed by the stub
+    inference server, so that the inference client stays in the replayed path.
+    """
+
+    def __init__(self, logger, directory, mode=REPLAY):
+        if mode not in [RECORD, REPLAY]:
+            raise ValueError(f"mode must be '{RECORD}' or '{REPLAY}'")
+        self.logger = logger
+        self.directory = Path(directory)
+        self.mode = mode
+        if mode == RECORD:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        elif not self.directory.is_dir():
+            raise ValueError(f"Crawl archive {self.directory} not found")
+
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.records = Counter()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @staticmethod
+    def make_inference_key(inference_json) -> str:
+        request = {field: value for field, value in inference_json.items() if field not in INFERENCE_KEY_EXCLUDED_FIELDS}
+        return json.dumps(request, sort_keys=True)
+
+    def _get_path(self, kind, key) -> Path:
+        return self.directory / kind / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.json.gz"
+
+    def get(self, kind, key):
+        """The response recorded for key, None when it was not recorded"""
+        path = self._get_path(kind, key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+                value = json.load(archive_file)["value"]
+        except FileNotFoundError:
+            with self.lock:
+                self.misses[kind] += 1
+            return None
+
+        with self.lock:
+            self.hits[kind] += 1
+        return value
+
+    def put(self, kind, key, value):
+        # Written to a temporary file first, so that a response recorded twice at the same time is never half written.
+        path = self._get_path(kind, key)
+        path.parent.mkdir(exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with gzip.open(temporary_path, "wt", encoding="utf-8") as archive_file:
+                json.dump({"key": key, "value": value}, archive_file)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            self.logger.write(f"  Error recording {key[:200]} in the crawl archive: {str(e)}")
+            return
+
+        with self.lock:
+            self.records[kind] += 1
+
+    def record_watchlist(self, watchlist):
+        """Add the urls of the watchlist ({url: [entries]}) to the recorded watchlist"""
+        with self.lock:
+            recorded = {entry["url"]: entry for entry in self.get_watchlist()}
+            for url, entries in watchlist.items():
+                recorded[url] = {"url": url, "page_type": next((entry.page_type for entry in entries if entry.page_type), None)}
+            with open(self.directory / "watchlist.json", "w", encoding="utf-8") as watchlist_file:
+                json.dump(list(recorded.values()), watchlist_file, indent=2)
+
+    def get_watchlist(self) -> list[dict]:
+        """The recorded watchlist, as a list of {"url", "page_type"}"""
+        path = self.directory / "watchlist.json"
+        if not path.exists():
+            return []
+        with open(path, encoding="utf-8") as watchlist_file:
+            return json.load(watchlist_file)
+
+    def write_summary(self):
+        kinds = [PAGE, API, INFERENCE]
+        if self.recording:
+            self.logger.write(f"Crawl archive {self.directory}: recorded {', '.join(f'{self.records[kind]} {kind}' for kind in kinds)}")
+        else:
+            self.logger.write(f"Crawl archive {self.directory}: replayed {', '.join(f'{self.hits[kind]} {kind}' for kind in kinds)}, {sum(self.misses.values())} missing")
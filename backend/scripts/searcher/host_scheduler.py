@@ -0,0 +1,222 @@
+"""HostScheduler class spacing the requests of a crawl per host, to stay under the rate limits of the job boards"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import requests
+from .browser_pool import USER_AGENT
+
+# Answers of a host asking the crawler to slow down.
+THROTTLING_STATUS_CODES = [429, 503]
+
+
+def get_host(url) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def interleave_by_host(urls) -> list:
+    """The urls in round robin across their hosts, so that consecutive urls are on different hosts when possible"""
+
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(get_host(url), []).append(url)
+
+    # The hosts with the most urls first, so that they are spread over the whole crawl.
+    queues = sorted(by_host.values(), key=len, reverse=True)
+    interleaved = []
+    for index in range(len(queues[0]) if queues else 0):
+        interleaved += [queue[index] for queue in queues if index < len(queue)]
+    return interleaved
+
+
+class _Host:
+
+    def __init__(self, rate, max_rate, burst):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.crawl_delay = None
+        self.robots_checked = False
+        self.throttled_in_a_row = 0
+
+        # Counters reported at the end of the session.
+        self.requests = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+
+class HostScheduler:
+    """Token bucket per host, honouring the robots.txt crawl delay and adapting to the answers of the host
+
+    Each request to a host takes a token, the tokens coming back at the rate of the host up to its burst. The rate
+    grows slowly while the host answers fast, is halved on a 429 or 503 answer (the host being paused for its
+    Retry-After) and lowered when the host gets slow. It never goes above the crawl delay of the robots.txt of the host.
+    """
+
+    def __init__(self, logger, rate=1.0, burst=3, max_rate=None, min_rate=0.05, slow_seconds=5.0, max_pause_seconds=300.0, timeout=10):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate or rate * 2
+        self.min_rate = min(min_rate, rate)
+        self.slow_seconds = slow_seconds
+        self.max_pause_seconds = max_pause_seconds
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _get_host(self, host) -> _Host:
+        if host not in self.hosts:
+            self.hosts[host] = _Host(self.rate, self.max_rate, self.burst)
+        return self.hosts[host]
+
+    def _should_check_robots(self, url) -> bool:
+        # A single check per host, even when several requests start at the same time.
+        with self.lock:
+            host = self._get_host(get_host(url))
+            if host.robots_checked:
+                return False
+            host.robots_checked = True
+            return True
+
+    def _check_robots(self, url):
+        # The crawl delay of the robots.txt of the host caps its rate, a missing or unreadable robots.txt has none.
+
+        url_parts = urlsplit(url)
+        robots_url = f"{url_parts.scheme}://{url_parts.netloc}/robots.txt"
+        try:
+            response = requests.get(robots_url, headers={"User-Agent": USER_AGENT}, timeout=self.timeout)
+        except requests.RequestException:
+            return
+        if response.status_code != 200:
+            return
+
+        robots = RobotFileParser()
+        robots.parse(response.text.splitlines())
+        crawl_delay = robots.crawl_delay(USER_AGENT)
+        if not crawl_delay:
+            return
+
+        crawl_delay = float(crawl_delay)
+        with self.lock:
+            host = self._get_host(get_host(url))
+            host.crawl_delay = crawl_delay
+            host.max_rate = min(host.max_rate, 1 / crawl_delay)
+            host.rate = min(host.rate, host.max_rate)
+            host.burst = 1
+            host.tokens = min(host.tokens, 1.0)
+        self.logger.write(f"  {get_host(url)}: crawl delay of {crawl_delay:g} seconds in robots.txt")
+
+    def _reserve(self, url) -> float:
+        # Takes a token of the host, returns the seconds to wait before the request. The tokens may go below zero,
+        # the requests waiting in turn for theirs.
+
+        now = time.monotonic()
+        with self.lock:
+            host = self._get_host(get_host(url))
+            host.tokens = min(float(host.burst), host.tokens + (now - host.updated) * host.rate)
+            host.updated = now
+            host.tokens -= 1
+            host.requests += 1
+            wait_seconds = max(0.0, -host.tokens / host.rate, host.paused_until - now)
+            host.wait_seconds += wait_seconds
+            return wait_seconds
+
+    def _get_ready_seconds(self, url) -> float:
+        # Seconds before the host has a token again, without taking it.
+        now = time.monotonic()
+        with self.lock:
+            host = self._get_host(get_host(url))
+            tokens = min(float(host.burst), host.tokens + (now - host.updated) * host.rate)
+            return max(0.0, (1 - tokens) / host.rate, host.paused_until - now)
+
+    async def wait_ready_async(self, url):
+        """Wait until the host of url has a token, without taking it, so that a crawl slot is only taken once the
+        host can be requested"""
+        if self._should_check_robots(url):
+            await asyncio.to_thread(self._check_robots, url)
+        while (wait_seconds := self._get_ready_seconds(url)) > 0:
+            await asyncio.sleep(wait_seconds)
+
+    def acquire(self, url):
+        """Wait for the turn of a request to url"""
+        if self._should_check_robots(url):
+            self._check_robots(url)
+        wait_seconds = self._reserve(url)
+        if wait_seconds:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, url):
+        """Same as acquire, without blocking the event loop"""
+        if self._should_check_robots(url):
+            await asyncio.to_thread(self._check_robots, url)
+        wait_seconds = self._reserve(url)
+        if wait_seconds:
+            await asyncio.sleep(wait_seconds)
+
+    def _get_retry_after_seconds(self, retry_after):
+        # Retry-After is either a number of seconds or an HTTP date.
+        if not retry_after:
+            return None
+        if retry_after.strip().isdigit():
+            return float(retry_after)
+        try:
+            return (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+
+    def record(self, url, status_code=None, latency_seconds=None, retry_after=None):
+        """Adapt the rate of the host of url to an answer, status_code None for a request that failed"""
+
+        now = time.monotonic()
+        with self.lock:
+            host = self._get_host(get_host(url))
+
+            if status_code in THROTTLING_STATUS_CODES:
+                # Multiplicative decrease, and a pause of Retry-After or of a backoff doubling on each throttled answer in a row.
+                host.throttled += 1
+                host.throttled_in_a_row += 1
+                host.rate = max(self.min_rate, host.rate / 2)
+                host.tokens = min(host.tokens, 0.0)
+                pause_seconds = self._get_retry_after_seconds(retry_after)
+                if pause_seconds is None:
+                    pause_seconds = 2 ** host.throttled_in_a_row
+                pause_seconds = min(max(pause_seconds, 0.0), self.max_pause_seconds)
+                host.paused_until = max(host.paused_until, now + pause_seconds)
+                message = f"  {get_host(url)}: throttled ({status_code}), rate lowered to {host.rate:.2f} requests per second, paused for {pause_seconds:.0f} seconds"
+
+            elif latency_seconds is not None and latency_seconds > self.slow_seconds:
+                host.rate = max(self.min_rate, host.rate * 0.75)
+                message = None
+
+            else:
+                # Additive increase while the host answers fast.
+                host.throttled_in_a_row = 0
+                if status_code is not None and status_code < 500:
+                    host.rate = min(host.max_rate, host.rate + self.rate / 10)
+                message = None
+
+        if message:
+            self.logger.write(message)
+
+    def write_summary(self):
+        with self.lock:
+            hosts = list(self.hosts.items())
+        throttled = sum(host.throttled for _, host in hosts)
+        wait_seconds = sum(host.wait_seconds for _, host in hosts)
+        self.logger.write(f"Host scheduler: {sum(host.requests for _, host in hosts)} requests to {len(hosts)} hosts, {throttled} throttled answers, {wait_seconds:.2f} seconds waited")
+        if self.logger.verbose:
+            for name, host in sorted(hosts, key=lambda item: item[1].requests, reverse=True):
+                self.logger.write(f"  {name}: {host.requests} requests, rate {host.rate:.2f} per second{f', crawl delay {host.crawl_delay:g} seconds' if host.crawl_delay else ''}, {host.throttled} throttled, {host.wait_seconds:.2f} seconds waited")
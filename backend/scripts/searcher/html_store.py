@@ -0,0 +1,56 @@
+"""HtmlStore class keeping the raw HTML of the fetched pages on disk, compressed, for debugging"""
+
+import gzip
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+class HtmlStore:
+    """Gzipped HTML of each fetched page, one file per url named after its hash
+
+    The pages are written as they are fetched, so the searcher never holds them in memory for longer than the
+    extraction of their text.
+    """
+
+    def __init__(self, logger, directory, compresslevel=6):
+        self.logger = logger
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.bytes_written = 0
+
+    def get_path(self, url) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]}.html.gz"
+
+    def put(self, url, html_content):
+        # Written to a temporary file first, so that a page fetched twice at the same time is never half written.
+        path = self.get_path(url)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with gzip.open(temporary_path, "wt", encoding="utf-8", compresslevel=self.compresslevel) as html_file:
+                html_file.write(f"<!-- {url} -->\n")
+                html_file.write(html_content)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            self.logger.write(f"  Error storing the HTML of {url}: {str(e)}")
+            return
+
+        with self.lock:
+            self.pages += 1
+            self.bytes_written += path.stat().st_size
+
+    def get(self, url):
+        """The HTML stored for url, None when the page was not stored"""
+        path = self.get_path(url)
+        if not path.exists():
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as html_file:
+            html_file.readline()
+            return html_file.read()
+
+    def write_summary(self):
+        self.logger.write(f"HTML store: {self.pages} pages written to {self.directory} ({self.bytes_written / 1024:.0f} KB compressed)")
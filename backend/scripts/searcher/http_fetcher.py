@@ -0,0 +1,226 @@
+"""HttpFetcher class for fetching pages without the headless browser when they do not need rendering"""
+
+import asyncio
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from .browser_pool import USER_AGENT
+from .host_scheduler import THROTTLING_STATUS_CODES
+
+HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# Per page type rules telling when a plain HTTP answer is good enough, a page missing the selector is rendered by the browser.
+# "career_page" applies to the job board, "job_description" to the job detail pages.
+RENDERING_RULES = {
+    "ashbyhq": {
+        "career_page": "a[href^='/']",
+        "job_description": None,
+    },
+}
+
+# Markers of pages that only render with JavaScript enabled.
+JAVASCRIPT_REQUIRED_MARKERS = [
+    "enable javascript",
+    "javascript is required",
+    "you need to enable javascript",
+]
+
+HTTP_TIER = "http"
+BROWSER_TIER = "browser"
+
+
+class HostThrottledError(Exception):
+    """Raised when the host answers with a throttling status, the page being skipped rather than rendered by the browser"""
+
+    def __init__(self, url, status_code):
+        super().__init__(f"{url} throttled the crawl (status code {status_code})")
+        self.status_code = status_code
+
+
+class HttpFetcher:
+    """Keep-alive HTTP session fetching pages, telling when the browser is needed instead"""
+
+    def __init__(self, logger, timeout=30, min_text_characters=500, max_connections=10, scheduler=None):
+        self.logger = logger
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.min_text_characters = min_text_characters
+        self.max_connections = max_connections
+        self.session = None
+        self.client = None
+
+        # The tier that served each url, and the counters reported at the end of the session.
+        self.tiers = {}
+        self.fetches = 0
+        self.escalations = 0
+        self.throttled = 0
+        self.fetch_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def needs_rendering(self, page_type, html_content, kind="job_description") -> bool:
+        # True when the page served over HTTP does not look complete, so it has to be rendered by the browser.
+
+        if not html_content or not html_content.strip():
+            return True
+
+        soup = BeautifulSoup(html_content, "html.parser")
+
+        rules = RENDERING_RULES.get(page_type, {})
+        selector = rules.get(kind)
+        if selector and not soup.select_one(selector):
+            return True
+
+        for element in soup(["script", "style", "noscript", "template"]):
+            element.decompose()
+        text_content = soup.get_text(separator=" ", strip=True)
+
+        if kind == "job_description" and len(text_content) < self.min_text_characters:
+            return True
+
+        lowered_text_content = text_content.lower()
+        if len(text_content) < 2 * self.min_text_characters and any(marker in lowered_text_content for marker in JAVASCRIPT_REQUIRED_MARKERS):
+            return True
+
+        return False
+
+    def _get_html_content(self, url, response):
+        # Returns the body of an HTML answer, None when the answer can't be used as it is. A throttled answer raises
+        # HostThrottledError, the browser would only hit the host again while it asks to slow down.
+
+        if response.status_code in THROTTLING_STATUS_CODES:
+            self.throttled += 1
+            raise HostThrottledError(url, response.status_code)
+        if response.status_code != 200:
+            if self.logger.verbose:
+                self.logger.write(f"  HTTP fetch of {url} returned status code {response.status_code}")
+            return None
+        if "html" not in response.headers.get("Content-Type", "html").lower():
+            return None
+        return response.text
+
+    def _get_session(self):
+        if not self.session:
+            self.session = requests.Session()
+            self.session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=self.max_connections, pool_maxsize=self.max_connections)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def _get_client(self):
+        # Created on first use, inside the running event loop.
+        if not self.client:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self.client = httpx.AsyncClient(headers=HEADERS, limits=limits, timeout=self.timeout, follow_redirects=True)
+        return self.client
+
+    def _record_answer(self, url, response, start):
+        # The host scheduler adapts the rate of the host to its answers, a failed request having none.
+        if self.scheduler:
+            self.scheduler.record(url, response.status_code if response is not None else None, time.perf_counter() - start,
+                                  response.headers.get("Retry-After") if response is not None else None)
+
+    def _get(self, url, **kwargs):
+        if self.scheduler:
+            self.scheduler.acquire(url)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self._get_session().get(url, timeout=self.timeout, **kwargs)
+            return response
+        finally:
+            self._record_answer(url, response, start)
+
+    async def _get_async(self, url, **kwargs):
+        if self.scheduler:
+            await self.scheduler.acquire_async(url)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self._get_client().get(url, **kwargs)
+            return response
+        finally:
+            self._record_answer(url, response, start)
+
+    def get_json(self, url):
+        response = self._get(url, headers={"Accept": "application/json"})
+        response.raise_for_status()
+        return response.json()
+
+    async def get_json_async(self, url):
+        response = await self._get_async(url, headers={"Accept": "application/json"})
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(self, url, page_type, kind="job_description"):
+        """Return the HTML content of url, or None when the page has to be rendered by the browser
+
+        Raises HostThrottledError when the host answers with a throttling status.
+        """
+
+        fetch_start = time.perf_counter()
+        try:
+            response = self._get(url, allow_redirects=True)
+            html_content = self._get_html_content(url, response)
+        except requests.RequestException as e:
+            if self.logger.verbose:
+                self.logger.write(f"  HTTP fetch of {url} failed: {str(e)}")
+            html_content = None
+        finally:
+            self.fetch_seconds += time.perf_counter() - fetch_start
+
+        return self._record(url, html_content, html_content is None or self.needs_rendering(page_type, html_content, kind))
+
+    async def fetch_async(self, url, page_type, kind="job_description"):
+        """Same as fetch, through a shared async HTTP client"""
+
+        fetch_start = time.perf_counter()
+        try:
+            response = await self._get_async(url)
+            html_content = self._get_html_content(url, response)
+        except httpx.HTTPError as e:
+            if self.logger.verbose:
+                self.logger.write(f"  HTTP fetch of {url} failed: {str(e)}")
+            html_content = None
+        finally:
+            self.fetch_seconds += time.perf_counter() - fetch_start
+
+        # The page is parsed in a thread, so that a large page does not hold the other fetches of the crawl.
+        needs_rendering = html_content is None or await asyncio.to_thread(self.needs_rendering, page_type, html_content, kind)
+        return self._record(url, html_content, needs_rendering)
+
+    def _record(self, url, html_content, needs_rendering):
+
+        self.fetches += 1
+        if needs_rendering:
+            self.escalations += 1
+            self.tiers[url] = BROWSER_TIER
+            return None
+
+        self.tiers[url] = HTTP_TIER
+        return html_content
+
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    async def aclose(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    def write_summary(self):
+        self.logger.write(f"HTTP fetches: {self.fetches} ({self.fetches - self.escalations} served over HTTP, {self.escalations} rendered by the browser, {self.throttled} throttled, {self.fetch_seconds:.2f} seconds)")
@@ -0,0 +1,247 @@
+"""InferenceClient class sharing pooled connections to an inference server across a search session"""
+
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Answers worth retrying, the server is overloaded or restarting.
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class InferenceError(Exception):
+    """Raised when the inference server can't answer a request"""
+
+
+class InferenceUnavailableError(InferenceError):
+    """Raised when the inference server is still failing after the retries"""
+
+
+class InferenceClient:
+    """Keep-alive connection pool to one inference server, with bounded in-flight requests and retries"""
+
+    def __init__(self, logger, inference_url, timeout, max_in_flight=4, max_retries=3, backoff_seconds=1.0, max_backoff_seconds=30.0, health_check_path="/health"):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.logger = logger
+        self.inference_url = inference_url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json"}
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        url_parts = urlsplit(inference_url)
+        self.health_check_url = f"{url_parts.scheme}://{url_parts.netloc}{health_check_path}"
+
+        self.session = None
+        self.client = None
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.async_slots = None
+        self.lock = threading.Lock()
+
+        # Requests waiting or in flight, for the load balancing.
+        self.outstanding = 0
+
+        # Counters reported at the end of the session.
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.first_token_calls = 0
+        self.first_token_seconds = 0.0
+
+    def _get_session(self):
+        if not self.session:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def _get_client(self):
+        # Created on first use, inside the running event loop.
+        if not self.client:
+            limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+            self.client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(self.timeout, pool=None))
+            self.async_slots = asyncio.Semaphore(self.max_in_flight)
+        return self.client
+
+    def _get_backoff(self, attempt, retry_after=None) -> float:
+        # Exponential backoff with full jitter, unless the server tells how long to wait.
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff_seconds)
+        return random.uniform(0, min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds))
+
+    def _add_outstanding(self, count):
+        with self.lock:
+            self.outstanding += count
+
+    def _record_success(self, latency_seconds, answer=None):
+        # llama.cpp servers tell how many prompt tokens were evaluated, the others came from the prompt cache.
+        usage = (answer or {}).get("usage") or {}
+        timings = (answer or {}).get("timings") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        cached_prompt_tokens = max(prompt_tokens - timings["prompt_n"], 0) if "prompt_n" in timings else 0
+
+        with self.lock:
+            self.calls += 1
+            self.latency_seconds += latency_seconds
+            self.max_latency_seconds = max(self.max_latency_seconds, latency_seconds)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += usage.get("completion_tokens") or 0
+            self.cached_prompt_tokens += cached_prompt_tokens
+            if "prompt_ms" in timings:
+                self._record_first_token(timings["prompt_ms"] / 1000)
+
+        if self.logger.verbose:
+            self.logger.write(f"Inference call to {self.inference_url}: {latency_seconds:.2f} seconds, {usage.get('prompt_tokens', '?')} prompt tokens ({cached_prompt_tokens} cached), {usage.get('completion_tokens', '?')} completion tokens")
+
+    def _record_first_token(self, seconds):
+        self.first_token_calls += 1
+        self.first_token_seconds += seconds
+
+    def _timed_lines(self, lines, start):
+        # Time to first token of a streamed answer.
+        first_line = True
+        for line in lines:
+            if first_line and line:
+                first_line = False
+                with self.lock:
+                    self._record_first_token(time.perf_counter() - start)
+            yield line
+
+    async def _timed_lines_async(self, lines, start):
+        first_line = True
+        async for line in lines:
+            if first_line and line:
+                first_line = False
+                self._record_first_token(time.perf_counter() - start)
+            yield line
+
+    def _get_retry(self, attempt, error, retry_after=None) -> float:
+        # Returns the seconds to wait before the next attempt, raises when out of attempts.
+
+        with self.lock:
+            self.failures += 1
+            if attempt >= self.max_retries:
+                raise InferenceUnavailableError(f"{self.inference_url}: {str(error)}")
+            self.retries += 1
+        return self._get_backoff(attempt, retry_after)
+
+    def post(self, inference_json, read_stream=None) -> dict:
+        """Send an inference request and return the answer, read_stream reads it when it comes as a server-sent event stream"""
+
+        self._add_outstanding(1)
+        try:
+            with self.slots:
+
+                for attempt in range(self.max_retries + 1):
+
+                    start = time.perf_counter()
+                    retry_after = None
+                    try:
+                        with self._get_session().post(self.inference_url, headers=self.headers, json=inference_json, timeout=self.timeout, stream=bool(read_stream)) as response:
+
+                            if response.status_code == 200:
+                                if read_stream and response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                                    answer = read_stream(self._timed_lines(response.iter_lines(decode_unicode=True), start))
+                                else:
+                                    answer = response.json()
+                                self._record_success(time.perf_counter() - start, answer)
+                                return answer
+
+                            error = InferenceError(f"API returned status code {response.status_code}: {response.text}")
+                            if response.status_code not in RETRYABLE_STATUS_CODES:
+                                raise error
+                            retry_after = response.headers.get("Retry-After")
+
+                    except (requests.ConnectionError, requests.Timeout) as e:
+                        error = e
+
+                    time.sleep(self._get_retry(attempt, error, retry_after))
+        finally:
+            self._add_outstanding(-1)
+
+    async def post_async(self, inference_json, read_stream=None) -> dict:
+        """Same as post, read_stream being a coroutine reading the async lines of the stream"""
+
+        client = self._get_client()
+
+        self._add_outstanding(1)
+        try:
+            async with self.async_slots:
+
+                for attempt in range(self.max_retries + 1):
+
+                    start = time.perf_counter()
+                    retry_after = None
+                    try:
+                        async with client.stream("POST", self.inference_url, headers=self.headers, json=inference_json) as response:
+
+                            if response.status_code == 200:
+                                if read_stream and response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                                    answer = await read_stream(self._timed_lines_async(response.aiter_lines(), start))
+                                else:
+                                    await response.aread()
+                                    answer = response.json()
+                                self._record_success(time.perf_counter() - start, answer)
+                                return answer
+
+                            await response.aread()
+                            error = InferenceError(f"API returned status code {response.status_code}: {response.text}")
+                            if response.status_code not in RETRYABLE_STATUS_CODES:
+                                raise error
+                            retry_after = response.headers.get("Retry-After")
+
+                    except httpx.TransportError as e:
+                        error = e
+
+                    await asyncio.sleep(self._get_retry(attempt, error, retry_after))
+        finally:
+            self._add_outstanding(-1)
+
+    def is_healthy(self) -> bool:
+        # Servers without a health check answer 404, which still tells they are up.
+        try:
+            return self._get_session().get(self.health_check_url, timeout=min(self.timeout, 5)).status_code < 500
+        except requests.RequestException:
+            return False
+
+    async def is_healthy_async(self) -> bool:
+        try:
+            return (await self._get_client().get(self.health_check_url, timeout=min(self.timeout, 5))).status_code < 500
+        except httpx.HTTPError:
+            return False
+
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    async def aclose(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+            self.async_slots = None
+
+    def write_summary(self):
+        average_latency_seconds = self.latency_seconds / self.calls if self.calls else 0.0
+        self.logger.write(f"Inference calls to {self.inference_url}: {self.calls} (average: {average_latency_seconds:.2f} seconds, max: {self.max_latency_seconds:.2f} seconds, {self.retries} retries, {self.failures} failed attempts)")
+        self.logger.write(f"Inference tokens from {self.inference_url}: {self.prompt_tokens} prompt ({self.get_prompt_cache_hit_rate():.0%} cached), {self.completion_tokens} completion, {self.get_average_first_token_seconds():.3f} seconds to first token")
+
+    def get_prompt_cache_hit_rate(self) -> float:
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def get_average_first_token_seconds(self) -> float:
+        return self.first_token_seconds / self.first_token_calls if self.first_token_calls else 0.0
@@ -0,0 +1,233 @@
+"""InferenceRouter class balancing the inference requests across model servers"""
+
+import asyncio
+import hashlib
+import json
+import math
+import threading
+import time
+from .inference_client import InferenceClient, InferenceError, InferenceUnavailableError
+
+# Scoring types routed like another one, the job names scored in batches go to the job name models.
+ROUTED_AS = {"job_name_batch": "job_name"}
+
+
+class _Endpoint:
+    """One model server with its connection pool, routing settings and health"""
+
+    def __init__(self, client, model_name=None, weight=1.0, types=None, slots=None):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+
+        self.client = client
+        self.model_name = model_name
+        self.weight = weight
+        self.types = types
+        self.slots = slots
+        self.slot_requests = [0] * (slots or 0)
+        self.down_until = 0.0
+
+    def serves(self, type) -> bool:
+        return not self.types or type is None or ROUTED_AS.get(type, type) in self.types
+
+    def get_load(self) -> float:
+        return (self.client.outstanding + 1) / self.weight
+
+    def is_full(self) -> bool:
+        return self.client.outstanding >= self.client.max_in_flight
+
+    def get_affinity(self, prefix_key) -> float:
+        # Weighted rendezvous hashing, a prefix keeps going to the same endpoint as long as it is healthy.
+        hash_value = int(hashlib.sha256(f"{prefix_key}\x1f{self.client.inference_url}".encode("utf-8")).hexdigest()[:8], 16)
+        return -self.weight / math.log((hash_value + 1) / (2 ** 32 + 1))
+
+
+class InferenceRouter:
+    """Dispatches inference requests to the least loaded healthy endpoint serving the scoring type
+
+    Requests sharing a prompt prefix stick to the same endpoint (and slot, when the endpoint declares its slots)
+    unless it is full, so the server reuses its prompt cache. A request whose slot is busy goes to a free slot, or to
+    the one chosen by the server when none is free. When every endpoint is down the search pauses until the next
+    health check, instead of failing the career pages.
+    """
+
+    def __init__(self, logger, endpoints, pause_seconds=60.0, max_pauses=5, prefix_affinity=True):
+        if not endpoints:
+            raise ValueError("at least one endpoint is required")
+
+        self.logger = logger
+        self.endpoints = endpoints
+        self.pause_seconds = pause_seconds
+        self.max_pauses = max_pauses
+        self.prefix_affinity = prefix_affinity
+        self.lock = threading.Lock()
+        self.pauses = 0
+
+    @classmethod
+    def from_config(cls, logger, config_path, default_url, default_model_name, timeout, max_in_flight=4, max_retries=3, prefix_affinity=True):
+        """Build the router from a JSON list of endpoints, or a single endpoint from the defaults when config_path is None
+
+        An endpoint is {"url": ..., "model": ..., "weight": 1, "max_in_flight": 4, "types": ["job_name", ...], "slots": 4},
+        only url is required, an endpoint without types serves all the scoring types and slots is the number of
+        llama.cpp server slots the prompt prefixes are pinned to.
+        """
+
+        if config_path:
+            with open(config_path) as config_file:
+                endpoints_config = json.load(config_file)
+        else:
+            endpoints_config = [{"url": default_url, "model": default_model_name}]
+
+        endpoints = [
+            _Endpoint(
+                InferenceClient(logger, endpoint_config["url"], timeout, max_in_flight=endpoint_config.get("max_in_flight", max_in_flight), max_retries=max_retries),
+                model_name=endpoint_config.get("model", default_model_name),
+                weight=float(endpoint_config.get("weight", 1)),
+                types=endpoint_config.get("types"),
+                slots=endpoint_config.get("slots"),
+            )
+            for endpoint_config in endpoints_config
+        ]
+        return cls(logger, endpoints, prefix_affinity=prefix_affinity)
+
+    def get_model_name(self, type):
+        """The model scoring this type, part of the score cache key"""
+        model_names = sorted({endpoint.model_name or "" for endpoint in self.endpoints if endpoint.serves(type)})
+        return ",".join(model_names) or None
+
+    def _get_candidates(self, type):
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(type)]
+        if not candidates:
+            raise InferenceError(f"No inference endpoint serves '{type}'")
+        return candidates
+
+    def _pick(self, type, now, prefix_key=None):
+        # The healthy endpoint of the prefix, or the one with the least outstanding requests for its weight.
+        # Returns the down endpoints, by time of their next health check, when none is healthy.
+
+        candidates = self._get_candidates(type)
+        with self.lock:
+            healthy = [endpoint for endpoint in candidates if endpoint.down_until <= now]
+            if not healthy:
+                return None, sorted(candidates, key=lambda endpoint: endpoint.down_until)
+            if self.prefix_affinity and prefix_key:
+                preferred = max(healthy, key=lambda endpoint: endpoint.get_affinity(prefix_key))
+                if not preferred.is_full():
+                    return preferred, []
+            return min(healthy, key=lambda endpoint: endpoint.get_load()), []
+
+    def _mark_down(self, endpoint, error):
+        with self.lock:
+            endpoint.down_until = time.monotonic() + self.pause_seconds
+        self.logger.write(f"WARNING: Inference endpoint {endpoint.client.inference_url} failing ({str(error)}). Not used for {self.pause_seconds:.0f} seconds.")
+
+    def _get_pause(self, endpoints, pauses, now) -> float:
+        # Every endpoint is down, the search waits for the first one to be checked again.
+        if pauses > self.max_pauses:
+            raise InferenceUnavailableError(f"Inference endpoints still failing after {self.max_pauses} pauses")
+        with self.lock:
+            self.pauses += 1
+        pause = max(endpoints[0].down_until - now, 0.0)
+        self.logger.write(f"WARNING: All inference endpoints are down. Pausing the search for {pause:.0f} seconds.")
+        return pause
+
+    def _acquire_slot(self, endpoint, prefix_key=None):
+        # The slot of the prefix when it is free, else a free slot, None leaving the choice to the server.
+        if not (self.prefix_affinity and prefix_key and endpoint.slots):
+            return None
+        with self.lock:
+            slot = int(prefix_key, 16) % endpoint.slots
+            if endpoint.slot_requests[slot]:
+                slot = next((free_slot for free_slot, requests in enumerate(endpoint.slot_requests) if not requests), None)
+                if slot is None:
+                    return None
+            endpoint.slot_requests[slot] += 1
+            return slot
+
+    def _release_slot(self, endpoint, slot):
+        if slot is None:
+            return
+        with self.lock:
+            endpoint.slot_requests[slot] -= 1
+
+    def _for_endpoint(self, inference_json, endpoint, slot=None) -> dict:
+        inference_json = dict(inference_json)
+        if endpoint.model_name:
+            inference_json["model"] = endpoint.model_name
+        if slot is not None:
+            inference_json["id_slot"] = slot
+        return inference_json
+
+    def _set_health(self, endpoint, healthy):
+        with self.lock:
+            endpoint.down_until = 0.0 if healthy else time.monotonic() + self.pause_seconds
+        if healthy:
+            self.logger.write(f"Inference endpoint {endpoint.client.inference_url} is back.")
+
+    def post(self, inference_json, read_stream=None, type=None, prefix_key=None) -> dict:
+        """Send an inference request to the best endpoint for the scoring type, moving to another one when it fails"""
+
+        pauses = 0
+        while True:
+
+            now = time.monotonic()
+            endpoint, down_endpoints = self._pick(type, now, prefix_key)
+
+            if not endpoint:
+                pauses += 1
+                time.sleep(self._get_pause(down_endpoints, pauses, now))
+                continue
+
+            # An endpoint that was down is checked before getting requests again.
+            if endpoint.down_until:
+                self._set_health(endpoint, endpoint.client.is_healthy())
+                continue
+
+            slot = self._acquire_slot(endpoint, prefix_key)
+            try:
+                return endpoint.client.post(self._for_endpoint(inference_json, endpoint, slot), read_stream=read_stream)
+            except InferenceUnavailableError as e:
+                self._mark_down(endpoint, e)
+            finally:
+                self._release_slot(endpoint, slot)
+
+    async def post_async(self, inference_json, read_stream=None, type=None, prefix_key=None) -> dict:
+        """Same as post, without blocking the event loop"""
+
+        pauses = 0
+        while True:
+
+            now = time.monotonic()
+            endpoint, down_endpoints = self._pick(type, now, prefix_key)
+
+            if not endpoint:
+                pauses += 1
+                await asyncio.sleep(self._get_pause(down_endpoints, pauses, now))
+                continue
+
+            # An endpoint that was down is checked before getting requests again.
+            if endpoint.down_until:
+                self._set_health(endpoint, await endpoint.client.is_healthy_async())
+                continue
+
+            slot = self._acquire_slot(endpoint, prefix_key)
+            try:
+                return await endpoint.client.post_async(self._for_endpoint(inference_json, endpoint, slot), read_stream=read_stream)
+            except InferenceUnavailableError as e:
+                self._mark_down(endpoint, e)
+            finally:
+                self._release_slot(endpoint, slot)
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()
+
+    def write_summary(self):
+        for endpoint in self.endpoints:
+            endpoint.client.write_summary()
+        if self.pauses:
+            self.logger.write(f"Inference pauses: {self.pauses}")
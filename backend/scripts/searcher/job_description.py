@@ -1,5 +1,20 @@
+import hashlib
+
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
 class JobDescription:
-    def __init__(self, description: str, url: str, html_content: str = None):
+    """A job listed on a career page, with the text of its full description once fetched
+
+    Only the extracted text given to the model and a hash of the page are kept, the HTML is released right after
+    the extraction.
+    """
+
+    __slots__ = ["description", "url", "text_content", "content_hash"]
+
+    def __init__(self, description: str, url: str, text_content: str = None, content_hash: str = None):
         if description is None:
             raise ValueError("description cannot be null")
         if url is None:
@@ -11,4 +26,14 @@ class JobDescription:
 
         self.description = description
         self.url = url
-        self.html_content = html_content
+        self.text_content = text_content
+        self.content_hash = content_hash
+
+    @property
+    def fetched(self) -> bool:
+        return self.content_hash is not None
+
+    def set_content(self, html_content, text_extractor, max_characters=None):
+        """Keep the text of the page truncated to max_characters and the hash of the page, not the page itself"""
+        self.content_hash = hash_content(html_content)
+        self.text_content = text_extractor.get_text(html_content, max_characters)
@@ -1,160 +1,599 @@
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from urllib.parse import urlsplit
+import asyncio
 import os
+import threading
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
 from app.models import JobOpportunity, JobRole, Watchlist
 from .content_analyser import ContentAnalyser
 from .career_page import CareerPage
 from .job_description import JobDescription
+from .search_metrics import SearchMetrics
+from .host_scheduler import interleave_by_host
+
+# Opportunities written together, a career page listing more is saved in several statements.
+OPPORTUNITY_BATCH_SIZE = 100
 
 class JobSearcher:
     
-    def __init__(self, db, logger, score_threshold, max_opportunities, max_job_descriptions):
+    def __init__(self, db, logger, browser_pool, inference_client, score_threshold, max_opportunities, max_job_descriptions, title_batch_size=20, title_batch_mode="prompt", score_cache=None, incremental=False, http_fetcher=None, pre_filter=None, stream_inference=False, capture_analysis=False, text_extractor=None, html_store=None, archive=None, scheduler=None):
         self.db = db
         self.logger = logger
+        self.browser_pool = browser_pool
+        self.inference_client = inference_client
         self.score_threshold = score_threshold
         self.max_opportunities = max_opportunities
         self.max_job_descriptions = max_job_descriptions
+        self.title_batch_size = title_batch_size
+        self.title_batch_mode = title_batch_mode
+        self.score_cache = score_cache
+        self.incremental = incremental
+        self.http_fetcher = http_fetcher
+        self.pre_filter = pre_filter
+        self.stream_inference = stream_inference
+        self.capture_analysis = capture_analysis
+        self.text_extractor = text_extractor
+        self.html_store = html_store
+        self.archive = archive
+        self.scheduler = scheduler
+        # The calls to the database session from the threads of the async crawl are serialized, the score cache
+        # having its own session.
+        self.db_lock = threading.Lock()
+        self.metrics = SearchMetrics()
+        self.max_characters = int(os.environ.get("MAX_CHARACTERS_FOR_CAREER_PAGE_ANALYSIS", 6000))
+        self.content_analyser = self._create_content_analyser()
         self.job_descriptions = 0
         self.opportunities = 0
+        self.errors = 0
+        self.urls_total = 0
+        self.urls_done = 0
+        # The urls_total, urls_done, job_descriptions and opportunities of each role, for the sessions of the roles.
+        self.role_progress = defaultdict(Counter)
+        self.stopped = False
+
+        # Called with the searcher after each career page, to report the progress of the session.
+        self.on_progress = None
     
-    def save_opportunity(self, url, score, active_role_id) -> bool:
+    def save_opportunities(self, opportunities, job_role_id) -> set:
+        # Inserts the new opportunities and updates the last update of the existing ones, in a single statement and commit.
+        # opportunities is a list of (url, score), returns the urls of the new opportunities.
+        # A failed save is rolled back and raised, so that the entry is not marked as visited.
+
+        if not opportunities:
+            return set()
+
+        now = datetime.now()
+        rows = {}
+        for url, score in opportunities:
+            rows.setdefault(url, {"url": url, "job_role_id": job_role_id, "score": score, "status": "New", "last_update": now})
+
+        statement = insert(JobOpportunity).values(list(rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=[JobOpportunity.url, JobOpportunity.job_role_id],
+            set_={"last_update": statement.excluded.last_update}
+        ).returning(JobOpportunity.url, literal_column("xmax = 0"))
 
         try:
-            existing = self.db.query(JobOpportunity).filter(
-                JobOpportunity.url == url,
-                JobOpportunity.job_role_id == active_role_id
-            ).first()
-            
-            if existing:
-                existing.last_update = datetime.now()
+            # xmax is 0 for the rows inserted by the statement, set for the rows it updated.
+            with self.metrics.time("save"):
+                result = self.db.execute(statement).all()
+            with self.metrics.time("commit"):
                 self.db.commit()
-                return False
-            
-            new_opp = JobOpportunity(
-                url=url,
-                job_role_id=active_role_id,
-                score=score,
-                status="New",
-                last_update=datetime.now()
-            )
-            self.db.add(new_opp)
-            self.db.commit()
+            new_urls = {url for url, inserted in result if inserted}
+            self.metrics.increment("opportunities_saved", len(new_urls))
+            return new_urls
 
-            return True
-            
-        except Exception as e:
+        except Exception:
             self.db.rollback()
-            self.logger.write(f"Error saving opportunity: {str(e)}")
-            return False
-    
-    def check_watchlist(self, id_active_role):
+            self.metrics.increment("save_errors")
+            raise
+
+    def _flush_opportunities(self, opportunities, job_role_id):
+        # Saves the opportunities collected on a career page, returns the number of new and existing ones.
+
+        new_urls = self.save_opportunities(opportunities, job_role_id)
+        for url, score in opportunities:
+            if url in new_urls:
+                self.logger.write(f"    {url}: saved as an opportunity.", event="opportunity", url=url, score=score, job_role_id=job_role_id)
+            else:
+                self.logger.write(f"    {url}: already saved as an opportunity. Last visit updated.")
+        return len(new_urls), len(opportunities) - len(new_urls)
+
+    def _get_job_descriptions_to_score(self, job_descriptions) -> list[JobDescription]:
+        # The job descriptions that will be checked before reaching the max job descriptions cap.
+        if not self.max_job_descriptions:
+            return job_descriptions
+        return job_descriptions[:max(self.max_job_descriptions - 1 - self.job_descriptions, 0)]
+
+    def _get_changed_job_descriptions(self, entry, job_descriptions, fingerprint):
+        # Incremental mode: only the job descriptions new or changed since the last complete visit of the entry are checked.
+
+        if not self.incremental:
+            return job_descriptions
+
+        content_hash, job_fingerprints = fingerprint
+        if entry.content_hash == content_hash:
+            return []
+
+        previous_fingerprints = entry.job_fingerprints or {}
+        changed_job_descriptions = [
+            job_description for job_description in job_descriptions
+            if previous_fingerprints.get(job_description.url) != job_fingerprints[job_description.url]
+        ]
+        self.logger.write(f"  New or changed job descriptions since last visit: {len(changed_job_descriptions)} out of {len(job_descriptions)}.")
+        return changed_job_descriptions
+
+    def _get_unchanged_entries(self, career_page, entries) -> list:
+        # HTTP fast path: the server says the career page did not change since the last complete visit.
+        # A single probe is sent for all the roles watching the page, with the validators of one of their entries.
+        # It also collects the validators stored with this visit, so it is sent even on the first incremental visit.
+
+        if not self.incremental:
+            return []
+
+        reference = next((entry for entry in entries if entry.content_hash and (entry.etag or entry.last_modified)), entries[0])
+        if not career_page.is_unchanged(reference.etag, reference.last_modified):
+            return []
+
+        return [
+            entry for entry in entries
+            if entry.content_hash and entry.etag == reference.etag and entry.last_modified == reference.last_modified
+        ]
+
+    def _get_watchlist(self, role_ids, urls=None):
+        # The selected roles, and their watchlist entries grouped by URL so that each career page is crawled once for all of them.
+        # urls limits the search to some of the watchlist URLs, as for the tasks of the search workers.
+
+        roles = {role.id: role for role in self.db.query(JobRole).filter(JobRole.id.in_(role_ids)).all()}
+        for role_id in role_ids:
+            if role_id not in roles:
+                self.logger.write(f"Job role with id {role_id} not found. Skipped.")
+
+        query = self.db.query(Watchlist).filter(Watchlist.job_role_id.in_(list(roles)))
+        if urls:
+            query = query.filter(Watchlist.url.in_(urls))
+
+        watchlist = {}
+        for entry in query.all():
+            watchlist.setdefault(entry.url, []).append(entry)
+
+        # The career pages are crawled in round robin across their hosts, so that the pages of a same job board
+        # host are spread over the crawl instead of waiting for their turn one after the other.
+        watchlist = {url: watchlist[url] for url in interleave_by_host(watchlist)}
+
+        return roles, watchlist
+
+    def _mark_visited(self, entry, career_page, fingerprint=None):
+
+        entry.last_visit = datetime.now()
+        if self.incremental:
+            if fingerprint:
+                content_hash, job_fingerprints = fingerprint
+                # The jobs whose page could not be fetched are checked again on the next visit, as is the whole page.
+                if career_page.failed_urls:
+                    content_hash = None
+                    job_fingerprints = {url: job_fingerprint for url, job_fingerprint in job_fingerprints.items() if url not in career_page.failed_urls}
+                entry.content_hash, entry.job_fingerprints = content_hash, job_fingerprints
+            entry.etag = career_page.etag
+            entry.last_modified = career_page.last_modified
+        with self.metrics.time("commit"):
+            self.db.commit()
+
+    def _set_urls_total(self, watchlist):
+        self.urls_total = len(watchlist)
+        for entries in watchlist.values():
+            for entry in entries:
+                self.role_progress[entry.job_role_id]["urls_total"] += 1
+
+    def _report_progress(self, job_role_ids=None):
+        # job_role_ids are the roles watching the URL just done, None when no URL is done yet.
+        if job_role_ids is not None:
+            self.urls_done += 1
+            for job_role_id in job_role_ids:
+                self.role_progress[job_role_id]["urls_done"] += 1
+        if self.on_progress:
+            try:
+                self.on_progress(self)
+            except Exception as e:
+                self.logger.write(f"  Error reporting progress: {str(e)}")
+
+    def _create_content_analyser(self) -> ContentAnalyser:
+        return ContentAnalyser(self.logger, self.inference_client, model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"), max_characters_for_career_page_analysis=self.max_characters, score_cache=self.score_cache, stream=self.stream_inference, capture_analysis=self.capture_analysis,
+                               archive=self.archive, metrics=self.metrics)
+
+    def check_watchlist(self, role_ids, urls=None):
 
         self.logger.write("-" * 80)
         self.logger.write("Checking the Watchlist.")
 
-        # Fetch the active job role.
-        active_job_role = self.db.query(JobRole).filter(JobRole.id == id_active_role).first()
-        if not active_job_role:
-            self.logger.write(f"Active job role with id {id_active_role} not found. Stopping search.")
+        # Fetch the job roles and their watchlist entries.
+        roles, watchlist = self._get_watchlist(role_ids, urls)
+        if self.archive and self.archive.recording:
+            self.archive.record_watchlist(watchlist)
+        if not roles:
+            self.logger.write("No job role found. Stopping search.")
             return
 
-        # Fetch watchlist entries for the active role.
-        watchlist = self.db.query(Watchlist).filter(
-            Watchlist.job_role_id == id_active_role
-        ).all()
-        
         if not watchlist:
-            self.logger.write("Watchlist empty for this role. Stopping search.")
+            self.logger.write("Watchlist empty for these roles. Stopping search.")
             return
-        self.logger.write(f"Found {len(watchlist)} URLs in the Watchlist.")
-        
-        for entry in watchlist:
+        self.logger.write(f"Found {len(watchlist)} URLs in the Watchlist for {len(roles)} roles.")
+        self._set_urls_total(watchlist)
+        self._report_progress()
 
-            self.logger.write("")
-            self.logger.write(f"Checking: {entry.url} (last visit:{entry.last_visit}, page type:{entry.page_type}).")
+        for url, entries in watchlist.items():
+
+            job_role_ids = [entry.job_role_id for entry in entries]
+            page_type = next((entry.page_type for entry in entries if entry.page_type), None)
 
-            career_page = CareerPage(entry.url, entry.page_type, self.logger)
+            self.logger.write("")
+            self.logger.write(f"Checking: {url} (page type:{page_type}, roles: {', '.join(roles[entry.job_role_id].name for entry in entries)}).")
 
-            content_analyser = ContentAnalyser(self.logger, inference_url=os.environ.get("INFERENCE_URL"), timeout=int(os.environ.get("INFERENCE_TIMEOUT")), model_name=os.environ.get("MODEL_NAME_FOR_CAREER_PAGE"), max_characters_for_career_page_analysis=int(os.environ.get("MAX_CHARACTERS_FOR_CAREER_PAGE_ANALYSIS", 6000)))
+            career_page = CareerPage(url, page_type, self.logger, self.browser_pool, http_fetcher=self.http_fetcher,
+                                     text_extractor=self.text_extractor, max_characters=self.max_characters, html_store=self.html_store,
+                                     archive=self.archive, metrics=self.metrics, scheduler=self.scheduler)
 
             try:
 
-                job_descriptions = career_page.get_job_descriptions()
-
-#                 job_descriptions = []
-#                 job_descriptions.append(JobDescription(
-#                         description="Web Experience Manager",
-#                         url="https://jobs.ashbyhq.com/kong/a5386015-0a8a-4a12-9e5a-d021b4474d22")
-#                 )
-#                 job_descriptions.append(JobDescription(
-#                         description="Senior Program Manager, Security Engineering",
-#                         url="https://jobs.ashbyhq.com/kong/eba0b07d-752a-47c9-a585-71049677b55d")
-#                 )
-#                 job_descriptions.append(JobDescription(
-#                         description="GRC Program Manager",
-#                         url="https://jobs.ashbyhq.com/kong/fd577e37-cde8-46e7-806f-debc40eab30a")
-#                 )
-
-                opportunities_in_career_page = 0
-                opportunities_skipped_in_career_page = 0
-
-                for job_description in job_descriptions:
-
-                    self.logger.write(f"  Checking job description: {job_description.description}.")
-
-                    self.job_descriptions += 1
-                    if self.max_job_descriptions and self.job_descriptions >= self.max_job_descriptions:
-                        self.logger.write(f"")
-                        self.logger.write(f"Max job descriptions reached ({self.max_job_descriptions}). Stopping search.")
+                unchanged_entries = self._get_unchanged_entries(career_page, entries)
+                for entry in unchanged_entries:
+                    self.logger.write(f"  {roles[entry.job_role_id].name}: career page not modified since last visit. Skipping.")
+                    self._mark_visited(entry, career_page)
+                entries = [entry for entry in entries if entry not in unchanged_entries]
+                if not entries:
+                    continue
+
+                # The career page is crawled once, then scored for each role watching it.
+                with self.metrics.time("career_page"):
+                    job_descriptions = career_page.get_job_descriptions()
+                fingerprint = career_page.get_fingerprints(job_descriptions)
+
+                for entry in entries:
+                    self._check_entry(entry, roles[entry.job_role_id], career_page, job_descriptions, fingerprint)
+                    if self.stopped:
                         return
 
-                    # Get score based on the job description content only.
-                    score = content_analyser.get_score_for_job_name(job_description, active_job_role)
+            except Exception as e:
+                self.errors += 1
+                self.metrics.increment("errors")
+                self.logger.write(f"  Error processing {url}: {str(e)}")
+
+            finally:
+                if self.score_cache:
+                    self.score_cache.flush()
+                self._report_progress(job_role_ids)
+
+        self.logger.write("End of check for the Watchlist.")
+
+    def _check_entry(self, entry, active_job_role, career_page, job_descriptions, fingerprint):
+
+        self.logger.write(f"  Role: {active_job_role.name}.")
+
+        content_analyser = self.content_analyser
 
-                    self.logger.write(f"    Score based on job name: {score}.")
+        try:
+
+            job_descriptions = self._get_changed_job_descriptions(entry, job_descriptions, fingerprint)
+            if self.incremental and not job_descriptions:
+                self.logger.write("  No new or changed job descriptions since last visit. Skipping.")
+                self._mark_visited(entry, career_page, fingerprint)
+                return
+
+            # Drop the job descriptions far from the role before any inference call.
+            if self.pre_filter:
+                job_descriptions = self.pre_filter.filter(job_descriptions, active_job_role)
+
+            opportunities_in_career_page = 0
+            opportunities_skipped_in_career_page = 0
+            opportunities_to_save = []
 
-                    # Get score based on the full job description.
-                    if score >= self.score_threshold:
+            # Score all the job names of the page up front, in batches.
+            job_name_scores = content_analyser.get_scores_for_job_names(self._get_job_descriptions_to_score(job_descriptions), active_job_role, batch_size=self.title_batch_size, mode=self.title_batch_mode)
 
-                        # Fetch the full job description content.
-                        fetched = career_page.fetch(job_description)
-                        if not fetched:
-                            self.logger.write(f"    Failed to fetch full job description. Skipping")
-                            opportunities_skipped_in_career_page += 1
-                            continue
+            for index, job_description in enumerate(job_descriptions):
 
-                        score = content_analyser.get_score_for_full_job_description(job_description, active_job_role)
+                self.logger.write(f"  Checking job description: {job_description.description}.")
 
-                        self.logger.write(f"    Score based on full job description: {score}.")
+                self.job_descriptions += 1
+                self.role_progress[active_job_role.id]["job_descriptions"] += 1
+                if self.max_job_descriptions and self.job_descriptions >= self.max_job_descriptions:
+                    self._stop(f"Max job descriptions reached ({self.max_job_descriptions}). Stopping search.")
+                    break
 
-                    # Filtering based on the score threshold 
-                    if score >= self.score_threshold:
+                # Score based on the job description content only.
+                score = job_name_scores[index]
 
-                        self.opportunities += 1
-                        if self.max_opportunities and self.opportunities >= self.max_opportunities:
-                            self.logger.write(f"")
-                            self.logger.write(f"Max opportunities reached ({self.max_opportunities}). Stopping search.")
-                            return
+                self.logger.write(f"    Score based on job name: {score}.")
 
-                        saved = self.save_opportunity(job_description.url, score, id_active_role)
-                        if saved:
-                            opportunities_in_career_page += 1
-                            self.logger.write(f"    Job Description saved as an opportunity.")
-                        else:
-                            opportunities_skipped_in_career_page += 1
-                            self.logger.write(f"    Job Description already saved as an opportunity. Last visit updated.")
+                # Get score based on the full job description.
+                if score >= self.score_threshold:
 
-                    else:
+                    # Fetch the full job description content, once for all the roles.
+                    try:
+                        career_page.fetch(job_description)
+                    except Exception as e:
+                        self.logger.write(f"    Failed to fetch full job description ({str(e)}). Skipping")
                         opportunities_skipped_in_career_page += 1
-                        self.logger.write(f"    Job Description below threshold. Skipping.")
+                        continue
 
-                self.logger.write(f"  Job descriptions found: {len(job_descriptions)}.")
-                self.logger.write(f"  New opportunities found: {opportunities_in_career_page}.")
-                self.logger.write(f"  Opportunities still active: {opportunities_skipped_in_career_page}.")
+                    score = content_analyser.get_score_for_full_job_description(job_description, active_job_role)
 
-                entry.last_visit = datetime.now()
-                self.db.commit()
+                    self.logger.write(f"    Score based on full job description: {score}.")
+
+                # Filtering based on the score threshold
+                if score >= self.score_threshold:
+
+                    self.opportunities += 1
+                    self.role_progress[active_job_role.id]["opportunities"] += 1
+                    if self.max_opportunities and self.opportunities >= self.max_opportunities:
+                        self._stop(f"Max opportunities reached ({self.max_opportunities}). Stopping search.")
+                        break
+
+                    # Saved with the other opportunities of the page.
+                    opportunities_to_save.append((job_description.url, score))
+                    if len(opportunities_to_save) >= OPPORTUNITY_BATCH_SIZE:
+                        new_opportunities, existing_opportunities = self._flush_opportunities(opportunities_to_save, active_job_role.id)
+                        opportunities_in_career_page += new_opportunities
+                        opportunities_skipped_in_career_page += existing_opportunities
+                        opportunities_to_save = []
+
+                else:
+                    opportunities_skipped_in_career_page += 1
+                    self.logger.write("    Job Description below threshold. Skipping.")
+
+            new_opportunities, existing_opportunities = self._flush_opportunities(opportunities_to_save, active_job_role.id)
+            opportunities_in_career_page += new_opportunities
+            opportunities_skipped_in_career_page += existing_opportunities
+
+            # An entry interrupted by the max caps is not marked as visited.
+            if self.stopped:
+                return
+
+            self.logger.write(f"  Job descriptions found: {len(job_descriptions)}.")
+            self.logger.write(f"  New opportunities found: {opportunities_in_career_page}.")
+            self.logger.write(f"  Opportunities still active: {opportunities_skipped_in_career_page}.")
+
+            self._mark_visited(entry, career_page, fingerprint)
+
+        except Exception as e:
+            self.errors += 1
+            self.metrics.increment("errors")
+            self.logger.write(f"  Error processing {entry.url} for {active_job_role.name}: {str(e)}")
+
+    async def check_watchlist_async(self, role_ids, concurrency, per_host_concurrency, urls=None):
+        # Pipeline mode: career pages and job descriptions are crawled and scored concurrently.
+        # The browser pool must be an AsyncBrowserPool, it is closed at the end of the crawl.
+
+        self.logger.write("-" * 80)
+        self.logger.write(f"Checking the Watchlist (concurrency: {concurrency}, per host: {per_host_concurrency}).")
+
+        # Fetch the job roles and their watchlist entries.
+        roles, watchlist = self._get_watchlist(role_ids, urls)
+        if self.archive and self.archive.recording:
+            self.archive.record_watchlist(watchlist)
+        if not roles:
+            self.logger.write("No job role found. Stopping search.")
+            return
+
+        if not watchlist:
+            self.logger.write("Watchlist empty for these roles. Stopping search.")
+            return
+        self.logger.write(f"Found {len(watchlist)} URLs in the Watchlist for {len(roles)} roles.")
+        self._set_urls_total(watchlist)
+        self._report_progress()
+
+        self.global_slots = asyncio.Semaphore(concurrency)
+        self.per_host_concurrency = per_host_concurrency
+        self.host_slots = {}
+
+        # The commits run in threads, the roles and entries read by the crawl must not be reloaded from the event loop.
+        expire_on_commit = self.db.expire_on_commit
+        self.db.expire_on_commit = False
+
+        try:
+            results = await asyncio.gather(*[
+                self._check_url_async(url, entries, roles, self.content_analyser)
+                for url, entries in watchlist.items()
+            ], return_exceptions=True)
+            for url, result in zip(watchlist, results):
+                if isinstance(result, Exception):
+                    self.errors += 1
+                    self.metrics.increment("errors")
+                    self.logger.write(f"  Error processing {url}: {str(result)}")
+        finally:
+            self.db.expire_on_commit = expire_on_commit
+            await self.browser_pool.close()
+            await self.inference_client.aclose()
+            if self.http_fetcher:
+                await self.http_fetcher.aclose()
 
-            except Exception as e:
-                self.logger.write(f"  Error processing {entry.url}: {str(e)}")
-            
         self.logger.write("End of check for the Watchlist.")
+
+    def _host_slot(self, url) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self.host_slots[host]
+
+    async def _run_db(self, function, *args):
+        # The synchronous database calls run in a thread, so that they do not block the crawl.
+        def run():
+            with self.db_lock:
+                return function(*args)
+        return await asyncio.to_thread(run)
+
+    @asynccontextmanager
+    async def _fetch_slots(self, url):
+        # The turn of the host comes first, so that the crawl slots are not held by requests waiting on a slow host.
+        async with self._host_slot(url):
+            if self.scheduler:
+                await self.scheduler.wait_ready_async(url)
+            async with self.global_slots:
+                yield
+
+    async def _check_url_async(self, url, entries, roles, content_analyser):
+
+        if self.stopped:
+            return
+
+        job_role_ids = [entry.job_role_id for entry in entries]
+        page_type = next((entry.page_type for entry in entries if entry.page_type), None)
+        career_page = CareerPage(url, page_type, self.logger, self.browser_pool, http_fetcher=self.http_fetcher,
+                                 text_extractor=self.text_extractor, max_characters=self.max_characters, html_store=self.html_store,
+                                 archive=self.archive, metrics=self.metrics, scheduler=self.scheduler)
+
+        try:
+
+            async with self._fetch_slots(url):
+
+                unchanged_entries = await asyncio.to_thread(self._get_unchanged_entries, career_page, entries)
+                for entry in unchanged_entries:
+                    self.logger.write(f"Checked: {url} for {roles[entry.job_role_id].name}, not modified since last visit. Skipping.")
+                    await self._run_db(self._mark_visited, entry, career_page)
+                entries = [entry for entry in entries if entry not in unchanged_entries]
+                if not entries:
+                    return
+
+                # The career page is crawled once, then scored for each role watching it.
+                with self.metrics.time("career_page"):
+                    job_descriptions = await career_page.get_job_descriptions_async()
+
+            self.logger.write(f"Checked: {url} (page type:{page_type}), {len(job_descriptions)} job descriptions found.")
+
+            fingerprint = career_page.get_fingerprints(job_descriptions)
+
+            # The roles of a career page are scored one after the other, so that a job description is fetched only once.
+            for entry in entries:
+                await self._check_entry_async(entry, roles[entry.job_role_id], career_page, job_descriptions, fingerprint, content_analyser)
+                if self.stopped:
+                    return
+
+        except Exception as e:
+            self.errors += 1
+            self.metrics.increment("errors")
+            self.logger.write(f"  Error processing {url}: {str(e)}")
+
+        finally:
+            if self.score_cache:
+                await asyncio.to_thread(self.score_cache.flush)
+            await self._run_db(self._report_progress, job_role_ids)
+
+    async def _check_entry_async(self, entry, active_job_role, career_page, job_descriptions, fingerprint, content_analyser):
+
+        try:
+
+            job_descriptions = self._get_changed_job_descriptions(entry, job_descriptions, fingerprint)
+            if self.incremental and not job_descriptions:
+                self.logger.write(f"  {entry.url} for {active_job_role.name}: no new or changed job descriptions since last visit. Skipping.")
+                await self._run_db(self._mark_visited, entry, career_page, fingerprint)
+                return
+
+            # Drop the job descriptions far from the role before any inference call.
+            if self.pre_filter:
+                job_descriptions = self.pre_filter.filter(job_descriptions, active_job_role)
+
+            # Score all the job names of the page up front, in batches.
+            job_descriptions_to_score = self._get_job_descriptions_to_score(job_descriptions)
+            job_name_scores = await content_analyser.get_scores_for_job_names_async(job_descriptions_to_score, active_job_role, batch_size=self.title_batch_size, mode=self.title_batch_mode)
+            job_name_scores += [None] * (len(job_descriptions) - len(job_name_scores))
+
+            results = await asyncio.gather(*[
+                self._check_job_description_async(career_page, job_description, job_name_score, active_job_role, content_analyser)
+                for job_description, job_name_score in zip(job_descriptions, job_name_scores)
+            ], return_exceptions=True)
+
+            # A job description that failed is skipped, the others of the page are still saved.
+            for index, (job_description, result) in enumerate(zip(job_descriptions, results)):
+                if isinstance(result, Exception):
+                    self.errors += 1
+                    self.metrics.increment("errors")
+                    self.logger.write(f"  {job_description.description}: error while checking ({str(result)}). Skipping")
+                    results[index] = False
+
+            # The opportunities of the page are saved together, including those found before the max caps stopped the search.
+            opportunities_to_save = [result for result in results if result]
+            opportunities_in_career_page = 0
+            opportunities_skipped_in_career_page = results.count(False)
+            for index in range(0, len(opportunities_to_save), OPPORTUNITY_BATCH_SIZE):
+                new_opportunities, existing_opportunities = await self._run_db(self._flush_opportunities, opportunities_to_save[index:index + OPPORTUNITY_BATCH_SIZE], active_job_role.id)
+                opportunities_in_career_page += new_opportunities
+                opportunities_skipped_in_career_page += existing_opportunities
+
+            # An entry interrupted by the max caps is not marked as visited.
+            if self.stopped:
+                return
+
+            self.logger.write(f"  {entry.url} for {active_job_role.name}: job descriptions found: {len(job_descriptions)}, new opportunities found: {opportunities_in_career_page}, opportunities still active: {opportunities_skipped_in_career_page}.")
+
+            await self._run_db(self._mark_visited, entry, career_page, fingerprint)
+
+        except Exception as e:
+            self.errors += 1
+            self.metrics.increment("errors")
+            self.logger.write(f"  Error processing {entry.url} for {active_job_role.name}: {str(e)}")
+
+    async def _check_job_description_async(self, career_page, job_description, job_name_score, active_job_role, content_analyser):
+        # Returns the (url, score) of the opportunity to save, False when skipped and None when the search stopped.
+
+        # The crawl slot is released while the job description waits for the turn of its host.
+        async with self.global_slots:
+
+            if self.stopped:
+                return None
+
+            self.job_descriptions += 1
+            self.role_progress[active_job_role.id]["job_descriptions"] += 1
+            if self.max_job_descriptions and self.job_descriptions >= self.max_job_descriptions:
+                self._stop(f"Max job descriptions reached ({self.max_job_descriptions}). Stopping search.")
+                return None
+
+            # Score based on the job description content only, unless it was left out of the batch scoring.
+            score = job_name_score
+            if score is None:
+                score = await content_analyser.get_score_for_job_name_async(job_description, active_job_role)
+
+            self.logger.write(f"  {job_description.description}: score based on job name: {score}.")
+
+        # Get score based on the full job description.
+        if score >= self.score_threshold:
+
+            # Fetch the full job description content.
+            try:
+                async with self._fetch_slots(job_description.url):
+                    if self.stopped:
+                        return None
+                    await career_page.fetch_async(job_description)
+            except Exception as e:
+                self.logger.write(f"  {job_description.description}: failed to fetch full job description ({str(e)}). Skipping")
+                return False
+
+            async with self.global_slots:
+                score = await content_analyser.get_score_for_full_job_description_async(job_description, active_job_role)
+
+            self.logger.write(f"  {job_description.description}: score based on full job description: {score}.")
+
+        if self.stopped:
+            return None
+
+        # Filtering based on the score threshold 
+        if score < self.score_threshold:
+            self.logger.write(f"  {job_description.description}: below threshold. Skipping.")
+            return False
+
+        self.opportunities += 1
+        self.role_progress[active_job_role.id]["opportunities"] += 1
+        if self.max_opportunities and self.opportunities >= self.max_opportunities:
+            self._stop(f"Max opportunities reached ({self.max_opportunities}). Stopping search.")
+            return None
+
+        self.logger.write(f"  {job_description.description}: above threshold.")
+        return job_description.url, score
+
+    def _stop(self, message):
+        if not self.stopped:
+            self.stopped = True
+            self.logger.write("")
+            self.logger.write(message)
@@ -1,23 +1,147 @@
 """Logger class for writing to console and log file"""
 
+import atexit
+import gzip
+import json
+import queue
+import shutil
+import sys
+import threading
+import time
 from datetime import datetime
+from pathlib import Path
+
+# The records are written by a background thread, in batches of this size or at least this often.
+FLUSH_BYTES = 64 * 1024
+FLUSH_SECONDS = 1.0
+
+_STOP = object()
 
 
 class Logger:
-    """Handles logging to both console and file"""
-    
-    def __init__(self, log_path=None, verbose=False):
+    """Handles logging to both console and file, the writes being done by a background thread
+
+    Each record is written to the log file in the human format and, with json_lines, to a .jsonl file next to it.
+    """
+
+    def __init__(self, log_path=None, verbose=False, json_lines=True, flush_bytes=FLUSH_BYTES, flush_seconds=FLUSH_SECONDS):
         self.log_path = log_path
         self.verbose = verbose
+        self.json_lines = json_lines
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.log_file = None
+        self.json_file = None
+        self.records = queue.SimpleQueue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+        # The timestamp is formatted once per second.
+        self.timestamp_second = None
+        self.timestamp = None
+
+        atexit.register(self.close)
+
+    def create_file(self, mode='w'):
+        self.close()
+        self.log_file = open(self.log_path, mode)
+        if self.json_lines:
+            self.json_file = open(Path(self.log_path).with_suffix(".jsonl"), mode)
+
+    def close(self):
+        # Waits for the queued records to be written.
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer:
+            self.records.put(_STOP)
+            writer.join()
+
+        for log_file in [self.log_file, self.json_file]:
+            if log_file:
+                log_file.close()
         self.log_file = None
-    
-    def create_file(self):
-        self.log_file = open(self.log_path, 'w')
-
-    def write(self, message):
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_message = f"[{timestamp}] {message}"
-        print(log_message)
+        self.json_file = None
+
+    def write(self, message, **fields):
+        """Queue a record, the fields are only written to the JSON lines"""
+        if not self.writer:
+            self._start()
+        self.records.put((time.time(), message, fields))
+
+    def _start(self):
+        with self.lock:
+            if not self.writer:
+                self.writer = threading.Thread(target=self._write_records, name="logger", daemon=True)
+                self.writer.start()
+
+    def _format_timestamp(self, created) -> str:
+        second = int(created)
+        if second != self.timestamp_second:
+            self.timestamp_second = second
+            self.timestamp = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return self.timestamp
+
+    def _write_records(self):
+        lines = []
+        json_records = []
+        size = 0
+        last_flush = time.monotonic()
+
+        while True:
+
+            try:
+                record = self.records.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                record = None
+
+            if record is _STOP:
+                self._flush(lines, json_records)
+                return
+
+            if record:
+                created, message, fields = record
+                line = f"[{self._format_timestamp(created)}] {message}\n"
+                lines.append(line)
+                size += len(line)
+                if self.json_file:
+                    json_records.append(json.dumps({"time": datetime.fromtimestamp(created).isoformat(timespec="milliseconds"), "message": message, **fields}, default=str) + "\n")
+
+            if lines and (size >= self.flush_bytes or record is None or time.monotonic() - last_flush >= self.flush_seconds):
+                self._flush(lines, json_records)
+                lines = []
+                json_records = []
+                size = 0
+                last_flush = time.monotonic()
+
+    def _flush(self, lines, json_records):
+        if not lines:
+            return
+        text = "".join(lines)
+        sys.stdout.write(text)
+        sys.stdout.flush()
         if self.log_file:
-            self.log_file.write(log_message + "\n")
+            self.log_file.write(text)
             self.log_file.flush()
+        if self.json_file:
+            self.json_file.write("".join(json_records))
+            self.json_file.flush()
+
+
+def compress_old_logs(log_dir, older_than_days=1, open_log_paths=()) -> int:
+    """Gzip the session logs not written to for older_than_days, returns the number of files compressed
+
+    The logs of open_log_paths, those of the sessions not ended yet, are left as they are: a queued session is only
+    written to once a worker claims it, and the event streams of the API follow the plain log of a running session.
+    """
+
+    cutoff = time.time() - older_than_days * 86400
+    open_log_stems = {Path(log_path).stem for log_path in open_log_paths}
+    compressed = 0
+    for path in Path(log_dir).glob("search_session_*"):
+        if path.suffix not in [".log", ".jsonl"] or path.stem in open_log_stems or path.stat().st_mtime >= cutoff:
+            continue
+        with path.open("rb") as source, gzip.open(f"{path}.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        path.unlink()
+        compressed += 1
+    return compressed
@@ -0,0 +1,134 @@
+"""Page type adapters listing the jobs of a career page from the structured API of its ATS"""
+
+import asyncio
+import html
+from urllib.parse import urlsplit
+from app.page_types import PAGE_TYPES
+from .job_description import JobDescription
+
+
+class PageAdapter:
+    """Base class of the page type adapters, registered by name in PAGE_ADAPTERS"""
+
+    name = None
+    label = None
+
+    # When the API can't be used, the career page is rendered in the browser and its links are collected instead.
+    rendered_fallback = False
+
+    def get_api_url(self, url):
+        raise NotImplementedError
+
+    def parse(self, data, url) -> list[tuple]:
+        """The jobs of the API answer as (title, url, HTML content or None) tuples"""
+        raise NotImplementedError
+
+    def get_board_name(self, url):
+        # The board name is the first path segment of the career page url, e.g. https://jobs.ashbyhq.com/<board>.
+        path_segments = [segment for segment in urlsplit(url).path.split("/") if segment]
+        return path_segments[0] if path_segments else None
+
+    def get_job_descriptions(self, career_page):
+        """Return the job descriptions with their full content, or None when the API can't be used"""
+
+        api_url = self.get_api_url(career_page.url)
+        if not api_url:
+            career_page.logger.write(f"  No board name found in {career_page.url} for page type '{self.name}'")
+            return None
+
+        try:
+            return self._parse(career_page, career_page.get_json(api_url))
+        except Exception as e:
+            career_page.logger.write(f"  Error fetching {api_url}: {str(e)}")
+            return None
+
+    async def get_job_descriptions_async(self, career_page):
+        """Same as get_job_descriptions, without blocking the event loop"""
+
+        api_url = self.get_api_url(career_page.url)
+        if not api_url:
+            career_page.logger.write(f"  No board name found in {career_page.url} for page type '{self.name}'")
+            return None
+
+        try:
+            data = await career_page.get_json_async(api_url)
+            # The text of the jobs is extracted off the event loop.
+            return await asyncio.to_thread(self._parse, career_page, data)
+        except Exception as e:
+            career_page.logger.write(f"  Error fetching {api_url}: {str(e)}")
+            return None
+
+    def _parse(self, career_page, data) -> list[JobDescription]:
+        # The HTML content of each job is turned into its text as it is parsed, the API answer is released after.
+        with career_page.metrics.time("parse"):
+            jobs = self.parse(data, career_page.url)
+        job_descriptions = [career_page.create_job_description(*job) for job in jobs]
+        career_page.logger.write(f"  Extracted {len(job_descriptions)} job descriptions from the {self.label} API")
+        return job_descriptions
+
+
+class AshbyAdapter(PageAdapter):
+    """Ashby job boards, https://jobs.ashbyhq.com/<board>"""
+
+    name = "ashbyhq"
+    label = PAGE_TYPES[name]
+    rendered_fallback = True
+
+    def get_api_url(self, url):
+        board_name = self.get_board_name(url)
+        return f"https://api.ashbyhq.com/posting-api/job-board/{board_name}" if board_name else None
+
+    def parse(self, data, url) -> list[tuple]:
+        return [
+            (job["title"], job["jobUrl"], job.get("descriptionHtml"))
+            for job in data.get("jobs", [])
+            if job.get("isListed", True) and job.get("title") and job.get("jobUrl")
+        ]
+
+
+class GreenhouseAdapter(PageAdapter):
+    """Greenhouse job boards, https://boards.greenhouse.io/<board> or https://job-boards.greenhouse.io/<board>"""
+
+    name = "greenhouse"
+    label = PAGE_TYPES[name]
+
+    def get_api_url(self, url):
+        board_name = self.get_board_name(url)
+        return f"https://boards-api.greenhouse.io/v1/boards/{board_name}/jobs?content=true" if board_name else None
+
+    def parse(self, data, url) -> list[tuple]:
+        # The content of the job is escaped HTML.
+        return [
+            (job["title"], job["absolute_url"], html.unescape(job["content"]) if job.get("content") else None)
+            for job in data.get("jobs", [])
+            if job.get("title") and job.get("absolute_url")
+        ]
+
+
+class LeverAdapter(PageAdapter):
+    """Lever job boards, https://jobs.lever.co/<company>"""
+
+    name = "lever"
+    label = PAGE_TYPES[name]
+
+    def get_api_url(self, url):
+        company_name = self.get_board_name(url)
+        return f"https://api.lever.co/v0/postings/{company_name}?mode=json" if company_name else None
+
+    def parse(self, data, url) -> list[tuple]:
+        return [
+            (job["text"], job["hostedUrl"], self._get_html_content(job))
+            for job in data
+            if job.get("text") and job.get("hostedUrl")
+        ]
+
+    def _get_html_content(self, job):
+        # The description of a posting is split between an introduction, some titled lists and a closing part.
+        parts = [job.get("description") or ""]
+        for item in job.get("lists", []):
+            parts.append(f"<h3>{item.get('text', '')}</h3><ul>{item.get('content', '')}</ul>")
+        parts.append(job.get("additional") or "")
+        return "".join(parts) or None
+
+
+PAGE_ADAPTERS = {adapter.name: adapter for adapter in [AshbyAdapter(), GreenhouseAdapter(), LeverAdapter()]}
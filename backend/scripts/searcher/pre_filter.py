@@ -0,0 +1,120 @@
+"""PreFilter class for ranking job descriptions locally before any inference call"""
+
+import math
+import re
+from collections import Counter
+
+# Titles of the links found on most career pages that are never a job.
+NON_JOB_TITLES = {
+    "about", "about us", "apply", "benefits", "blog", "careers", "contact", "contact us", "cookie policy",
+    "cookie settings", "cookies", "home", "imprint", "jobs", "legal", "life at", "log in", "login",
+    "news", "open positions", "privacy", "privacy policy", "security", "sign in", "sign up", "terms",
+    "terms of service", "terms of use", "view all jobs",
+}
+
+MIN_TERM_LENGTH = 2
+
+# The job role name weighs more than the keywords of the CV in the role vector.
+ROLE_NAME_WEIGHT = 3
+MAX_CV_KEYWORDS = 20
+
+
+class PreFilter:
+    """Ranks job names against the job role and its CV keywords with a TF-IDF cosine similarity over character trigrams"""
+
+    def __init__(self, logger, cutoff=0.0, top_k=None):
+        self.logger = logger
+        self.cutoff = cutoff
+        self.top_k = top_k
+
+        self.role_terms = {}
+
+        # Counters reported at the end of the session.
+        self.checked = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _get_terms(text) -> Counter:
+        # Character trigrams of each word, padded so that short words and word boundaries count too.
+        terms = Counter()
+        for word in re.findall(r"[a-z0-9+#]+", text.lower()):
+            if len(word) < MIN_TERM_LENGTH:
+                continue
+            padded_word = f" {word} "
+            terms.update(padded_word[index:index + 3] for index in range(len(padded_word) - 2))
+        return terms
+
+    @staticmethod
+    def _get_vector(terms, idf) -> dict:
+        vector = {term: count * idf.get(term, 0.0) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def _get_role_terms(self, active_job_role) -> Counter:
+        # The role name and the keywords of its CV, computed once per role.
+
+        if active_job_role.id not in self.role_terms:
+            role_terms = Counter()
+            for term, count in self._get_terms(active_job_role.name).items():
+                role_terms[term] = count * ROLE_NAME_WEIGHT
+            cv_keywords = sorted((active_job_role.cv_keywords or {}).items(), key=lambda item: -item[1])[:MAX_CV_KEYWORDS]
+            role_terms.update(self._get_terms(" ".join(keyword for keyword, _ in cv_keywords)))
+            self.role_terms[active_job_role.id] = role_terms
+
+        return self.role_terms[active_job_role.id]
+
+    def get_scores(self, job_descriptions, role_terms) -> list[float]:
+        """Return a similarity between 0 and 1 for each job description, in the same order"""
+
+        documents = [self._get_terms(job_description.description) for job_description in job_descriptions]
+
+        # The inverse document frequency is computed over the job names of the page and the role.
+        document_frequency = Counter()
+        for terms in documents + [role_terms]:
+            document_frequency.update(terms.keys())
+        size = len(documents) + 1
+        idf = {term: math.log((1 + size) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+
+        role_vector = self._get_vector(role_terms, idf)
+
+        scores = []
+        for job_description, terms in zip(job_descriptions, documents):
+            if job_description.description.strip().lower() in NON_JOB_TITLES:
+                scores.append(0.0)
+                continue
+            vector = self._get_vector(terms, idf)
+            scores.append(sum(weight * role_vector.get(term, 0.0) for term, weight in vector.items()))
+        return scores
+
+    def filter(self, job_descriptions, active_job_role) -> list:
+        """Return the job descriptions above the cutoff, best first, at most top_k of them"""
+
+        if not job_descriptions:
+            return job_descriptions
+
+        scores = self.get_scores(job_descriptions, self._get_role_terms(active_job_role))
+        ranked = sorted(zip(scores, range(len(job_descriptions))), key=lambda item: (-item[0], item[1]))
+
+        kept_ranks = [(score, index) for score, index in ranked if score >= self.cutoff]
+        if self.top_k:
+            kept_ranks = kept_ranks[:self.top_k]
+        kept = [job_descriptions[index] for _, index in kept_ranks]
+        kept_indexes = {index for _, index in kept_ranks}
+        dropped_ranks = [(score, index) for score, index in ranked if index not in kept_indexes]
+
+        self.checked += len(job_descriptions)
+        self.dropped += len(dropped_ranks)
+
+        self.logger.write(f"  Pre-filter kept {len(kept)} out of {len(job_descriptions)} job descriptions.")
+
+        # The dropped job names are always logged with their similarity, to tune the cutoff.
+        for score, index in dropped_ranks:
+            self.logger.write(f"    Dropped by the pre-filter ({score:.3f}): {job_descriptions[index].description}")
+        if self.logger.verbose:
+            for score, index in kept_ranks:
+                self.logger.write(f"    Kept by the pre-filter ({score:.3f}): {job_descriptions[index].description}")
+
+        return kept
+
+    def write_summary(self):
+        self.logger.write(f"Pre-filter: {self.dropped} out of {self.checked} job names dropped before inference")
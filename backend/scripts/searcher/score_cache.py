@@ -0,0 +1,155 @@
+"""ScoreCache class for reusing inference scores across search sessions"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects.postgresql import insert
+from app.models import ScoreCacheEntry
+
+# Bump the version of a scoring type whenever its prompt template changes, so old scores are not reused.
+PROMPT_VERSIONS = {
+    "job_name": "2",
+    "job_name_batch": "1",
+    "full_job_description": "2",
+}
+
+
+class ScoreCache:
+    """Persistent score cache in Postgres, with an in-process LRU in front of it
+
+    db must be a session of its own, the cache committing and rolling back its writes while the searcher has
+    changes pending on its session. It is closed by close().
+    """
+
+    def __init__(self, db, logger, ttl_days=30, max_entries=100000, lru_size=10000, flush_size=50):
+        self.db = db
+        self.logger = logger
+        self.ttl = timedelta(days=ttl_days)
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self.flush_size = flush_size
+        self.lru = OrderedDict()
+        self.pending = {}
+        self.hit_keys = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(type, role_name, text, model_name) -> str:
+        normalized_text = " ".join(text.split()).lower()
+        key_parts = [type, PROMPT_VERSIONS[type], model_name or "", role_name, normalized_text]
+        return hashlib.sha256("\x1f".join(key_parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _as_utc(value):
+        # The timestamps are compared in UTC, a naive one coming from a database without time zones being UTC already.
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+    def _remember(self, key, score, created_at):
+        self.lru[key] = (score, created_at)
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached score, or None when missing or expired"""
+
+        with self.lock:
+            expires_before = datetime.now(timezone.utc) - self.ttl
+
+            cached = self.lru.get(key)
+            if cached and cached[1] >= expires_before:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                self.hit_keys.add(key)
+                return cached[0]
+
+            entry = self.db.query(ScoreCacheEntry).filter(ScoreCacheEntry.key == key).first()
+            if entry and self._as_utc(entry.created_at) >= expires_before:
+                self._remember(key, entry.score, self._as_utc(entry.created_at))
+                self.hits += 1
+                self.hit_keys.add(key)
+                return entry.score
+
+            self.misses += 1
+            return None
+
+    def put(self, key, score):
+        with self.lock:
+            now = datetime.now(timezone.utc)
+            self._remember(key, score, now)
+            self.pending[key] = score
+            if len(self.pending) >= self.flush_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending and not self.hit_keys:
+            return
+
+        now = datetime.now(timezone.utc)
+        try:
+            if self.pending:
+                statement = insert(ScoreCacheEntry).values([
+                    {"key": key, "score": score, "created_at": now, "last_hit": now}
+                    for key, score in self.pending.items()
+                ])
+                statement = statement.on_conflict_do_update(
+                    index_elements=[ScoreCacheEntry.key],
+                    set_={"score": statement.excluded.score, "created_at": now, "last_hit": now}
+                )
+                self.db.execute(statement)
+
+            # The last hit drives the size based eviction.
+            if self.hit_keys:
+                self.db.query(ScoreCacheEntry).filter(
+                    ScoreCacheEntry.key.in_(self.hit_keys)
+                ).update({ScoreCacheEntry.last_hit: now}, synchronize_session=False)
+
+            self.db.commit()
+
+        except Exception as e:
+            self.db.rollback()
+            self.logger.write(f"Error saving the score cache: {str(e)}")
+
+        self.pending = {}
+        self.hit_keys = set()
+
+    def prune(self):
+        """Evict expired entries, then the least recently hit ones beyond max_entries"""
+
+        with self.lock:
+            self._flush()
+            try:
+                expired = self.db.query(ScoreCacheEntry).filter(
+                    ScoreCacheEntry.created_at < datetime.now(timezone.utc) - self.ttl
+                ).delete(synchronize_session=False)
+
+                oldest_keys = self.db.query(ScoreCacheEntry.key).order_by(
+                    ScoreCacheEntry.last_hit.desc()
+                ).offset(self.max_entries)
+                evicted = self.db.query(ScoreCacheEntry).filter(
+                    ScoreCacheEntry.key.in_(oldest_keys.scalar_subquery())
+                ).delete(synchronize_session=False)
+
+                self.db.commit()
+
+                if self.logger.verbose:
+                    self.logger.write(f"Score cache pruned: {expired} expired, {evicted} evicted")
+
+            except Exception as e:
+                self.db.rollback()
+                self.logger.write(f"Error pruning the score cache: {str(e)}")
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
+    def write_summary(self):
+        self.logger.write(f"Score cache: {self.hits} hits, {self.misses} misses")
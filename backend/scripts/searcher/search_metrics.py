@@ -0,0 +1,119 @@
+"""SearchMetrics class recording the durations, counters and in-flight gauges of a search"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from app.search_metrics import HISTOGRAM_BUCKETS, get_bucket_index, get_series
+
+# Stages of a search: the job listing of a career page, the fetch of a page (its extraction included), the parsing
+# of a job listing, the extraction of a job description text, an inference call, the save of the opportunities of
+# a page and the commits of the visits.
+STAGES = ["career_page", "fetch", "parse", "extraction", "inference", "save", "commit"]
+
+# Durations sampled per stage for the percentiles, so that the memory of a long crawl stays bounded.
+RESERVOIR_SIZE = 2000
+
+
+class SearchMetrics:
+    """Durations of the stages of a search with their percentiles, counters and in-flight gauges
+
+    A uniform sample of at most RESERVOIR_SIZE durations is kept per stage for its percentiles, exact up to that many
+    runs. The durations are also counted in the histogram buckets of the summary stored on the search sessions and
+    exposed by the /metrics endpoint of the API.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.counts = {}
+        self.totals = {}
+        self.buckets = {}
+        self.counters = {}
+        self.gauges = {}
+        self.peaks = {}
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def in_flight(self, name):
+        self._add_in_flight(name, 1)
+        try:
+            yield
+        finally:
+            self._add_in_flight(name, -1)
+
+    def _add_in_flight(self, name, count):
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + count
+            self.peaks[name] = max(self.peaks.get(name, 0), self.gauges[name])
+
+    def record(self, stage, seconds):
+        with self.lock:
+            # Reservoir sampling, each duration of the stage having the same chance to be in the sample.
+            count = self.counts.get(stage, 0) + 1
+            self.counts[stage] = count
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            durations = self.durations.setdefault(stage, [])
+            if len(durations) < RESERVOIR_SIZE:
+                durations.append(seconds)
+            elif (index := random.randrange(count)) < RESERVOIR_SIZE:
+                durations[index] = seconds
+            self.buckets.setdefault(stage, [0] * (len(HISTOGRAM_BUCKETS) + 1))[get_bucket_index(seconds)] += 1
+
+    def increment(self, name, value=1, **labels):
+        series = get_series(name, labels)
+        with self.lock:
+            self.counters[series] = self.counters.get(series, 0) + value
+
+    def get_counter(self, name, **labels) -> int:
+        return self.counters.get(get_series(name, labels), 0)
+
+    def get_count(self, stage) -> int:
+        return self.counts.get(stage, 0)
+
+    def get_percentile(self, stage, percentile) -> float:
+        # Nearest rank percentile of the sample, 0 for a stage never run.
+        with self.lock:
+            durations = sorted(self.durations.get(stage, []))
+        if not durations:
+            return 0.0
+        return durations[min(len(durations) - 1, max(0, round(percentile / 100 * len(durations)) - 1))]
+
+    def get_total(self, stage) -> float:
+        with self.lock:
+            return self.totals.get(stage, 0.0)
+
+    def to_summary(self) -> dict:
+        """The summary stored on the search sessions, see app.search_metrics"""
+        histograms = {
+            stage: {
+                "buckets": list(self.buckets[stage]),
+                "sum": round(self.get_total(stage), 6),
+                "count": self.get_count(stage),
+                "p50": round(self.get_percentile(stage, 50), 6),
+                "p99": round(self.get_percentile(stage, 99), 6),
+            }
+            for stage in list(self.buckets)
+        }
+        with self.lock:
+            return {
+                "histograms": histograms,
+                "counters": dict(self.counters),
+                "gauges": {name: {"value": value, "max": self.peaks[name]} for name, value in self.gauges.items()},
+            }
+
+    def write_summary(self, logger):
+        for stage in STAGES:
+            if self.get_count(stage):
+                logger.write(f"Stage {stage}: {self.get_count(stage)} runs, {self.get_total(stage):.2f} seconds, p50 {self.get_percentile(stage, 50) * 1000:.1f} ms, p99 {self.get_percentile(stage, 99) * 1000:.1f} ms")
+        if self.counters:
+            logger.write(f"Counters: {', '.join(f'{series} {value}' for series, value in sorted(self.counters.items()))}")
+        if self.peaks:
+            logger.write(f"Peak in flight: {', '.join(f'{name} {peak}' for name, peak in sorted(self.peaks.items()))}")
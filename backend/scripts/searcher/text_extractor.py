@@ -0,0 +1,163 @@
+"""Text extractors turning the HTML of the pages into the text given to the model, registered by name in TEXT_EXTRACTORS"""
+
+import re
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup
+
+# Elements never part of the job description.
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "select", "dialog"]
+BOILERPLATE_ROLES = ["navigation", "banner", "contentinfo", "complementary", "dialog", "alertdialog", "search"]
+
+# Elements removed only around the content, outside the <main> or <article> element of the page or right under <body>.
+# Inside the content, a <header> holds the job title and its location, a <form> or a <button> the application.
+PAGE_LEVEL_TAGS = ["nav", "header", "footer", "aside", "form", "button"]
+CONTENT_XPATH = "//main|//article|//*[@role='main']"
+
+# Class or id of the cookie banners, menus and other blocks around the job description, matched on whole words of the
+# class names so that "social-links" matches and "social-impact" does not.
+BOILERPLATE_PATTERN = re.compile(r"(^|[-_\s])(cookies?|consent|gdpr|navbar|menu|breadcrumbs?|footer|sidebar|social-(links|icons|media|share)|share|sharing|newsletter|subscribe|popup|modal|related-jobs|similar-jobs)([-_\s]|$)", re.IGNORECASE)
+
+# Blocks whose text scores the element containing them, shorter ones are labels and buttons.
+CONTENT_BLOCK_TAGS = ["p", "li", "pre", "td", "dd", "blockquote", "h1", "h2", "h3", "h4"]
+MIN_BLOCK_CHARACTERS = 25
+
+# Main content shorter than this is not trusted, nor a best scored element holding less than this share of the page text.
+MIN_CONTENT_CHARACTERS = 200
+MIN_CONTENT_SHARE = 0.5
+
+# The best scored element is widened to its parent while the parent adds less than this share of text, e.g. the job title.
+MAX_WIDENING_SHARE = 0.2
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class TextExtractor:
+    """Base class of the text extractors, registered by name in TEXT_EXTRACTORS"""
+
+    name = None
+
+    def get_text(self, html_content, max_characters=None) -> str:
+        """The text of the page, at most max_characters long"""
+        raise NotImplementedError
+
+    def get_links(self, html_content) -> list[tuple[str, str]]:
+        """The href and the text of every link of the page"""
+        raise NotImplementedError
+
+
+class SoupTextExtractor(TextExtractor):
+    """BeautifulSoup with the pure Python parser, the text of the whole page"""
+
+    name = "html.parser"
+
+    def get_text(self, html_content, max_characters=None) -> str:
+        text_content = BeautifulSoup(html_content, "html.parser").get_text(separator=" ", strip=True)
+        return text_content[:max_characters]
+
+    def get_links(self, html_content) -> list[tuple[str, str]]:
+        soup = BeautifulSoup(html_content, "html.parser")
+        return [(anchor["href"], anchor.get_text(strip=True)) for anchor in soup.find_all("a", href=True)]
+
+
+class LxmlTextExtractor(TextExtractor):
+    """lxml parser, the text of the main content of the page once the boilerplate is removed
+
+    The main content is the <main> or <article> element of the page when it has one, otherwise the element holding
+    most of the paragraphs, so that the truncation keeps the requirements rather than the menus and cookie banners.
+    """
+
+    name = "lxml"
+
+    def __init__(self, main_content=True):
+        self.main_content = main_content
+
+    def _parse(self, html_content):
+        # Encoded first, lxml refuses strings that declare their encoding.
+        if not html_content or not html_content.strip():
+            return None
+        try:
+            return lxml.html.document_fromstring(html_content.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8"))
+        except etree.ParserError:
+            return None
+
+    def _get_element_text(self, element) -> str:
+        return WHITESPACE_PATTERN.sub(" ", " ".join(element.itertext())).strip()
+
+    def _remove_boilerplate(self, root):
+        etree.strip_elements(root, etree.Comment, *BOILERPLATE_TAGS, with_tail=False)
+
+        has_content = bool(root.xpath(CONTENT_XPATH))
+        for element in list(root.iter(*PAGE_LEVEL_TAGS)):
+            parent = element.getparent()
+            if parent is None or element.xpath(".//main|.//article"):
+                continue
+            outside_content = has_content and not element.xpath("ancestor::main|ancestor::article|ancestor::*[@role='main']")
+            if outside_content or parent.tag == "body":
+                element.drop_tree()
+
+        for element in root.xpath("//*[@role or @class or @id or @hidden or @aria-hidden]"):
+            if element.tag in ["html", "body", "main", "article"] or element.getparent() is None:
+                continue
+            if element.get("hidden") is not None or element.get("aria-hidden") == "true" or element.get("role") in BOILERPLATE_ROLES:
+                element.drop_tree()
+                continue
+            # A matching wrapper holding the job description itself is kept.
+            if BOILERPLATE_PATTERN.search(f"{element.get('class', '')} {element.get('id', '')}") and not element.xpath(".//main|.//article|.//h1"):
+                element.drop_tree()
+
+    def _get_main_content(self, root):
+        body = root.find("body")
+        if body is None:
+            body = root
+
+        candidates = root.xpath("//main|//article|//*[@role='main']")
+        if candidates:
+            main = max(candidates, key=lambda element: len(self._get_element_text(element)))
+            if len(self._get_element_text(main)) >= MIN_CONTENT_CHARACTERS:
+                return main
+
+        # Each block scores its parent, and its grandparent by half.
+        scores = {}
+        for block in root.iter(*CONTENT_BLOCK_TAGS):
+            length = len(self._get_element_text(block))
+            if length < MIN_BLOCK_CHARACTERS:
+                continue
+            parent = block.getparent()
+            if parent is not None:
+                scores[parent] = scores.get(parent, 0) + length
+                grandparent = parent.getparent()
+                if grandparent is not None:
+                    scores[grandparent] = scores.get(grandparent, 0) + length / 2
+
+        if scores:
+            best = max(scores, key=scores.get)
+            length = len(self._get_element_text(best))
+            while best is not body and best.getparent() is not None:
+                parent_length = len(self._get_element_text(best.getparent()))
+                if parent_length > (1 + MAX_WIDENING_SHARE) * length:
+                    break
+                best, length = best.getparent(), parent_length
+            if length >= MIN_CONTENT_SHARE * len(self._get_element_text(body)):
+                return best
+
+        return body
+
+    def get_text(self, html_content, max_characters=None) -> str:
+        root = self._parse(html_content)
+        if root is None:
+            return ""
+        if self.main_content:
+            self._remove_boilerplate(root)
+            root = self._get_main_content(root)
+        return self._get_element_text(root)[:max_characters]
+
+    def get_links(self, html_content) -> list[tuple[str, str]]:
+        root = self._parse(html_content)
+        if root is None:
+            return []
+        return [(anchor.get("href"), "".join(text.strip() for text in anchor.itertext())) for anchor in root.iter("a") if anchor.get("href")]
+
+
+TEXT_EXTRACTORS = {extractor.name: extractor for extractor in [LxmlTextExtractor(), SoupTextExtractor()]}
+DEFAULT_TEXT_EXTRACTOR = "lxml"
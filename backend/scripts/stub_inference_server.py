@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Stub Inference Server - Answers the chat completion requests of the searcher from a crawl archive, without a model.
+
+The answers recorded in the crawl archive are replayed as they were, the other requests get a deterministic score
+derived from the prompt. The latency of a model is simulated with a fixed delay per request and per token.
+
+Usage:
+    python scripts/stub_inference_server.py --archive archives/crawl --port 8090
+    python scripts/stub_inference_server.py --port 8090 --latency-ms 200 --token-ms 20
+"""
+
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import click
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from searcher.crawl_archive import CrawlArchive, INFERENCE
+from searcher.logger import Logger
+
+BATCH_LINE_PATTERN = re.compile(r"^\s*(\d+)\.\s", re.MULTILINE)
+
+
+def get_stub_content(inference_json) -> str:
+    # A score derived from the prompt, one line per job name for the batch prompts which end with "1. SCORE: ".
+    prompt = inference_json["messages"][-1]["content"]
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    if "Job Descriptions:\n" in prompt:
+        numbers = BATCH_LINE_PATTERN.findall(prompt.split("Job Descriptions:\n", 1)[1])
+        lines = [f"{digest[index % len(digest)] % 101}" if index == 0 else f"{number}. SCORE: {digest[index % len(digest)] % 101}" for index, number in enumerate(numbers or ["1"])]
+        return "\n".join(lines)
+    return f"{digest[0] % 101}\nAnalysis: stub answer"
+
+
+class StubInferenceServer:
+    """OpenAI compatible chat completion server replaying the inference answers of a crawl archive"""
+
+    def __init__(self, logger, archive=None, host="127.0.0.1", port=0, latency_ms=0, token_ms=0):
+        self.logger = logger
+        self.archive = archive
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.replayed_calls = 0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def get_content(self, inference_json) -> str:
+        answer = self.archive.get(INFERENCE, CrawlArchive.make_inference_key(inference_json)) if self.archive else None
+        with self.lock:
+            self.calls += 1
+            if answer is not None:
+                self.replayed_calls += 1
+        if answer is not None:
+            return answer.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return get_stub_content(inference_json)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                # The requests are counted, not logged.
+                pass
+
+            def do_GET(self):
+                self.send_response(200 if self.path == "/health" else 404)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"status": "ok"}')
+
+            def do_POST(self):
+                inference_json = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                content = server.get_content(inference_json)
+                tokens = content.split()
+                usage = {"prompt_tokens": sum(len(message["content"].split()) for message in inference_json["messages"]), "completion_tokens": len(tokens)}
+                time.sleep(server.latency_ms / 1000)
+
+                if not inference_json.get("stream"):
+                    time.sleep(len(tokens) * server.token_ms / 1000)
+                    body = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}], "usage": usage}).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                # One event per token, the client may stop reading as soon as it has the score.
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for index, token in enumerate(re.findall(r"\S+\s*", content)):
+                        time.sleep(server.token_ms / 1000)
+                        finish_reason = "stop" if index == len(tokens) - 1 else None
+                        event = {"choices": [{"delta": {"content": token}, "finish_reason": finish_reason}]}
+                        if finish_reason:
+                            event["usage"] = usage
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def write_summary(self):
+        self.logger.write(f"Stub inference server: {self.calls} calls, {self.replayed_calls} replayed from the crawl archive")
+
+
+@click.command()
+@click.option('--archive', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Crawl archive whose recorded inference answers are replayed (default: stub answers only)')
+@click.option('--host', default='127.0.0.1',
+              help='Address to listen on (default: 127.0.0.1)')
+@click.option('--port', '-p', default=8090, type=int,
+              help='Port to listen on (default: 8090)')
+@click.option('--latency-ms', default=0, type=int,
+              help='Delay before each answer, in milliseconds (default: 0)')
+@click.option('--token-ms', default=0, type=int,
+              help='Delay per generated token, in milliseconds (default: 0)')
+def stub_inference_server(archive, host, port, latency_ms, token_ms):
+
+    logger = Logger()
+    server = StubInferenceServer(logger, CrawlArchive(logger, archive) if archive else None, host=host, port=port, latency_ms=latency_ms, token_ms=token_ms)
+    logger.write(f"Stub inference server listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        server.write_summary()
+
+
+if __name__ == '__main__':
+    stub_inference_server()
@@ -203,6 +203,8 @@ function ModifyCareerPagePage() {
                     >
                       <option value="">Default</option>
                       <option value="ashbyhq">Ashbyhq</option>
+                      <option value="greenhouse">Greenhouse</option>
+                      <option value="lever">Lever</option>
                     </Select>
                   </FormControl>
 
@@ -39,6 +39,7 @@ function SearchSessionsPage() {
   const [error, setError] = useState('');
   const [sortOrder, setSortOrder] = useState('desc');
   const [deleteConfirm, setDeleteConfirm] = useState(null);
+  const [progress, setProgress] = useState({});
   const cancelRef = useRef();
 
   useEffect(() => {
@@ -46,6 +47,23 @@ function SearchSessionsPage() {
     loadSearchSessions();
   }, []);
 
+  // Follow the progress of the running sessions, the server pushes it until the session ends.
+  useEffect(() => {
+    const runningSessions = sessions.filter((session) => !session.end_datetime && [null, undefined, 'queued', 'running'].includes(session.status));
+    const eventSources = runningSessions.map((session) => {
+      const eventSource = new EventSource(`${process.env.REACT_APP_API_BASE_URL}/search-sessions/${session.id}/events?log=false`);
+      eventSource.addEventListener('progress', (event) => {
+        setProgress((previous) => ({ ...previous, [session.id]: JSON.parse(event.data) }));
+      });
+      eventSource.addEventListener('end', () => {
+        eventSource.close();
+        loadSearchSessions();
+      });
+      return eventSource;
+    });
+    return () => eventSources.forEach((eventSource) => eventSource.close());
+  }, [sessions]);
+
   const loadActiveRole = async () => {
     try {
       const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/opportunities/active-role`);
@@ -93,6 +111,12 @@ function SearchSessionsPage() {
     return logFilePath.split('/').pop();
   };
 
+  const formatProgress = (session) => {
+    const sessionProgress = progress[session.id] || session;
+    if (!sessionProgress.status) return 'N/A';
+    return `${sessionProgress.urls_done}/${sessionProgress.urls_total} pages, ${sessionProgress.job_descriptions_checked} job descriptions, ${sessionProgress.opportunities_found} opportunities`;
+  };
+
   const deleteSession = async () => {
     if (!deleteConfirm) return;
     
@@ -211,6 +235,7 @@ function SearchSessionsPage() {
                         <Th>Start Date/Time</Th>
                         <Th>End Date/Time</Th>
                         <Th isNumeric>Score Threshold</Th>
+                        <Th>Progress</Th>
                         <Th>Log File</Th>
                         <Th isNumeric>Actions</Th>
                       </Tr>
@@ -227,6 +252,9 @@ function SearchSessionsPage() {
                           <Td isNumeric fontWeight="600" color="gray.800">
                             {session.score_threshold}
                           </Td>
+                          <Td fontSize="sm" color="gray.700">
+                            {formatProgress(session)}
+                          </Td>
                           <Td fontSize="sm" color="gray.700">
                             {session.log_file_path ? (
                               <Link
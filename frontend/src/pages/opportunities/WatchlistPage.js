@@ -91,6 +91,8 @@ function WatchlistPage() {
   const formatPageType = (pageType) => {
     if (!pageType) return 'Default';
     if (pageType === 'ashbyhq') return 'Ashbyhq';
+    if (pageType === 'greenhouse') return 'Greenhouse';
+    if (pageType === 'lever') return 'Lever';
     return pageType;
   };
 